@@ -0,0 +1,198 @@
+import heapq
+
+INF = float('inf')
+
+
+class CSPF(object):
+    """
+    constrained shortest path first over TED. dijkstra on binary heaps,
+    links w/o enough residual bandwidth (capacity - reserved) are pruned.
+    cost of the path is the sum of te metrics of the links.
+
+    for the hot loop we are keeping flat per node lists of
+    (neighbour, link id, metric), rebuilt only when TED topology changes
+    (reservations are read directly from TED arrays)
+    """
+    def __init__(self, te_db):
+        self.ted = te_db
+        self._neighbours = None
+        self._topology_version = None
+
+    def neighbours(self):
+        """(outgoing, incoming) per node lists of (neighbour, link, metric)"""
+        te_db = self.ted
+        if self._topology_version != te_db.topology_version:
+            metric = te_db.metric
+            outgoing = [[(nbr, link, metric[link])
+                         for nbr, link in node_adj.items()]
+                        for node_adj in te_db.adj]
+            incoming = [list() for _ in outgoing]
+            for node, node_links in enumerate(outgoing):
+                for nbr, link, link_metric in node_links:
+                    incoming[nbr].append((node, link, link_metric))
+            self._neighbours = (outgoing, incoming)
+            self._topology_version = te_db.topology_version
+        return self._neighbours
+
+    def shortest_path(self, src, dst, bandwidth=0, excluded=None,
+                      own_links=None):
+        """
+        src and dst are node addresses. returns (cost, list of link ids)
+        or None if there is no path with enough bandwidth.
+        excluded is optional set of link ids which must not be used.
+        own_links is optional set of links where bandwidth is already
+        reserved by the lsp we are computing path for (reoptimization),
+        they are not checked for residual bandwidth
+
+        bidirectional search: we are growing trees from src (over outgoing
+        links) and from dst (over incoming links), always expanding the
+        side with cheaper top of the heap, and stop when sum of the tops
+        cant beat the best path through already met nodes. on average it
+        touches much smaller part of the graph than one sided dijkstra
+        """
+        te_db = self.ted
+        src_index = te_db.node_index(src)
+        dst_index = te_db.node_index(dst)
+        if src_index is None or dst_index is None:
+            return None
+        if src_index == dst_index:
+            return (0, [])
+        outgoing, incoming = self.neighbours()
+        capacity = te_db.capacity
+        reserved = te_db.reserved
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        node_count = len(outgoing)
+        dist_fwd = [INF] * node_count
+        dist_bwd = [INF] * node_count
+        dist_fwd[src_index] = 0
+        dist_bwd[dst_index] = 0
+        #node -> link we came from (fwd) or are going to (bwd)
+        via_fwd = dict()
+        via_bwd = dict()
+        heap_fwd = [(0, src_index)]
+        heap_bwd = [(0, dst_index)]
+        best = INF
+        meet = None
+        while heap_fwd and heap_bwd:
+            if heap_fwd[0][0] + heap_bwd[0][0] >= best:
+                break
+            if heap_fwd[0][0] <= heap_bwd[0][0]:
+                heap, dist, other_dist, via, adj = (heap_fwd, dist_fwd,
+                    dist_bwd, via_fwd, outgoing)
+            else:
+                heap, dist, other_dist, via, adj = (heap_bwd, dist_bwd,
+                    dist_fwd, via_bwd, incoming)
+            cost, node = heappop(heap)
+            if cost > dist[node]:
+                #stale heap entry, node was already reached cheaper
+                continue
+            for nbr, link, link_metric in adj[node]:
+                nbr_cost = cost + link_metric
+                if nbr_cost < dist[nbr]:
+                    if (bandwidth and
+                            capacity[link] - reserved[link] < bandwidth and
+                            not (own_links and link in own_links)):
+                        continue
+                    if excluded and link in excluded:
+                        continue
+                    dist[nbr] = nbr_cost
+                    via[nbr] = link
+                    heappush(heap, (nbr_cost, nbr))
+                    if nbr_cost + other_dist[nbr] < best:
+                        best = nbr_cost + other_dist[nbr]
+                        meet = nbr
+        if meet is None:
+            return None
+        links = list()
+        link_src = te_db.link_src
+        link_dst = te_db.link_dst
+        node = meet
+        while node != src_index:
+            link = via_fwd[node]
+            links.append(link)
+            node = link_src[link]
+        links.reverse()
+        node = meet
+        while node != dst_index:
+            link = via_bwd[node]
+            links.append(link)
+            node = link_dst[link]
+        return (best, links)
+
+    def shortest_path_tree(self, src, bandwidth=0):
+        """
+        shortest paths from src to all the nodes, for batches of requests
+        from the same headend. returns (dist, via) lists by node index,
+        via is the link we came to the node from (-1 for src and
+        unreachable nodes), or None if src is unknown. see tree_path
+        """
+        te_db = self.ted
+        src_index = te_db.node_index(src)
+        if src_index is None:
+            return None
+        outgoing = self.neighbours()[0]
+        capacity = te_db.capacity
+        reserved = te_db.reserved
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        node_count = len(outgoing)
+        dist = [INF] * node_count
+        via = [-1] * node_count
+        dist[src_index] = 0
+        heap = [(0, src_index)]
+        while heap:
+            cost, node = heappop(heap)
+            if cost > dist[node]:
+                continue
+            for nbr, link, link_metric in outgoing[node]:
+                nbr_cost = cost + link_metric
+                if nbr_cost < dist[nbr]:
+                    if bandwidth and capacity[link] - reserved[link] < bandwidth:
+                        continue
+                    dist[nbr] = nbr_cost
+                    via[nbr] = link
+                    heappush(heap, (nbr_cost, nbr))
+        return (dist, via)
+
+    def tree_path(self, tree, dst):
+        """(cost, list of link ids) to dst out of shortest_path_tree or None"""
+        dist, via = tree
+        dst_index = self.ted.node_index(dst)
+        if dst_index is None or dst_index >= len(dist):
+            return None
+        if dist[dst_index] == INF:
+            return None
+        links = list()
+        link_src = self.ted.link_src
+        node = dst_index
+        while via[node] != -1:
+            link = via[node]
+            links.append(link)
+            node = link_src[link]
+        links.reverse()
+        return (dist[dst_index], links)
+
+    def node_links(self, links):
+        """
+        all links touching transit nodes of the path (for node diverse
+        paths; headend and tailend are shared by definition)
+        """
+        te_db = self.ted
+        outgoing, incoming = self.neighbours()
+        result = set()
+        for link in links[:-1]:
+            node = te_db.link_dst[link]
+            result.update([nbr_link for nbr, nbr_link, _ in outgoing[node]])
+            result.update([nbr_link for nbr, nbr_link, _ in incoming[node]])
+        return result
+
+    def path_nodes(self, links):
+        """addresses of the nodes after headend along the links"""
+        nodes = self.ted.nodes
+        link_dst = self.ted.link_dst
+        return [nodes[link_dst[link]] for link in links]
+
+    def ero(self, links):
+        """strict ipv4 ero hops, in the form generate_ero_object expects"""
+        return [(0, addr, 32) for addr in self.path_nodes(links)]
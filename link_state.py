@@ -0,0 +1,183 @@
+"""
+link state accounting on top of numpy, for bulk and what-if analysis.
+
+TED keeps total reservation per link, which is all CSPF needs. here we
+are keeping reservations per (hold) priority in 2d array indexed by
+[priority, link id], so we could answer questions like "unreserved
+bandwidth at priority p" (capacity minus everything reserved by lsps with
+hold priority p or better, they could not be preempted by setup priority
+p) for all the links at once. updates are scatter-adds, bulk updates go
+in one numpy call for the whole batch.
+
+numpy is optional, LinkState raises ImportError w/o it.
+"""
+from itertools import chain
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PRIORITIES = 8
+
+
+class LinkState(object):
+    """
+    could be attached to TED (TED.lsp_listeners), then it follows
+    update_lsp/remove_lsp of TED. capacity is always read from TED
+    """
+    def __init__(self, te_db, size=1024):
+        if numpy is None:
+            raise ImportError('numpy is required for LinkState')
+        self.ted = te_db
+        self._by_prio = numpy.zeros((PRIORITIES, size))
+        #lsp key -> (tuple of link ids, bandwidth, priority)
+        self._lsps = dict()
+
+    def clear(self):
+        self._by_prio[:] = 0
+        self._lsps.clear()
+
+    def _ensure(self, link_count):
+        size = self._by_prio.shape[1]
+        if link_count <= size:
+            return
+        while size < link_count:
+            size *= 2
+        by_prio = numpy.zeros((PRIORITIES, size))
+        by_prio[:, :self._by_prio.shape[1]] = self._by_prio
+        self._by_prio = by_prio
+
+    def _scatter(self, links, bandwidth, priority, sign):
+        #list, tuple would be taken as index into several dimensions
+        numpy.add.at(self._by_prio[priority], list(links), sign * bandwidth)
+
+    def update_lsp(self, key, links, bandwidth, priority=0):
+        """adds lsp or moves it to the new links/bandwidth/priority"""
+        old = self._lsps.get(key)
+        if old is not None:
+            self._scatter(old[0], old[1], old[2], -1)
+        links = tuple(links)
+        if links:
+            self._ensure(max(links) + 1)
+        self._lsps[key] = (links, bandwidth, priority)
+        self._scatter(links, bandwidth, priority, 1)
+
+    def remove_lsp(self, key):
+        old = self._lsps.pop(key, None)
+        if old is None:
+            return False
+        self._scatter(old[0], old[1], old[2], -1)
+        return True
+
+    def update_lsps(self, lsps):
+        """
+        bulk version of update_lsp, lsps is iterable of
+        (key, links, bandwidth, priority). old reservations are released
+        and new ones added with one scatter-add for the whole batch
+        """
+        batch = list()
+        append = batch.append
+        known = self._lsps
+        for key, links, bandwidth, priority in lsps:
+            old = known.get(key)
+            if old is not None:
+                append((old[0], -old[1], old[2]))
+            entry = known[key] = (tuple(links), bandwidth, priority)
+            append(entry)
+        if not batch:
+            return
+        #everything is flattened in python once, per lsp numpy calls on
+        #a few hops would cost more than the python loop itself
+        links = numpy.fromiter(chain.from_iterable(
+            [entry[0] for entry in batch]), dtype=numpy.intp)
+        if not len(links):
+            return
+        self._ensure(int(links.max()) + 1)
+        lengths = numpy.array([len(entry[0]) for entry in batch],
+                              dtype=numpy.intp)
+        bandwidth = numpy.repeat(numpy.array([entry[1] for entry in batch],
+                                             dtype=numpy.float64), lengths)
+        priority = numpy.repeat(numpy.array([entry[2] for entry in batch],
+                                            dtype=numpy.intp), lengths)
+        #flat index into [priority, link] array
+        numpy.add.at(self._by_prio.reshape(-1),
+                     priority * self._by_prio.shape[1] + links, bandwidth)
+
+    def rebuild(self, lsps):
+        """
+        from scratch, lsps are (key, lsp) pairs already accounted in TED
+        (e.g. LSPStore.items())
+        """
+        self.clear()
+        self.update_lsps([(key, self.ted.lsp_links(key)[0] or (),
+                           lsp.bandwidth, lsp.hold_prio)
+                          for key, lsp in lsps])
+
+    def link_count(self):
+        return self.ted.link_count()
+
+    def capacity(self):
+        return numpy.array(self.ted.capacity, dtype=numpy.float64)
+
+    def reserved(self, priority=PRIORITIES-1):
+        """per link bandwidth reserved at priority or better"""
+        #TED learns links w/o any lsp on them (add_link, capacities), we
+        #grow only on lsp updates, so catch up with it before reading
+        link_count = self.link_count()
+        self._ensure(link_count)
+        return self._by_prio[:priority+1, :link_count].sum(axis=0)
+
+    def unreserved(self, priority=PRIORITIES-1):
+        """per link bandwidth available for setup priority"""
+        return self.capacity() - self.reserved(priority)
+
+    def utilization(self):
+        """reserved / capacity per link, 0 for links w/o known capacity"""
+        capacity = self.capacity()
+        reserved = self.reserved()
+        result = numpy.zeros(len(capacity))
+        known = numpy.isfinite(capacity) & (capacity > 0)
+        result[known] = reserved[known] / capacity[known]
+        return result
+
+    def most_utilized(self, count=10):
+        """list of (link id, utilization), most utilized first"""
+        utilization = self.utilization()
+        if count < len(utilization):
+            top = numpy.argpartition(-utilization, count)[:count]
+        else:
+            top = numpy.arange(len(utilization))
+        top = top[numpy.argsort(-utilization[top], kind='stable')]
+        return [(int(link), float(utilization[link])) for link in top]
+
+    def links_above(self, threshold):
+        """link ids with utilization above threshold (e.g. 0.8)"""
+        return numpy.nonzero(self.utilization() > threshold)[0]
+
+    def headroom(self, links, priority=PRIORITIES-1):
+        """
+        bandwidth which could be added along the path of links at setup
+        priority, inf for empty path
+        """
+        if not len(links):
+            return float('inf')
+        self._ensure(self.link_count())
+        links = numpy.array(links, dtype=numpy.intp)
+        capacity = numpy.array([self.ted.capacity[link] for link in links])
+        return float((capacity -
+                      self._by_prio[:priority+1, links].sum(axis=0)).min())
+
+    def headroom_paths(self, paths, priority=PRIORITIES-1):
+        """headroom for many candidate paths at once, array by path"""
+        result = numpy.full(len(paths), numpy.inf)
+        lengths = numpy.array([len(links) for links in paths],
+                              dtype=numpy.intp)
+        non_empty = lengths > 0
+        if not non_empty.any():
+            return result
+        links = numpy.fromiter(chain.from_iterable(paths), dtype=numpy.intp)
+        starts = numpy.concatenate(([0], numpy.cumsum(lengths[non_empty])[:-1]))
+        result[non_empty] = numpy.minimum.reduceat(
+            self.unreserved(priority)[links], starts)
+        return result
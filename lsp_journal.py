@@ -0,0 +1,474 @@
+"""
+persistent copy of LSPStore, so after restart we have the lsp db (and TED
+reservations) right away instead of waiting for all pccs to resync.
+
+directory with two files:
+    snapshot - compacted state, all lsps at some point in time
+    journal - changes since that snapshot, append only
+both are file header (magic, snapshot sequence number) followed by
+records: header (op, pcc, plsp_id, length) and serialized
+mpls_lsp_pb2.LSP of that length (empty for delete).
+journal belongs to the snapshot with the same sequence number, one with
+other number was already compacted into the snapshot and is ignored.
+
+lsps are serialized with our own struct based codec (encode_lsp,
+decode_lsp), which writes the same bytes as LSP.SerializeToString() of
+LSPRecord.to_pb() but doesnt need protobuf runtime (generated
+mpls_lsp_pb2 is for old py2 protobuf anyway) and decodes about 2x faster
+than pure python protobuf + from_pb. on load both files are mmaped and scanned by record
+headers first, only the last version of every live lsp is decoded.
+
+LSPStore changes are queued by listener (that is all the session loop is
+doing) and background thread writes them in batches every
+flush_interval, with fsync. so we could lose last flush_interval of
+changes on crash, pccs will report them again. when journal is bigger
+than snapshot (and compact_min), thread compacts it into new snapshot.
+"""
+import os
+import mmap
+import time
+import struct
+import logging
+import threading
+from collections import deque
+import lsp_store
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b'LSPJ'
+_file_hdr = struct.Struct('!4sI')
+#op, pcc, plsp_id, length of serialized LSP
+_record_hdr = struct.Struct('!BIII')
+_UPDATE = 1
+_DELETE = 2
+
+
+def _put_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(buf, pos):
+    byte = buf[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    result = byte & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = buf[pos]
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos + 1
+        shift += 7
+
+
+def _put_bytes(out, tag, data):
+    out.append(tag)
+    _put_varint(out, len(data))
+    out.extend(data)
+
+
+def _ip_bytes(addr):
+    return lsp_store.int2ip(addr).encode('ascii')
+
+
+def _ip_int(data):
+    octets = data.split(b'.')
+    return ((int(octets[0]) << 24) | (int(octets[1]) << 16) |
+            (int(octets[2]) << 8) | int(octets[3]))
+
+
+def _ero_subobject(addr, flags):
+    sub = bytearray((0x08, 1 if flags >> 8 else 0))
+    _put_bytes(sub, 0x12, _ip_bytes(addr))
+    sub.append(0x18)
+    _put_varint(sub, flags & 255)
+    out = bytearray()
+    _put_bytes(out, 0x22, sub)
+    return bytes(out)
+
+
+def _rro_subobject(addr, mask):
+    sub = bytearray()
+    _put_bytes(sub, 0x0a, _ip_bytes(addr))
+    sub.append(0x10)
+    _put_varint(sub, mask)
+    out = bytearray()
+    _put_bytes(out, 0x2a, sub)
+    return bytes(out)
+
+
+def encode_lsp(lsp, hops=None):
+    """
+    LSPRecord as serialized mpls_lsp_pb2.LSP (same bytes as to_pb).
+    hops is optional cache of encoded pcc address and ero/rro subobjects,
+    there are only so many routers, but each lsp has several of them
+    """
+    if hops is None:
+        hops = dict()
+    pcc = hops.get(lsp.pcc)
+    if pcc is None:
+        out = bytearray()
+        _put_bytes(out, 0x0a, _ip_bytes(lsp.pcc))
+        pcc = hops[lsp.pcc] = bytes(out)
+    out = bytearray(pcc)
+    sub = bytearray(b'\x08')
+    _put_varint(sub, lsp.plsp_id)
+    sub.extend((0x10, 1 if lsp.delegated else 0,
+                0x18, 1 if lsp.administrative else 0, 0x20))
+    _put_varint(sub, lsp.operational)
+    _put_bytes(out, 0x12, sub)
+    sub = bytearray(b'\x08')
+    _put_varint(sub, lsp.setup_prio)
+    sub.append(0x10)
+    _put_varint(sub, lsp.hold_prio)
+    sub.extend((0x18, 1 if lsp.local_protection else 0))
+    _put_bytes(out, 0x1a, sub)
+    #ero/rro are (address, flags) pairs, cache key is the pair as one int
+    #with ero and rro in different key ranges
+    ero = lsp.ero
+    for index in range(0, len(ero), 2):
+        hop_key = -((ero[index] << 10) | ero[index + 1]) - 1
+        hop = hops.get(hop_key)
+        if hop is None:
+            hop = hops[hop_key] = _ero_subobject(ero[index], ero[index + 1])
+        out.extend(hop)
+    rro = lsp.rro
+    for index in range(0, len(rro), 2):
+        hop_key = (rro[index] << 10) | rro[index + 1] | 1 << 42
+        hop = hops.get(hop_key)
+        if hop is None:
+            hop = hops[hop_key] = _rro_subobject(rro[index], rro[index + 1])
+        out.extend(hop)
+    out.append(0x30)
+    _put_varint(out, int(lsp.bandwidth))
+    return bytes(out)
+
+
+def _skip(buf, pos, tag):
+    """position after the value of field with tag"""
+    wire_type = tag & 7
+    if wire_type == 0:
+        return _get_varint(buf, pos)[1]
+    if wire_type == 2:
+        length, pos = _get_varint(buf, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    if wire_type == 1:
+        return pos + 8
+    raise ValueError('unsupported pb wire type %s' % (wire_type,))
+
+
+def _hop(buf, pos, sub_end, tag):
+    """(address, flags) of ero/rro subobject (flags as in LSPRecord)"""
+    loose = addr = mask = 0
+    addr_tag = 0x12 if tag == 0x22 else 0x0a
+    mask_tag = 0x18 if tag == 0x22 else 0x10
+    while pos < sub_end:
+        sub_tag = buf[pos]
+        if sub_tag == addr_tag:
+            length, pos = _get_varint(buf, pos + 1)
+            addr = _ip_int(bytes(buf[pos:pos + length]))
+            pos += length
+            continue
+        value, pos = _get_varint(buf, pos + 1)
+        if sub_tag == mask_tag:
+            mask = value
+        elif sub_tag == 0x08:
+            loose = value
+    return addr, (loose << 8) | mask
+
+
+def decode_lsp(data, key, hops=None):
+    """
+    serialized mpls_lsp_pb2.LSP as LSPRecord, key is (pcc, plsp_id).
+    hand inlined: all our tags and almost all values are one byte varints,
+    which are read directly, anything else goes through _get_varint/_skip.
+    hops is optional cache of raw ero/rro subobject -> (address, flags),
+    shared by many lsps
+    """
+    data = bytes(data)
+    buf = bytearray(data)
+    if hops is None:
+        hops = dict()
+    lsp = lsp_store.LSPRecord(key[0], key[1])
+    get_varint = _get_varint
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag = buf[pos]
+        if tag == 0x22 or tag == 0x2a:
+            #run of ero/rro subobjects, each of them is shorter than 128
+            path = lsp.ero if tag == 0x22 else lsp.rro
+            while pos < end and buf[pos] == tag:
+                sub_end = pos + 2 + buf[pos + 1]
+                raw = data[pos:sub_end]
+                hop = hops.get(raw)
+                if hop is None:
+                    hop = hops[raw] = _hop(buf, pos + 2, sub_end, tag)
+                path.extend(hop)
+                pos = sub_end
+            continue
+        if tag == 0x30:
+            lsp.bandwidth, pos = get_varint(buf, pos + 1)
+            continue
+        if tag & 7 != 2:
+            pos = _skip(buf, pos + 1, tag)
+            continue
+        length = buf[pos + 1]
+        pos += 2
+        if length >= 0x80:
+            length, pos = get_varint(buf, pos - 1)
+        sub_end = pos + length
+        if tag == 0x12 or tag == 0x1a:
+            #LSPObject and LSPAttributeObject, only varint fields
+            while pos < sub_end:
+                sub_tag = buf[pos]
+                value = buf[pos + 1]
+                pos += 2
+                if value >= 0x80:
+                    value, pos = get_varint(buf, pos - 1)
+                if tag == 0x12:
+                    if sub_tag == 0x10:
+                        lsp.delegated = value
+                    elif sub_tag == 0x18:
+                        lsp.administrative = value
+                    elif sub_tag == 0x20:
+                        lsp.operational = value
+                elif sub_tag == 0x08:
+                    lsp.setup_prio = value
+                elif sub_tag == 0x10:
+                    lsp.hold_prio = value
+                elif sub_tag == 0x18:
+                    lsp.local_protection = value
+        pos = sub_end
+    return lsp
+
+
+def _record(op, key, payload=b''):
+    return _record_hdr.pack(op, key[0], key[1], len(payload)) + payload
+
+
+class LSPJournal(object):
+    def __init__(self, path, flush_interval=0.1, compact_min=1<<20,
+                 fsync=True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_min = compact_min
+        self.fsync = fsync
+        self._snapshot_path = os.path.join(path, 'snapshot')
+        self._journal_path = os.path.join(path, 'journal')
+        self._seq = 0
+        #valid part of journal (w/o torn record at the end), from load
+        self._journal_end = None
+        self._loaded = False
+        self._journal = None
+        self._pending = deque()
+        #encoded addresses and hops for encode_lsp, used only by writer
+        self._hops = dict()
+        self._thread = None
+        self._stopped = False
+        self.stats = {'loaded': 0, 'written': 0, 'batches': 0,
+                      'compactions': 0, 'journal_bytes': 0,
+                      'snapshot_bytes': 0}
+
+    def _scan(self, path, live, seq=None):
+        """
+        adds records of the file to live (key -> payload location),
+        returns (mmap, sequence number, end of the last complete record)
+        or None if there is no such file (or it is for other snapshot)
+        """
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < _file_hdr.size:
+                    return None
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except IOError:
+            return None
+        magic, file_seq = _file_hdr.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            buf.close()
+            raise ValueError('%s is not lsp journal' % (path,))
+        if seq is not None and file_seq != seq:
+            buf.close()
+            return None
+        offset = _file_hdr.size
+        unpack_from = _record_hdr.unpack_from
+        hdr_size = _record_hdr.size
+        while offset + hdr_size <= size:
+            op, pcc, plsp_id, length = unpack_from(buf, offset)
+            end = offset + hdr_size + length
+            if end > size:
+                break
+            if op == _UPDATE:
+                live[(pcc, plsp_id)] = (buf, offset + hdr_size, end)
+            else:
+                live.pop((pcc, plsp_id), None)
+            offset = end
+        if offset != size:
+            log.warning('%s: incomplete record at %s, ignoring %s bytes',
+                        path, offset, size - offset)
+        return buf, file_seq, offset
+
+    def _live(self):
+        """(key -> payload location, list of mmaps to close)"""
+        live = dict()
+        maps = list()
+        self._seq = 0
+        self._journal_end = None
+        snapshot = self._scan(self._snapshot_path, live)
+        if snapshot is not None:
+            maps.append(snapshot[0])
+            self._seq = snapshot[1]
+            self.stats['snapshot_bytes'] = snapshot[2]
+        journal = self._scan(self._journal_path, live, self._seq)
+        if journal is not None:
+            maps.append(journal[0])
+            self._journal_end = journal[2]
+            self.stats['journal_bytes'] = journal[2]
+        return live, maps
+
+    def load(self, controller):
+        """
+        restores lsps into controller's lsp_dict and TED, must be done
+        before start (or they would be written again), returns number of
+        lsps
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        live, maps = self._live()
+        hops = dict()
+        lsps = list()
+        try:
+            for key, (buf, start, end) in live.items():
+                lsp = decode_lsp(buf[start:end], key, hops)
+                controller.lsp_dict.update(key, lsp)
+                lsps.append((key, lsp))
+            controller.ted.update_lsps(lsps)
+        finally:
+            for buf in maps:
+                buf.close()
+        self._loaded = True
+        self.stats['loaded'] = len(live)
+        return len(live)
+
+    def _open_journal(self):
+        """continues valid journal of the current snapshot or starts new"""
+        if self._journal_end is not None:
+            self._journal = open(self._journal_path, 'r+b')
+            self._journal.truncate(self._journal_end)
+            self._journal.seek(self._journal_end)
+            return
+        tmp_path = self._journal_path + '.tmp'
+        journal = open(tmp_path, 'wb')
+        journal.write(_file_hdr.pack(_MAGIC, self._seq))
+        journal.flush()
+        os.fsync(journal.fileno())
+        os.rename(tmp_path, self._journal_path)
+        self._journal = journal
+        self._journal_end = _file_hdr.size
+        self.stats['journal_bytes'] = self._journal_end
+
+    def start(self, lsp_dict, writer_thread=True):
+        """
+        follows changes of lsp_dict and starts writer thread (w/o it
+        flush and compact must be called by the user)
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        if not self._loaded:
+            #w/o load we still need sequence number and end of the journal
+            for buf in self._live()[1]:
+                buf.close()
+        self._open_journal()
+        lsp_dict.listeners.append(self)
+        if not writer_thread:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='lsp-journal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """writes everything what is queued and stops writer thread"""
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def lsp_updated(self, key, lsp):
+        self._pending.append((key, lsp))
+
+    def lsp_deleted(self, key):
+        self._pending.append((key, None))
+
+    def _run(self):
+        while not self._stopped:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if self.stats['journal_bytes'] > max(
+                        self.compact_min, self.stats['snapshot_bytes']):
+                    self.compact()
+            except Exception:
+                log.exception('writing lsp journal failed')
+        self.flush()
+
+    def flush(self):
+        """writes queued changes as one batch, in writer thread"""
+        pending = self._pending
+        records = list()
+        while pending:
+            key, lsp = pending.popleft()
+            if lsp is None:
+                records.append(_record(_DELETE, key))
+            else:
+                records.append(_record(_UPDATE, key,
+                                       encode_lsp(lsp, self._hops)))
+        if not records:
+            return
+        data = b''.join(records)
+        self._journal.write(data)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self.stats['written'] += len(records)
+        self.stats['batches'] += 1
+        self.stats['journal_bytes'] += len(data)
+
+    def compact(self):
+        """new snapshot out of current one and journal, in writer thread"""
+        start = time.time()
+        live, maps = self._live()
+        tmp_path = self._snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as snapshot:
+                snapshot.write(_file_hdr.pack(_MAGIC, self._seq + 1))
+                for key, (buf, start_offset, end) in live.items():
+                    snapshot.write(_record_hdr.pack(
+                        _UPDATE, key[0], key[1], end - start_offset))
+                    snapshot.write(buf[start_offset:end])
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+                size = snapshot.tell()
+        finally:
+            for buf in maps:
+                buf.close()
+        os.rename(tmp_path, self._snapshot_path)
+        #journal of the old snapshot is ignored from now on
+        self._seq += 1
+        self._journal.close()
+        self._journal_end = None
+        self._open_journal()
+        self.stats['snapshot_bytes'] = size
+        self.stats['compactions'] += 1
+        log.info('lsp journal compacted, %s lsps in %.3f s', len(live),
+                 time.time() - start)
@@ -0,0 +1,269 @@
+import socket
+import struct
+from array import array
+
+_ipv4_addr = struct.Struct("!I")
+
+
+def ip2int(addr):
+    return _ipv4_addr.unpack(socket.inet_aton(addr))[0]
+
+
+def int2ip(addr):
+    return socket.inet_ntoa(_ipv4_addr.pack(addr))
+
+
+class LSPRecord(object):
+    """
+    compact in-memory representation of LSP. addresses are ints, hops are
+    packed into array('I') as pairs:
+        ero: address, loose<<8 | prefix length
+        rro: address, prefix length
+    protobuf (mpls_lsp_pb2.LSP) is used only on the edges (northbound,
+    persistence), see to_pb/from_pb
+
+    path_key is digest of raw ero/rro subobjects the hops were decoded from
+    (set by TEController.report_to_lsps, None otherwise), so the next report
+    with the same path could take the hops w/o decoding them. it is a cache,
+    not a part of the lsp: not compared and not copied. hop arrays of the
+    stored lsps are shared with their next versions, they must be replaced,
+    never modified in place
+    """
+    _fields = ('pcc', 'plsp_id', 'delegated', 'administrative',
+               'operational', 'setup_prio', 'hold_prio',
+               'local_protection', 'bandwidth', 'ero', 'rro')
+    __slots__ = _fields + ('path_key',)
+
+    def __init__(self, pcc, plsp_id):
+        self.pcc = pcc
+        self.plsp_id = plsp_id
+        self.delegated = 0
+        self.administrative = 0
+        self.operational = 0
+        self.setup_prio = 0
+        self.hold_prio = 0
+        self.local_protection = 0
+        self.bandwidth = 0
+        self.ero = array('I')
+        self.rro = array('I')
+        self.path_key = None
+
+    def key(self):
+        return (self.pcc, self.plsp_id)
+
+    def copy(self):
+        record = LSPRecord(self.pcc, self.plsp_id)
+        for slot in self._fields[2:]:
+            setattr(record, slot, getattr(self, slot))
+        record.ero = array('I', self.ero)
+        record.rro = array('I', self.rro)
+        return record
+
+    def add_ero_hop(self, loose, addr, mask):
+        self.ero.extend((addr, (loose << 8) | mask))
+
+    def add_rro_hop(self, addr, mask):
+        self.rro.extend((addr, mask))
+
+    def ero_hops(self):
+        """list of (loose, address, prefix length)"""
+        ero = self.ero
+        return [(ero[i+1] >> 8, ero[i], ero[i+1] & 255)
+                for i in range(0, len(ero), 2)]
+
+    def rro_hops(self):
+        """list of (address, prefix length)"""
+        rro = self.rro
+        return [(rro[i], rro[i+1]) for i in range(0, len(rro), 2)]
+
+    def path(self):
+        """addresses of actual path from rro, signalled ero otherwise"""
+        hops = self.rro if self.rro else self.ero
+        return hops[0::2]
+
+    def __eq__(self, other):
+        if not isinstance(other, LSPRecord):
+            return False
+        for slot in self._fields:
+            value = getattr(self, slot)
+            other_value = getattr(other, slot)
+            #hop arrays are often shared, dont compare them hop by hop
+            if value is not other_value and value != other_value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LSPRecord(%s)' % (', '.join(
+            ['%s=%r' % (slot, getattr(self, slot))
+             for slot in self._fields]),)
+
+    def to_pb(self):
+        import mpls_lsp_pb2
+        lsp = mpls_lsp_pb2.LSP()
+        lsp.pcc_ip = int2ip(self.pcc)
+        lsp.lsp_obj.plsp_id = self.plsp_id
+        lsp.lsp_obj.delegated = bool(self.delegated)
+        lsp.lsp_obj.administrative = bool(self.administrative)
+        lsp.lsp_obj.operational = self.operational
+        lsp.lspa_obj.setup_prio = self.setup_prio
+        lsp.lspa_obj.hold_prio = self.hold_prio
+        lsp.lspa_obj.local_protection = bool(self.local_protection)
+        lsp.bandwidth = self.bandwidth
+        for loose, addr, mask in self.ero_hops():
+            ero = lsp.ero.add()
+            ero.loose = bool(loose)
+            ero.node_ip = int2ip(addr)
+            ero.node_mask = mask
+        for addr, mask in self.rro_hops():
+            rro = lsp.rro.add()
+            rro.node_ip = int2ip(addr)
+            rro.node_mask = mask
+        return lsp
+
+    @classmethod
+    def from_pb(cls, lsp):
+        record = cls(ip2int(lsp.pcc_ip), lsp.lsp_obj.plsp_id)
+        record.delegated = int(lsp.lsp_obj.delegated)
+        record.administrative = int(lsp.lsp_obj.administrative)
+        record.operational = lsp.lsp_obj.operational
+        record.setup_prio = lsp.lspa_obj.setup_prio
+        record.hold_prio = lsp.lspa_obj.hold_prio
+        record.local_protection = int(lsp.lspa_obj.local_protection)
+        record.bandwidth = lsp.bandwidth
+        for ero in lsp.ero:
+            record.add_ero_hop(int(ero.loose), ip2int(ero.node_ip),
+                               ero.node_mask)
+        for rro in lsp.rro:
+            record.add_rro_hop(ip2int(rro.node_ip), rro.node_mask)
+        return record
+
+
+class LSPStore(object):
+    """
+    LSP database of the controller. keyed the same way as old lsp_dict:
+    (pcc ip as int, plsp_id). besides primary dict we are keeping
+    secondary indexes, so questions like "all lsps of this pcc",
+    "all delegated lsps" or "lsps through router X" are answered in time
+    proportional to the size of the answer, not the size of the db:
+        pcc -> set of keys
+        delegated keys
+        node (ipv4 as int, from rro or ero if there is no rro) -> set of keys
+    indexes are kept consistent on every update and delete
+
+    listeners are notified about every change:
+        lsp_updated(key, lsp), lsp_deleted(key)
+    """
+    def __init__(self):
+        self.listeners = list()
+        self._lsps = dict()
+        self._by_pcc = dict()
+        self._delegated = set()
+        self._by_node = dict()
+
+    def __len__(self):
+        return len(self._lsps)
+
+    def __contains__(self, key):
+        return key in self._lsps
+
+    def __iter__(self):
+        return iter(self._lsps)
+
+    def __getitem__(self, key):
+        return self._lsps[key]
+
+    def __setitem__(self, key, lsp):
+        self.update(key, lsp)
+
+    def __delitem__(self, key):
+        if self.delete(key) is None:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self._lsps.get(key, default)
+
+    def keys(self):
+        return list(self._lsps.keys())
+
+    def items(self):
+        return list(self._lsps.items())
+
+    def lsp_hops(self, lsp):
+        """nodes traversed by lsp: actual path from rro, signalled ero otherwise"""
+        return set(lsp.path())
+
+    def lsp_delegated(self, lsp):
+        return lsp.delegated
+
+    def _add_to_index(self, index, index_key, key):
+        keys = index.get(index_key)
+        if keys is None:
+            keys = index[index_key] = set()
+        keys.add(key)
+
+    def _remove_from_index(self, index, index_key, key):
+        keys = index.get(index_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+    def update(self, key, lsp):
+        """inserts or replaces lsp, returns old version (or None)"""
+        old_lsp = self._lsps.get(key)
+        self._lsps[key] = lsp
+        if old_lsp is None:
+            self._add_to_index(self._by_pcc, key[0], key)
+            old_hops = set()
+        elif old_lsp.ero is lsp.ero and old_lsp.rro is lsp.rro:
+            #unchanged path reported again, hops are shared (see LSPRecord)
+            old_hops = None
+        else:
+            old_hops = self.lsp_hops(old_lsp)
+        if self.lsp_delegated(lsp):
+            self._delegated.add(key)
+        else:
+            self._delegated.discard(key)
+        if old_hops is not None:
+            new_hops = self.lsp_hops(lsp)
+            for node in old_hops - new_hops:
+                self._remove_from_index(self._by_node, node, key)
+            for node in new_hops - old_hops:
+                self._add_to_index(self._by_node, node, key)
+        for listener in self.listeners:
+            listener.lsp_updated(key, lsp)
+        return old_lsp
+
+    def delete(self, key):
+        """removes lsp, returns removed version (or None)"""
+        lsp = self._lsps.pop(key, None)
+        if lsp is None:
+            return None
+        self._remove_from_index(self._by_pcc, key[0], key)
+        self._delegated.discard(key)
+        for node in self.lsp_hops(lsp):
+            self._remove_from_index(self._by_node, node, key)
+        for listener in self.listeners:
+            listener.lsp_deleted(key)
+        return lsp
+
+    def delete_pcc(self, pcc):
+        """removes all lsps of the pcc, returns list of removed lsps"""
+        return [self.delete(key) for key in list(self._by_pcc.get(pcc, ()))]
+
+    def lsps_by_pcc(self, pcc):
+        return [self._lsps[key] for key in self._by_pcc.get(pcc, ())]
+
+    def delegated_lsps(self):
+        return [self._lsps[key] for key in self._delegated]
+
+    def lsps_via_node(self, node):
+        return [self._lsps[key] for key in self._by_node.get(node, ())]
+
+    def pccs(self):
+        return list(self._by_pcc.keys())
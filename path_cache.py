@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+
+class PathCache(object):
+    """
+    bounded LRU cache of path computation results, in front of CSPF.
+
+    key is built from parsed PCReq objects (END-POINTS, BANDWIDTH, LSPA,
+    METRIC, see request_key), so the same request from different PCCs or
+    after a flap is answered without running CSPF again. RP is not a part
+    of the key, request id is different every time.
+
+    entries are validated against TED on lookup instead of being purged
+    on every TED change:
+        NO-PATH is valid while TED generation is the same (generation is
+        incremented on every change which could make some path better or
+        feasible)
+        found path is valid while generation is the same and none of its
+        links lost residual bandwidth (TED link_version)
+    stale entries are dropped on lookup and counted as misses
+    """
+    def __init__(self, te_db, max_size=10000):
+        self.ted = te_db
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def request_key(self, request):
+        """request is one of TEController.pcreq_requests"""
+        return (request['endpoints'], request['bw'], request['lspa'],
+                tuple(request['metric']))
+
+    def get(self, key):
+        """cached result or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        generation, links, versions, result = entry
+        if not self._valid(generation, links, versions):
+            del self._entries[key]
+            self.stale += 1
+            self.misses += 1
+            return None
+        #move to the end, most recently used
+        del self._entries[key]
+        self._entries[key] = entry
+        self.hits += 1
+        return result
+
+    def _valid(self, generation, links, versions):
+        if generation != self.ted.generation:
+            return False
+        link_version = self.ted.link_version
+        for link, version in zip(links, versions):
+            if link_version[link] != version:
+                return False
+        return True
+
+    def put(self, key, result, links=()):
+        """links is empty for NO-PATH results"""
+        link_version = self.ted.link_version
+        entry = (self.ted.generation, tuple(links),
+                 tuple([link_version[link] for link in links]), result)
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'stale': self.stale, 'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""
+synthetic pcc load generator for scale testing of pce_controller.py
+(python 3.7+, asyncio).
+
+opens N sessions (each from its own 127.x.y.z address, so they are
+different pccs, see transport_bench), does Open handshake and sends the
+lsp db of the pcc in PCRpts, then keeps rerouting random lsps at churn
+rate for the duration of the test. every report of a delegated lsp with
+new path is answered by controller with PCUpd, time between them is
+report->update latency.
+
+controller keepalive interval is taken from its Open. if nothing came
+from controller for longer than that (plus slack for the 1 s ticks of its
+timer wheel), keepalive slipped: we report the number of sessions up when
+it happened first. with ramp sessions are opened gradually, so it is the
+session count at which controller cant keep up with its timers. loadgen
+itself is one process, so its own loop lag is reported too: if it is
+close to the slack, slips could be ours.
+
+usage: pcc_loadgen.py [--sessions 1000] [--ramp 100] [--lsps 100]
+                      [--delegated 0.5] [--hops 6] [--churn 1]
+                      [--duration 60] [--port 4189]
+"""
+import time
+import random
+import asyncio
+import argparse
+import pcep
+import pcep_replay
+import transport_bench
+
+#controller timers are ticking once per second, and its KA could wait for
+#the queued replies
+KA_SLACK = 2.0
+
+
+def update_plsp_ids(msg):
+    """plsp ids of lsp objects in PCUpd"""
+    plsp_ids = list()
+    offset = 4
+    while offset + 8 <= len(msg):
+        obj_class, obj_type, obj_len = pcep._common_obj_hdr.unpack_from(
+            msg, offset)
+        if obj_len < 4:
+            break
+        if obj_class == 32:
+            plsp_ids.append(pcep._lsp_obj.unpack_from(msg, offset+4)[0] >> 12)
+        offset += obj_len
+    return plsp_ids
+
+
+def percentiles(values):
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    return 'p50 %.1f p90 %.1f p99 %.1f max %.1f ms' % tuple(
+        [pcep_replay.percentile(values, fraction)*1e3
+         for fraction in (0.5, 0.9, 0.99)] + [values[-1]*1e3])
+
+
+class Stats(object):
+    def __init__(self):
+        self.sessions = 0
+        self.failed = 0
+        self.reports = 0
+        self.updates = 0
+        self.latencies = {'sync': list(), 'churn': list()}
+        self.slipped = 0
+        self.first_slip = None
+        self.max_gap = 0.0
+        self.max_lag = 0.0
+
+
+class PCCSession(object):
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.ctx = pcep.PCEP()
+        self.framer = pcep.PCEPFramer()
+        self.rnd = random.Random(index)
+        #plsp_id -> reroute generation of its path
+        self.generation = dict()
+        #plsp_id -> (time of report, phase), waiting for PCUpd
+        self.pending = dict()
+        self.ka_interval = None
+        self.last_rx = None
+        self.slipped = False
+        self.reader = None
+        self.writer = None
+
+    def path(self, plsp_id):
+        nodes = self.args.nodes
+        base = (self.index * 7919 + plsp_id * 104729 +
+                self.generation[plsp_id] * 613)
+        return [0x0a000000 + (base + hop * 31) % nodes
+                for hop in range(self.args.hops)]
+
+    def report(self, plsp_id, phase):
+        delegated = plsp_id <= self.args.lsps * self.args.delegated
+        if delegated:
+            self.pending[plsp_id] = (time.time(), phase)
+        self.stats.reports += 1
+        return pcep_replay.synth_pcrpt([pcep_replay.synth_lsp(
+            self.ctx, plsp_id, self.path(plsp_id), delegated=int(delegated))])
+
+    async def connect(self):
+        args = self.args
+        self.reader, self.writer = await asyncio.open_connection(
+            args.host, args.port,
+            local_addr=(transport_bench.session_addr(self.index), 0))
+        self.writer.write(self.ctx.generate_open_msg(args.keepalive))
+        while self.ka_interval is None:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError('closed during open')
+            for msg in self.framer.feed(data):
+                if pcep._common_hdr.unpack_from(msg)[1] == 1:
+                    self.ctx.parse_rcved_msg(msg)
+                    self.ka_interval = self.ctx._peer_ka_timer
+        self.last_rx = time.time()
+
+    async def receive(self):
+        stats = self.stats
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                return
+            now = time.time()
+            self.last_rx = now
+            for msg in self.framer.feed(data):
+                if pcep._common_hdr.unpack_from(msg)[1] != 11:
+                    continue
+                stats.updates += 1
+                for plsp_id in update_plsp_ids(msg):
+                    sent = self.pending.pop(plsp_id, None)
+                    if sent is not None:
+                        stats.latencies[sent[1]].append(now - sent[0])
+
+    async def keepalives(self):
+        while True:
+            await asyncio.sleep(self.args.keepalive)
+            self.writer.write(self.ctx.generate_ka_msg())
+
+    async def churn(self):
+        args = self.args
+        while True:
+            await asyncio.sleep(self.rnd.expovariate(args.churn))
+            plsp_id = self.rnd.randint(1, args.lsps)
+            self.generation[plsp_id] += 1
+            self.writer.write(self.report(plsp_id, 'churn'))
+
+    async def run(self):
+        args = self.args
+        try:
+            await self.connect()
+        except (OSError, ConnectionError):
+            self.stats.failed += 1
+            return
+        self.stats.sessions += 1
+        for plsp_id in range(1, args.lsps + 1):
+            self.generation[plsp_id] = 0
+        self.writer.write(b''.join([self.report(plsp_id, 'sync')
+                                    for plsp_id in range(1, args.lsps + 1)]))
+        tasks = [asyncio.ensure_future(self.keepalives())]
+        if args.churn:
+            tasks.append(asyncio.ensure_future(self.churn()))
+        try:
+            await self.receive()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.writer.close()
+
+    def check_keepalive(self, now):
+        if self.ka_interval is None or not self.ka_interval:
+            return
+        gap = now - self.last_rx
+        stats = self.stats
+        if gap > stats.max_gap:
+            stats.max_gap = gap
+        if not self.slipped and gap > self.ka_interval + KA_SLACK:
+            self.slipped = True
+            stats.slipped += 1
+            if stats.first_slip is None:
+                stats.first_slip = stats.sessions
+
+
+async def monitor(sessions, stats, interval=0.5):
+    """keepalive gaps of all sessions and our own loop lag"""
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - start - interval
+        if lag > stats.max_lag:
+            stats.max_lag = lag
+        now = time.time()
+        for session in sessions:
+            session.check_keepalive(now)
+
+
+async def run(args):
+    stats = Stats()
+    sessions = list()
+    tasks = list()
+    watcher = asyncio.ensure_future(monitor(sessions, stats))
+    start = time.time()
+    for index in range(args.sessions):
+        session = PCCSession(index, args, stats)
+        sessions.append(session)
+        tasks.append(asyncio.ensure_future(session.run()))
+        if args.ramp:
+            await asyncio.sleep(1.0 / args.ramp)
+    while stats.sessions + stats.failed < args.sessions:
+        await asyncio.sleep(0.01)
+    print('%s sessions up (%s failed) in %.1f s' % (
+        stats.sessions, stats.failed, time.time() - start))
+    sync_start = time.time()
+    while (sum([len(session.pending) for session in sessions]) and
+           time.time() - sync_start < args.duration):
+        await asyncio.sleep(0.01)
+    print('initial reports: %s lsps, %s delegated, all answered %.1f s '
+          'after the last session was up' % (
+              stats.sessions * args.lsps, len(stats.latencies['sync']),
+              time.time() - sync_start))
+    churn_start = time.time()
+    reports = stats.reports
+    updates = stats.updates
+    await asyncio.sleep(max(0, args.duration - (churn_start - start)))
+    elapsed = time.time() - churn_start
+    watcher.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats, elapsed, stats.reports - reports, stats.updates - updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pcc load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4189)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--ramp', type=float, default=0,
+                        help='sessions opened per second, 0 is all at once')
+    parser.add_argument('--lsps', type=int, default=100,
+                        help='lsps per pcc')
+    parser.add_argument('--delegated', type=float, default=0.5,
+                        help='part of lsps delegated to controller')
+    parser.add_argument('--hops', type=int, default=6,
+                        help='ERO/RRO length')
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help='nodes the paths are going through')
+    parser.add_argument('--churn', type=float, default=1,
+                        help='reroutes per second per pcc')
+    parser.add_argument('--keepalive', type=int, default=30,
+                        help='our keepalive interval, controller DeadTimer '
+                             'is 4 times that')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='seconds, from the start of the test')
+    args = parser.parse_args()
+    stats, elapsed, reports, updates = asyncio.run(run(args))
+    print('initial report->update latency: %s' % (
+        percentiles(stats.latencies['sync']),))
+    if elapsed > 0:
+        print('churn: %s reports (%.0f/s), %s updates (%.0f/s) in %.1f s' % (
+            reports, reports / elapsed, updates, updates / elapsed, elapsed))
+    print('churn report->update latency: %s' % (
+        percentiles(stats.latencies['churn']),))
+    print('keepalives: max gap %.1f s, slipped in %s sessions%s' % (
+        stats.max_gap, stats.slipped,
+        ', first with %s sessions up' % (stats.first_slip,)
+        if stats.first_slip is not None else ''))
+    print('loadgen max loop lag %.1f ms' % (stats.max_lag*1e3,))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+asyncio transport of the controller, alternative to gevent (python 3.7+).
+
+the same PCEP/TEController logic as pce_controller.pcc_handler, but driven
+by asyncio.BufferedProtocol: kernel copies data directly into per-session
+PCEPRecvBuffer and msgs are parsed in place. replies are queued per
+session and written once per received chunk; when transport's write
+buffer is over high watermark we stop reading from the pcc till it
+drains, so slow pcc cant make us buffer unbounded amount of replies.
+keepalives and DeadTimers of all the sessions are on one TimerWheel.
+with recorder (pcep_capture.CaptureWriter) received bytes are captured
+straight from the receive buffer.
+"""
+import os
+import asyncio
+import logging
+import pcep
+import pce_metrics
+import timer_wheel
+
+log = logging.getLogger(__name__)
+
+
+class PCEPSession(asyncio.BufferedProtocol):
+    """
+    one pcep session. send(data) could be called from anywhere (e.g. for
+    PCUpd from reoptimizer), it is the same interface as
+    pce_controller.SessionWriter's send for pce_controller.send_to_pcc
+    """
+    def __init__(self, server, sid):
+        self._server = server
+        self._sid = sid
+        self._recv_buf = pcep.PCEPRecvBuffer()
+        self._rx = None
+        self._out = list()
+        self._max_depth = 0
+        self._blocked = 0
+        self._flush_scheduled = False
+        self._paused = False
+        self._timers = None
+        self._loop = None
+        self.transport = None
+        self.peer = None
+        self.pcep_context = None
+
+    def connection_made(self, transport):
+        self._loop = asyncio.get_event_loop()
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.pcep_context = pcep.PCEP(open_sid=self._sid, peer=self.peer[0])
+        self.pcep_context.set_trace(
+            self.peer[0] in self._server.controller._traced_pccs)
+        self._server.sessions[self._sid] = self.pcep_context
+        if self._server.recorder is not None:
+            self._server.recorder.opened(self._sid, self.peer)
+        log.info('new session %s from %s', self._sid, self.peer)
+
+    def get_buffer(self, sizehint):
+        self._rx = self._recv_buf.get_buffer()
+        return self._rx
+
+    def buffer_updated(self, nbytes):
+        if self._server.recorder is not None:
+            self._server.recorder.data(self._sid, self._rx[:nbytes])
+        try:
+            msgs = self._recv_buf.feed(nbytes)
+            if self._timers is not None:
+                self._timers.received()
+            for msg in msgs:
+                if self._timers is None:
+                    #first msg in session must be open
+                    self._server.open_session(self.pcep_context, self,
+                                              self.peer[0], msg)
+                    self._timers = timer_wheel.SessionTimers(
+                        self._server.timers, self.pcep_context._ka_timer,
+                        self.pcep_context._peer_dead_timer, self._send_ka,
+                        self._expire)
+                    self._server.pcc_sessions[self.peer[0]] = (
+                        self.pcep_context, self)
+                    continue
+                self._server.handle_msg(self.pcep_context, self, self.peer,
+                                        msg, self._server.controller)
+        except pcep.MSG_ERRORS as e:
+            #the same as gevent's pcc_handler: replies to msgs before the
+            #broken one are still sent
+            log.warning('closing session %s: %r', self.peer, e)
+            self._flush()
+            self.transport.close()
+            return
+        self._flush()
+
+    def _send_ka(self):
+        self._server.send_keepalive(self.pcep_context, self, self.peer[0])
+
+    def _expire(self):
+        """DeadTimer expired: session is closed and lsps of the pcc deleted"""
+        log.warning('%s: DeadTimer expired, closing session', self.peer[0])
+        pcc_sessions = self._server.pcc_sessions
+        if pcc_sessions.get(self.peer[0], (None,))[0] is self.pcep_context:
+            del pcc_sessions[self.peer[0]]
+            log.info('%s: removed %s lsps', self.peer[0],
+                     self._server.controller.remove_pcc(self.peer[0]))
+        if self.transport is not None:
+            self.transport.abort()
+
+    def send(self, data, timeout=None, force=False):
+        """
+        queues data, it is written at the end of current recv batch.
+        we cant wait here as SessionWriter does, so when pcc is not reading
+        (writing is paused) msgs we are initiating (timeout is given) are
+        refused with False. replies are still queued, but reading from the
+        pcc is paused then, so there is at most one recv batch of them
+        """
+        if self._paused and timeout is not None and not force:
+            self._blocked += 1
+            return False
+        self._out.append(data)
+        if len(self._out) > self._max_depth:
+            self._max_depth = len(self._out)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+        return True
+
+    def queue_stats(self):
+        queued = sum([len(data) for data in self._out])
+        if self.transport is not None:
+            queued += self.transport.get_write_buffer_size()
+        return {'queued': queued, 'depth': len(self._out),
+                'max_depth': self._max_depth, 'blocked': self._blocked}
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if self._out and not self._paused and self.transport is not None:
+            if self._timers is not None:
+                self._timers.sent()
+            if len(self._out) == 1:
+                self.transport.write(self._out[0])
+            else:
+                self.transport.write(b''.join(self._out))
+            del self._out[:]
+
+    def pause_writing(self):
+        self._paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+        self.transport.resume_reading()
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self._server.sessions.pop(self._sid, None)
+        if self._server.recorder is not None:
+            self._server.recorder.closed(self._sid)
+        self._server.controller.session_closed(self.peer)
+        if self._server.pcc_sessions.get(self.peer[0], (None,))[0] is (
+                self.pcep_context):
+            del self._server.pcc_sessions[self.peer[0]]
+        if self._timers is not None:
+            self._timers.cancel()
+        self.transport = None
+        log.info('session %s from %s closed', self._sid, self.peer)
+
+
+class ControlSession(asyncio.Protocol):
+    """line protocol of pce_control.ControlServer on asyncio unix socket"""
+    def __init__(self, control):
+        self._control = control
+        self._buf = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        lines = (self._buf + data).split(b'\n')
+        self._buf = lines.pop()
+        for line in lines:
+            reply = self._control.execute(line.decode('utf-8'))
+            self.transport.write(('%s\n' % (reply,)).encode('utf-8'))
+
+
+class MetricsSession(asyncio.Protocol):
+    """http endpoint of pce_metrics, any request gets the metrics"""
+    def __init__(self, metrics):
+        self._metrics = metrics
+        self._buf = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buf += data
+        if b'\r\n\r\n' in self._buf:
+            self.transport.write(pce_metrics.http_response(
+                self._metrics.render()))
+            self.transport.close()
+
+
+def open_session(pcep_context, session, peer_ip, msg):
+    pcep_context.parse_rcved_msg(msg)
+    session.send(pcep_context.generate_open_msg(20))
+
+
+def send_keepalive(pcep_context, session, peer_ip):
+    session.send(pcep_context.generate_ka_msg(), force=True)
+
+
+class AsyncioServer(object):
+    """
+    sessions and pcc_sessions are the same registries gevent mode is using
+    (pce_controller.SESSIONS, PCC_SESSIONS), handle_msg is
+    pce_controller.handle_pcep_msg, timers is TimerWheel of the sessions,
+    recorder is optional pcep_capture.CaptureWriter. open_session and
+    send_keepalive are pce_controller's (with metrics) or plain ones above
+    """
+    def __init__(self, controller, sessions, pcc_sessions, handle_msg,
+                 timers=None, recorder=None, open_session=open_session,
+                 send_keepalive=send_keepalive):
+        self.controller = controller
+        self.sessions = sessions
+        self.pcc_sessions = pcc_sessions
+        self.handle_msg = handle_msg
+        self.open_session = open_session
+        self.send_keepalive = send_keepalive
+        if timers is None:
+            timers = timer_wheel.TimerWheel()
+        self.timers = timers
+        self.recorder = recorder
+        self._next_sid = 0
+
+    def _new_session(self):
+        session = PCEPSession(self, self._next_sid)
+        self._next_sid += 1
+        return session
+
+    async def _wave(self, reopt):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        sent = [0]
+        try:
+            for delay in reopt.wave(sent):
+                await asyncio.sleep(delay)
+        except Exception:
+            log.exception('reoptimization failed')
+            return
+        log.info('reoptimization: %s updates in %.3f s', sent[0],
+                 loop.time() - start)
+
+    async def _reoptimize(self, reopt):
+        while True:
+            await asyncio.sleep(reopt.interval)
+            await self._wave(reopt)
+
+    def reoptimize_now(self, reopt):
+        """for control socket, wave is running in background"""
+        asyncio.get_event_loop().create_task(self._wave(reopt))
+        return 'reoptimization started'
+
+    async def _run_timers(self):
+        while True:
+            await asyncio.sleep(self.timers.next_tick_in())
+            self.timers.advance()
+
+    async def start_services(self, control=None, reopt=None, metrics=None):
+        """
+        session timers, control socket, metrics endpoint (addr, port,
+        pce_metrics.Metrics) and reoptimization, on the current loop
+        """
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._run_timers())
+        if metrics is not None:
+            await loop.create_server(lambda: MetricsSession(metrics[2]),
+                                     metrics[0], metrics[1],
+                                     reuse_address=True)
+            log.info('metrics on http://%s:%s/metrics', metrics[0],
+                     metrics[1])
+        if control is not None:
+            if os.path.exists(control.path):
+                os.unlink(control.path)
+            await loop.create_unix_server(
+                lambda: ControlSession(control), control.path)
+            log.info('control socket: %s', control.path)
+        if reopt is not None:
+            loop.create_task(self._reoptimize(reopt))
+
+    async def add_socket(self, sock):
+        """session on already accepted socket (e.g. passed by pce_workers)"""
+        await asyncio.get_event_loop().connect_accepted_socket(
+            self._new_session, sock)
+
+    async def serve(self, addr, port, backlog, control=None, reopt=None,
+                    metrics=None):
+        loop = asyncio.get_event_loop()
+        server = await loop.create_server(self._new_session, addr, port,
+                                          backlog=backlog)
+        await self.start_services(control, reopt, metrics)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, addr, port, backlog, control=None, reopt=None,
+            metrics=None):
+        asyncio.run(self.serve(addr, port, backlog, control, reopt, metrics))
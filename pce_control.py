@@ -0,0 +1,62 @@
+"""
+local control socket of the controller (unix socket).
+
+line based protocol: client sends "<command> [args...]\n", we are
+replying with text output of the command. could be used with socat:
+    echo "trace 10.0.0.1 on" | socat - UNIX-CONNECT:/tmp/pce.sock
+"""
+import os
+import socket
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ControlServer(object):
+    def __init__(self, path):
+        self.path = path
+        self._commands = dict()
+        self.register('help', self._help, 'list of commands')
+
+    def register(self, name, handler, help_msg=''):
+        """handler is called with command args and returns reply string"""
+        self._commands[name] = (handler, help_msg)
+
+    def _help(self):
+        return '\n'.join(['%s: %s' % (name, self._commands[name][1])
+                          for name in sorted(self._commands)])
+
+    def execute(self, line):
+        args = line.split()
+        if not args:
+            return ''
+        if args[0] not in self._commands:
+            return 'unknown command: %s' % (args[0],)
+        try:
+            return self._commands[args[0]][0](*args[1:])
+        except Exception as e:
+            log.exception('control command failed: %s', line)
+            return 'error: %s' % (e,)
+
+    def _handle_client(self, sock):
+        try:
+            lines = sock.makefile('r')
+            for line in lines:
+                reply = self.execute(line)
+                sock.sendall(('%s\n' % (reply,)).encode('utf-8'))
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    def serve_forever(self, spawn):
+        """spawn is used to run each client, e.g. gevent.spawn"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        servsock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        servsock.bind(self.path)
+        servsock.listen(5)
+        log.info('control socket: %s', self.path)
+        while True:
+            client, _ = servsock.accept()
+            spawn(self._handle_client, client)
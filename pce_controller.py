@@ -1,51 +1,551 @@
 #!/usr/bin/python
-import gevent
 import socket
+import signal
+import argparse
+import logging
 import pcep
 import te_controller
+import pce_logging
+import pce_control
+import reoptimizer
+import lsp_store
+import lsp_journal
+import pcep_capture
+import pce_metrics
+import pce_profile
+import timer_wheel
 import time
-from gevent import monkey
-monkey.patch_socket()
+
+try:
+    import gevent
+    from gevent import monkey
+    from gevent.event import Event
+except ImportError:
+    #not needed for --transport asyncio
+    gevent = None
 
 
 SERVADDR='0.0.0.0'
 SERVPORT=4189
-MAXCLIENTS=10
+#listen backlog, pccs are reconnecting all at once after our restart
+MAXCLIENTS=128
+#pcep msg could be up to 64k, so read in big chunks
+RECV_CHUNK=65536
+#bytes queued for the pcc, when it is over producers are waiting
+MAX_QUEUED=1<<20
+#how long PCUpds we are initiating wait for congested session
+SEND_TIMEOUT=5
+#metrics http endpoint is local only
+METRICS_ADDR='127.0.0.1'
 
-def send_ka(pcep_context, sock):
-    while True:
-        sock.send(pcep_context.generate_ka_msg())
-        gevent.sleep(pcep_context._ka_timer)
+log = logging.getLogger('pce_controller')
+#sid -> pcep context of all active sessions
+SESSIONS = dict()
+#pcc ip -> (pcep context, socket), for msgs we are initiating (PCUpd)
+PCC_SESSIONS = dict()
+#keepalives and DeadTimers of all the sessions
+TIMERS = timer_wheel.TimerWheel()
+#msg counters and codec/controller latency histograms
+METRICS = pce_metrics.Metrics()
+#on-demand sampling and per pcc profiling, windows are on the wheel
+PROFILER = pce_profile.Profiler(TIMERS.schedule)
+
+class SessionWriter(object):
+    """
+    the only writer of the session's socket (gevent). send() queues msg
+    and writer greenlet sends everything queued so far with one sendall,
+    so msgs are never interleaved or cut short, and replies to the whole
+    recv chunk go in one syscall. when pcc is not reading and more than
+    max_queued bytes are waiting, send() blocks the producer till writer
+    drains the queue: pcc_handler stops reading from the pcc, PCUpds we
+    are initiating wait for timeout seconds and give up (send returns
+    False). force is for keepalives from the timer wheel, which must
+    never block
+    """
+    def __init__(self, sock, max_queued=MAX_QUEUED):
+        self.sock = sock
+        self.timers = None
+        self.max_queued = max_queued
+        self.queued = 0
+        self.max_depth = 0
+        self.blocked = 0
+        self._queue = list()
+        self._closed = False
+        self._ready = Event()
+        self._drained = Event()
+        self._drained.set()
+        self._writer = gevent.spawn(self._run)
+
+    def send(self, data, timeout=None, force=False):
+        if self.queued >= self.max_queued and not force:
+            self.blocked += 1
+            if not self._drained.wait(timeout):
+                return False
+        if self._closed:
+            return False
+        self._queue.append(data)
+        self.queued += len(data)
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+        if self.queued >= self.max_queued:
+            self._drained.clear()
+        self._ready.set()
+        return True
+
+    def queue_stats(self):
+        return {'queued': self.queued, 'depth': len(self._queue),
+                'max_depth': self.max_depth, 'blocked': self.blocked}
+
+    def _run(self):
+        while not self._closed:
+            self._ready.wait()
+            self._ready.clear()
+            queue = self._queue
+            if not queue:
+                continue
+            self._queue = list()
+            data = queue[0] if len(queue) == 1 else b''.join(queue)
+            try:
+                self.sock.sendall(data)
+            except socket.error as e:
+                log.info('write to %s failed: %s', self.sock, e)
+                self.shutdown()
+                return
+            if self.timers is not None:
+                self.timers.sent()
+            self.queued -= len(data)
+            if self.queued < self.max_queued:
+                self._drained.set()
+
+    def shutdown(self):
+        """wakes up everybody, pcc_handler's recv gets EOF or error"""
+        self._closed = True
+        self._ready.set()
+        self._drained.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def close(self):
+        self.shutdown()
+        self._writer.kill()
+        self.sock.close()
+
+def session_expired(controller, pcep_context, peer_ip, close):
+    """DeadTimer expired: session is closed and lsps of the pcc deleted"""
+    log.warning('%s: DeadTimer expired, closing session', peer_ip)
+    if PCC_SESSIONS.get(peer_ip, (None,))[0] is pcep_context:
+        del PCC_SESSIONS[peer_ip]
+        log.info('%s: removed %s lsps', peer_ip,
+                 controller.remove_pcc(peer_ip))
+    close()
 
-def pcc_handler(clsock,sid,controller):
-    pcep_context = pcep.PCEP(open_sid = sid)
-    print(clsock[1])
-    msg=clsock[0].recv(1000)
+def send_to_pcc(pcc_ip, result):
+    """sends msg generated out of result to the pcc, False if no session"""
+    session = PCC_SESSIONS.get(pcc_ip)
+    if session is None:
+        return False
+    pcep_context, sock = session
+    start = METRICS.clock()
+    msg = pcep_context.generate_pcep_msg(result)
+    msg_type = pcep._common_hdr.unpack_from(msg)[1]
+    METRICS.encode[msg_type].observe(METRICS.clock() - start)
+    if not sock.send(msg, SEND_TIMEOUT):
+        log.warning('%s: session is congested, msg dropped', pcc_ip)
+        return False
+    METRICS.sent(pcc_ip, msg_type, len(msg))
+    return True
+
+def handle_pcep_msg(pcep_context, sock, peer, msg, controller):
+    profiles = PROFILER.pccs
+    if profiles and peer[0] in profiles:
+        #w/o the send, it may block and switch to other sessions' greenlets
+        pcep_msg = PROFILER.runcall(peer[0], _handle_pcep_msg, pcep_context,
+                                    peer, msg, controller)
+    else:
+        pcep_msg = _handle_pcep_msg(pcep_context, peer, msg, controller)
+    if pcep_msg:
+        sock.send(pcep_msg)
+
+def _handle_pcep_msg(pcep_context, peer, msg, controller):
+    """parse, handle and encode, returns the reply (if any) to send"""
+    metrics = METRICS
+    clock = metrics.clock
+    msg_type = pcep._common_hdr.unpack_from(msg)[1]
+    start = clock()
+    parsed_msg = pcep_context.parse_rcved_msg(msg)
+    parsed = clock()
+    result = controller.handle_pce_message(peer,parsed_msg)
+    handled = clock()
+    metrics.parse[msg_type].observe(parsed - start)
+    metrics.handle[msg_type].observe(handled - parsed)
+    metrics.received(peer[0], msg_type, len(msg))
+    pcep_msg = None
+    if result:
+        pcep_msg = pcep_context.generate_pcep_msg(result)
+    if pcep_msg:
+        msg_type = pcep._common_hdr.unpack_from(pcep_msg)[1]
+        metrics.encode[msg_type].observe(clock() - handled)
+        metrics.sent(peer[0], msg_type, len(pcep_msg))
+    return pcep_msg
+
+def send_keepalive(pcep_context, sock, peer_ip):
+    """from the timer wheel, must never block"""
+    msg = pcep_context.generate_ka_msg()
+    METRICS.sent(peer_ip, 2, len(msg))
+    sock.send(msg, force=True)
+
+def open_session(pcep_context, sock, peer_ip, msg):
+    """first msg of the session, it must be open"""
+    METRICS.received(peer_ip, 1, len(msg))
     pcep_context.parse_rcved_msg(msg)
-    clsock[0].send(pcep_context.generate_open_msg(20))
-    ka_greenlet = gevent.spawn(send_ka,pcep_context,clsock[0])
-    while True: 
-        msg=clsock[0].recv(1000)
-        parsed_msg = pcep_context.parse_rcved_msg(msg)
-        result = controller.handle_pce_message(clsock[1],parsed_msg)
-        if result:
-            pcep_msg = pcep_context.generate_pcep_msg(result)
-        if pcep_msg:
-            clsock[0].send(pcep_msg)
-            pcep_msg = None
-        #time.sleep(100)
-    clsock[0].close()
+    reply = pcep_context.generate_open_msg(20)
+    METRICS.sent(peer_ip, 1, len(reply))
+    sock.send(reply)
 
-def main():
+def pcc_handler(clsock,sid,controller,recorder=None):
+    pcep_context = pcep.PCEP(open_sid = sid, peer = clsock[1][0])
+    pcep_context.set_trace(clsock[1][0] in controller._traced_pccs)
+    framer = pcep.PCEPFramer()
+    sock = SessionWriter(clsock[0])
+    log.info('new session %s from %s', sid, clsock[1])
+    SESSIONS[sid] = pcep_context
+    if recorder is not None:
+        recorder.opened(sid, clsock[1])
+    timers = None
+    try:
+        while True:
+            data = sock.sock.recv(RECV_CHUNK)
+            if not data:
+                break
+            if recorder is not None:
+                recorder.data(sid, data)
+            if timers is not None:
+                timers.received()
+            for msg in framer.feed(data):
+                if timers is None:
+                    open_session(pcep_context, sock, clsock[1][0], msg)
+                    timers = sock.timers = timer_wheel.SessionTimers(
+                        TIMERS, pcep_context._ka_timer,
+                        pcep_context._peer_dead_timer,
+                        lambda: send_keepalive(pcep_context, sock,
+                                               clsock[1][0]),
+                        lambda: session_expired(controller, pcep_context,
+                                                clsock[1][0], sock.shutdown))
+                    PCC_SESSIONS[clsock[1][0]] = (pcep_context, sock)
+                    continue
+                handle_pcep_msg(pcep_context, sock, clsock[1], msg, controller)
+    except pcep.MSG_ERRORS as e:
+        log.warning('closing session %s: %r', clsock[1], e)
+    except socket.error as e:
+        #also DeadTimer's shutdown, gevent cancels the recv
+        log.info('session %s: %s', clsock[1], e)
+    finally:
+        del SESSIONS[sid]
+        if recorder is not None:
+            recorder.closed(sid)
+        controller.session_closed(clsock[1])
+        if PCC_SESSIONS.get(clsock[1][0], (None,))[0] is pcep_context:
+            del PCC_SESSIONS[clsock[1][0]]
+        if timers is not None:
+            timers.cancel()
+        sock.close()
+        log.info('session %s from %s closed', sid, clsock[1])
+
+def register_control_commands(control, controller, reopt=None,
+                              reopt_now=None, journal=None):
+    def sessions():
+        return '\n'.join(['%s %s %s' % (sid, ctx._session, ctx._state)
+                          for sid, ctx in sorted(SESSIONS.items())])
+
+    def loglevel(name, level):
+        pce_logging.set_level('' if name == 'root' else name, level)
+        return 'ok'
+
+    def trace(pcc_ip, state):
+        enabled = state == 'on'
+        controller.set_trace(pcc_ip, enabled)
+        for ctx in SESSIONS.values():
+            if ctx._session == pcc_ip:
+                ctx.set_trace(enabled)
+        return 'ok'
+
+    def pathcache(*args):
+        if args and args[0] == 'clear':
+            controller.path_cache.clear()
+            return 'ok'
+        stats = controller.path_cache.stats()
+        return '\n'.join(['%s %s' % (name, stats[name])
+                          for name in sorted(stats)])
+
+    def reoptimize(*args):
+        if reopt is None:
+            return 'reoptimization is disabled'
+        if args and args[0] == 'now':
+            if reopt_now is not None:
+                return reopt_now()
+            return 'sent %s updates' % (reopt.run_once(),)
+        return '\n'.join(['%s %s' % (name, reopt.stats[name])
+                          for name in sorted(reopt.stats)])
+
+    def links(count='10'):
+        if controller.link_state is None:
+            return 'link state is disabled'
+        te_db = controller.ted
+        return '\n'.join(['%s -> %s %.3f' % (
+            lsp_store.int2ip(te_db.nodes[te_db.link_src[link]]),
+            lsp_store.int2ip(te_db.nodes[te_db.link_dst[link]]),
+            utilization) for link, utilization in
+            controller.link_state.most_utilized(int(count))])
+
+    def queues():
+        lines = list()
+        for pcc_ip, (ctx, sock) in sorted(PCC_SESSIONS.items()):
+            stats = sock.queue_stats()
+            lines.append('%s %s' % (pcc_ip, ' '.join(
+                ['%s %s' % (name, stats[name]) for name in sorted(stats)])))
+        return '\n'.join(lines)
+
+    def journal_stats():
+        if journal is None:
+            return 'lsp journal is disabled'
+        return '\n'.join(['%s %s' % (name, journal.stats[name])
+                          for name in sorted(journal.stats)])
+
+    def timers():
+        stats = dict(TIMERS.stats, pending=len(TIMERS), ticks=TIMERS.ticks)
+        return '\n'.join(['%s %s' % (name, stats[name])
+                          for name in sorted(stats)])
+
+    def metrics():
+        return METRICS.render().rstrip('\n')
+
+    def lsps():
+        lsp_dict = controller.lsp_dict
+        return 'lsps %s delegated %s pccs %s ted reservations %s' % (
+            len(lsp_dict), len(lsp_dict.delegated_lsps()),
+            len(lsp_dict.pccs()), len(controller.ted._lsp_links))
+
+    control.register('sessions', sessions, 'list of active pcep sessions')
+    control.register('lsps', lsps, 'size of lsp db')
+    control.register('profile', PROFILER.command, pce_profile.USAGE)
+    control.register('metrics', metrics,
+                     'counters and histograms, prometheus text format')
+    control.register('queues', queues,
+                     'output queue of sessions, bytes and msgs waiting')
+    control.register('journal', journal_stats, 'lsp journal counters')
+    control.register('timers', timers,
+                     'keepalive/DeadTimer wheel counters')
+    control.register('loglevel', loglevel, '<logger|root> <level>')
+    control.register('trace', trace, '<pcc ip> on|off per-object tracing')
+    control.register('pathcache', pathcache,
+                     '[clear] path cache hit/miss counters')
+    control.register('links', links, '[count] most utilized links')
+    control.register('reopt', reoptimize,
+                     '[now] reoptimization counters or run a wave now')
+
+def metrics_collector(controller):
+    """gauges computed from the controller state on scrape"""
+    def collect():
+        lsp_states = dict()
+        for key, lsp in controller.lsp_dict.items():
+            state = (bool(lsp.delegated), bool(lsp.operational))
+            lsp_states[state] = lsp_states.get(state, 0) + 1
+        queues = [(pcc_ip, sock.queue_stats())
+                  for pcc_ip, (ctx, sock) in sorted(PCC_SESSIONS.items())]
+        return [
+            ('pce_sessions', 'gauge', 'pcep sessions up',
+             [(dict(), len(PCC_SESSIONS))]),
+            ('pce_lsps', 'gauge', 'lsps by state',
+             [({'delegated': str(delegated).lower(),
+                'operational': 'up' if operational else 'down'}, count)
+              for (delegated, operational), count in
+              sorted(lsp_states.items())]),
+            ('pce_send_queue_bytes', 'gauge', 'bytes waiting for the pcc',
+             [({'pcc': pcc_ip}, stats['queued']) for pcc_ip, stats in queues]),
+            ('pce_send_queue_msgs', 'gauge', 'msgs waiting for the pcc',
+             [({'pcc': pcc_ip}, stats['depth']) for pcc_ip, stats in queues]),
+            ('pce_send_blocked_total', 'counter',
+             'sends which waited for (or were refused by) full queue',
+             [({'pcc': pcc_ip}, stats['blocked'])
+              for pcc_ip, stats in queues])]
+    return collect
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='stateful pce controller')
+    parser.add_argument('--transport', choices=('gevent', 'asyncio'),
+                        default='gevent',
+                        help='event loop of the server, asyncio needs '
+                             'python 3.7+')
+    parser.add_argument('--port', type=int, default=SERVPORT)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes, sessions are '
+                             'sharded between them by pcc address '
+                             '(asyncio transport)')
+    parser.add_argument('--log-levels', default='info',
+                        help='root and per-module log levels, '
+                             'e.g. info,pcep=debug')
+    parser.add_argument('--control-socket',
+                        help='path of the unix control socket')
+    parser.add_argument('--path-cache-size', type=int, default=10000,
+                        help='max number of cached path computation results')
+    parser.add_argument('--state-dir',
+                        help='directory for lsp db snapshot and journal, '
+                             'lsps are restored from it on start')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='local http port of prometheus metrics, '
+                             '+N per worker, 0 disables it')
+    parser.add_argument('--profile-dir',
+                        help='where profiles are written (profile control '
+                             'command, SIGUSR1), default is temp dir')
+    parser.add_argument('--record',
+                        help='capture file for received byte streams of '
+                             'all sessions, see pcep_replay.py (.N suffix '
+                             'per worker)')
+    parser.add_argument('--link-state', action='store_true',
+                        help='per priority link accounting (needs numpy)')
+    parser.add_argument('--reopt-interval', type=float, default=0,
+                        help='seconds between reoptimizations of delegated '
+                             'lsps, 0 disables it')
+    parser.add_argument('--reopt-threshold', type=float, default=0.1,
+                        help='min relative improvement of path cost')
+    parser.add_argument('--reopt-pcc-rate', type=float, default=10,
+                        help='max PCUpds per second to one pcc')
+    parser.add_argument('--reopt-rate', type=float, default=100,
+                        help='max PCUpds per second overall')
+    return parser.parse_args()
+
+def profile_on_signal():
+    """SIGUSR1: sampling profiler for 30 s, in the process getting it"""
+    signal.signal(signal.SIGUSR1,
+                  lambda signum, frame: PROFILER.start_sampling())
+    signal.siginterrupt(signal.SIGUSR1, False)
+
+def serve_gevent(args, controller, control, reopt, journal, recorder):
+    monkey.patch_socket()
+    profile_on_signal()
     CURRENT_SID = 0
-    controller = te_controller.TEController()
+    gevent.spawn(TIMERS.run_forever, gevent.sleep)
+    if journal is not None:
+        journal.start(controller.lsp_dict)
+    if reopt is not None:
+        gevent.spawn(reopt.run_forever)
+    if control is not None:
+        register_control_commands(control, controller, reopt,
+                                  journal=journal)
+        gevent.spawn(control.serve_forever, gevent.spawn)
+    if args.metrics_port:
+        gevent.spawn(pce_metrics.serve_http_forever, METRICS, METRICS_ADDR,
+                     args.metrics_port, gevent.spawn)
     servsock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-    servsock.bind((SERVADDR,SERVPORT))
+    servsock.bind((SERVADDR,args.port))
     servsock.listen(MAXCLIENTS)
     while True:
         client = servsock.accept()
-        gevent.spawn(pcc_handler,client,CURRENT_SID,controller)
+        gevent.spawn(pcc_handler,client,CURRENT_SID,controller,recorder)
         CURRENT_SID += 1
 
+def serve_asyncio(args, controller, control, reopt, journal, recorder):
+    import pce_asyncio
+    profile_on_signal()
+    server = pce_asyncio.AsyncioServer(controller, SESSIONS, PCC_SESSIONS,
+                                       handle_pcep_msg, TIMERS, recorder,
+                                       open_session, send_keepalive)
+    if journal is not None:
+        journal.start(controller.lsp_dict)
+    if control is not None:
+        register_control_commands(
+            control, controller, reopt,
+            reopt_now=lambda: server.reoptimize_now(reopt), journal=journal)
+    server.run(SERVADDR, args.port, MAXCLIENTS, control, reopt,
+               (METRICS_ADDR, args.metrics_port, METRICS)
+               if args.metrics_port else None)
+
+def serve_workers(args, controller, control, reopt, journal):
+    import asyncio
+    import pce_asyncio
+    import pce_workers
+
+    def worker_main(index, fd_sock, sync_sock):
+        #forked after controller was created, so each worker has its copy
+        profile_on_signal()
+        publisher = pce_workers.SyncPublisher(controller, index,
+                                              args.workers)
+        recorder = None
+        if args.record:
+            recorder = pcep_capture.CaptureWriter(
+                '%s.%s' % (args.record, index))
+        server = pce_asyncio.AsyncioServer(controller, SESSIONS,
+                                           PCC_SESSIONS, handle_pcep_msg,
+                                           TIMERS, recorder, open_session,
+                                           send_keepalive)
+        #every worker has the global lsp db, so only the first one is
+        #writing it down
+        worker_journal = journal if index == 0 else None
+        if worker_journal is not None:
+            worker_journal.start(controller.lsp_dict)
+        worker_control = None
+        if control is not None:
+            worker_control = pce_control.ControlServer(
+                '%s.%s' % (control.path, index))
+            register_control_commands(
+                worker_control, controller, reopt,
+                reopt_now=lambda: server.reoptimize_now(reopt),
+                journal=worker_journal)
+        if reopt is not None:
+            reopt.owns = publisher.owns
+        worker = pce_workers.Worker(server, publisher, fd_sock, sync_sock)
+        metrics = None
+        if args.metrics_port:
+            metrics = (METRICS_ADDR, args.metrics_port + index, METRICS)
+        asyncio.run(worker.serve(worker_control, reopt, metrics))
+
+    pce_workers.Supervisor(args.workers, SERVADDR, args.port,
+                           MAXCLIENTS).start(worker_main)
+
+def main():
+    args = parse_args()
+    pce_logging.setup(args.log_levels)
+    if args.workers:
+        args.transport = 'asyncio'
+    if args.transport == 'gevent' and gevent is None:
+        raise SystemExit('gevent is not installed, try --transport asyncio')
+    controller = te_controller.TEController(args.path_cache_size,
+                                            args.link_state)
+    METRICS.add_collector(metrics_collector(controller))
+    if args.profile_dir:
+        PROFILER.directory = args.profile_dir
+    reopt = None
+    if args.reopt_interval:
+        reopt = reoptimizer.Reoptimizer(
+            controller, lambda pcc_ip, upd_list: send_to_pcc(
+                pcc_ip, ('lsp_upd_list', upd_list)),
+            interval=args.reopt_interval, threshold=args.reopt_threshold,
+            pcc_rate=args.reopt_pcc_rate, pcc_burst=2*args.reopt_pcc_rate,
+            rate=args.reopt_rate, burst=args.reopt_rate,
+            sleep=gevent.sleep if args.transport == 'gevent' else time.sleep)
+    journal = None
+    if args.state_dir:
+        journal = lsp_journal.LSPJournal(args.state_dir)
+        start = time.time()
+        restored = journal.load(controller)
+        log.info('restored %s lsps from %s in %.3f s', restored,
+                 args.state_dir, time.time() - start)
+    control = None
+    if args.control_socket:
+        control = pce_control.ControlServer(args.control_socket)
+    if args.workers:
+        serve_workers(args, controller, control, reopt, journal)
+        return
+    recorder = None
+    if args.record:
+        recorder = pcep_capture.CaptureWriter(args.record)
+        log.info('recording sessions to %s', args.record)
+    if args.transport == 'asyncio':
+        serve_asyncio(args, controller, control, reopt, journal, recorder)
+    else:
+        serve_gevent(args, controller, control, reopt, journal, recorder)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,56 @@
+"""
+logging setup for the controller.
+
+every module is logging into its own logger (pcep, te_controller,
+pce_controller etc), levels could be set per module, for example:
+    info,pcep=debug,te_controller=warning
+first element w/o module name is the root level.
+per-object tracing is going into *.trace loggers and is enabled per
+session (see PCEP.set_trace and TEController.set_trace), so it costs
+one attribute check when it's off.
+"""
+import logging
+
+DEFAULT_FORMAT = '%(asctime)s %(name)s %(levelname)s: %(message)s'
+#these are gated per session/pcc, not by level
+TRACE_LOGGERS = ('pcep.trace', 'te_controller.trace')
+
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    if level.isdigit():
+        return int(level)
+    parsed_level = logging.getLevelName(level.upper())
+    if not isinstance(parsed_level, int):
+        raise ValueError('unknown log level: %s' % (level,))
+    return parsed_level
+
+
+def parse_levels(spec):
+    """'info,pcep=debug' -> {'': INFO, 'pcep': DEBUG}"""
+    levels = dict()
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            name, level = item.split('=', 1)
+        else:
+            name, level = '', item
+        levels[name.strip()] = parse_level(level.strip())
+    return levels
+
+
+def set_level(name, level):
+    logging.getLogger(name or None).setLevel(parse_level(level))
+
+
+def setup(spec='info', fmt=DEFAULT_FORMAT):
+    logging.basicConfig(format=fmt)
+    levels = parse_levels(spec)
+    levels.setdefault('', logging.INFO)
+    for name, level in levels.items():
+        set_level(name, level)
+    for name in TRACE_LOGGERS:
+        logging.getLogger(name).setLevel(logging.DEBUG)
@@ -0,0 +1,216 @@
+"""
+runtime metrics of the controller in prometheus text format.
+
+hot path is recording into lists preallocated per msg type (and per
+histogram bucket), w/o locks: each transport is one thread per process
+(gevent greenlets or asyncio loop), so plain increments are enough.
+per pcc counters are created on first msg of the pcc. things which could
+be computed from the controller state (lsp counts, send queues) are not
+tracked at all, collectors are computing them on scrape.
+
+served by the control socket command 'metrics' or plain http (any GET
+gets the metrics), one request per connection:
+    curl http://127.0.0.1:9189/metrics
+"""
+import socket
+import bisect
+import timeit
+import logging
+
+log = logging.getLogger(__name__)
+
+#seconds, upper bounds of histogram buckets, last one is +Inf
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3,
+                   5e-3, 1e-2, 2.5e-2, 0.1, 1.0)
+#pcep msg type -> label
+MSG_TYPES = {1:'open', 2:'keepalive', 3:'pcreq', 4:'pcrep', 5:'pcntf',
+             6:'pcerr', 7:'close', 10:'pcrpt', 11:'pcupd'}
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def count(self):
+        return sum(self.counts)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % (','.join(['%s="%s"' % (name, labels[name])
+                               for name in sorted(labels)]),)
+
+
+def _value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metrics(object):
+    """
+    counters by msg type are lists of 256 (type is one byte), parse,
+    handle and encode histograms are preallocated for known msg types
+    (others are sharing 'other' one). per pcc counters are lists of
+    msgs in, msgs out, bytes in, bytes out.
+    collectors are called on render() and return list of
+    (name, type, help, [(labels dict, value), ...])
+    """
+    def __init__(self, clock=timeit.default_timer):
+        self.clock = clock
+        self.msgs_in = [0] * 256
+        self.msgs_out = [0] * 256
+        self.bytes_in = [0] * 256
+        self.bytes_out = [0] * 256
+        self.parse = self._histograms()
+        self.handle = self._histograms()
+        self.encode = self._histograms()
+        self.pccs = dict()
+        self._collectors = list()
+
+    def _histograms(self):
+        other = Histogram()
+        known = dict([(msg_type, Histogram()) for msg_type in MSG_TYPES])
+        return [known.get(msg_type, other) for msg_type in range(256)]
+
+    def pcc(self, pcc_ip):
+        counters = self.pccs.get(pcc_ip)
+        if counters is None:
+            counters = self.pccs[pcc_ip] = [0, 0, 0, 0]
+        return counters
+
+    def received(self, pcc_ip, msg_type, nbytes):
+        self.msgs_in[msg_type] += 1
+        self.bytes_in[msg_type] += nbytes
+        counters = self.pcc(pcc_ip)
+        counters[0] += 1
+        counters[2] += nbytes
+
+    def sent(self, pcc_ip, msg_type, nbytes):
+        self.msgs_out[msg_type] += 1
+        self.bytes_out[msg_type] += nbytes
+        counters = self.pcc(pcc_ip)
+        counters[1] += 1
+        counters[3] += nbytes
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def _by_type(self, counters):
+        return [({'type': MSG_TYPES.get(msg_type, msg_type)}, count)
+                for msg_type, count in enumerate(counters) if count]
+
+    def _histogram_lines(self, name, help_msg, histograms):
+        lines = ['# HELP %s %s' % (name, help_msg),
+                 '# TYPE %s histogram' % (name,)]
+        seen = set()
+        for msg_type, histogram in enumerate(histograms):
+            if id(histogram) in seen or not histogram.count():
+                continue
+            seen.add(id(histogram))
+            msg_name = MSG_TYPES.get(msg_type, 'other')
+            total = 0
+            for bound, count in zip(histogram.bounds + ('+Inf',),
+                                    histogram.counts):
+                total += count
+                lines.append('%s_bucket%s %s' % (name, _labels(
+                    {'type': msg_name, 'le': bound}), total))
+            lines.append('%s_sum%s %r' % (name, _labels({'type': msg_name}),
+                                         histogram.sum))
+            lines.append('%s_count%s %s' % (name, _labels(
+                {'type': msg_name}), total))
+        return lines
+
+    def collect(self):
+        """all the metrics except histograms, as collectors return them"""
+        pccs = sorted(self.pccs.items())
+        metrics = [
+            ('pce_msgs_received_total', 'counter', 'pcep msgs received',
+             self._by_type(self.msgs_in)),
+            ('pce_bytes_received_total', 'counter', 'pcep bytes received',
+             self._by_type(self.bytes_in)),
+            ('pce_msgs_sent_total', 'counter', 'pcep msgs sent',
+             self._by_type(self.msgs_out)),
+            ('pce_bytes_sent_total', 'counter', 'pcep bytes sent',
+             self._by_type(self.bytes_out)),
+            ('pce_pcc_msgs_received_total', 'counter',
+             'pcep msgs received per pcc',
+             [({'pcc': pcc_ip}, counters[0]) for pcc_ip, counters in pccs]),
+            ('pce_pcc_msgs_sent_total', 'counter', 'pcep msgs sent per pcc',
+             [({'pcc': pcc_ip}, counters[1]) for pcc_ip, counters in pccs]),
+            ('pce_pcc_bytes_received_total', 'counter',
+             'pcep bytes received per pcc',
+             [({'pcc': pcc_ip}, counters[2]) for pcc_ip, counters in pccs]),
+            ('pce_pcc_bytes_sent_total', 'counter',
+             'pcep bytes sent per pcc',
+             [({'pcc': pcc_ip}, counters[3]) for pcc_ip, counters in pccs])]
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                log.exception('metrics collector failed')
+        return metrics
+
+    def render(self):
+        """prometheus text exposition format"""
+        lines = list()
+        for name, metric_type, help_msg, samples in self.collect():
+            lines.append('# HELP %s %s' % (name, help_msg))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, _labels(labels),
+                                          _value(value)))
+        lines += self._histogram_lines(
+            'pce_parse_seconds', 'time of PCEP.parse_rcved_msg', self.parse)
+        lines += self._histogram_lines(
+            'pce_handle_seconds', 'time of TEController.handle_pce_message',
+            self.handle)
+        lines += self._histogram_lines(
+            'pce_encode_seconds', 'time of encoding of the msgs we send',
+            self.encode)
+        return '\n'.join(lines) + '\n'
+
+
+def http_response(body):
+    body = body.encode('utf-8')
+    return b''.join([b'HTTP/1.0 200 OK\r\n'
+                     b'Content-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ', str(len(body)).encode('ascii'),
+                     b'\r\nConnection: close\r\n\r\n', body])
+
+
+def _http_client(metrics, sock):
+    try:
+        request = b''
+        while b'\r\n\r\n' not in request and len(request) < 65536:
+            data = sock.recv(4096)
+            if not data:
+                return
+            request += data
+        sock.sendall(http_response(metrics.render()))
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+
+
+def serve_http_forever(metrics, addr, port, spawn):
+    """http endpoint on blocking sockets, spawn is e.g. gevent.spawn"""
+    servsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    servsock.bind((addr, port))
+    servsock.listen(5)
+    log.info('metrics on http://%s:%s/metrics', addr, port)
+    while True:
+        client, _ = servsock.accept()
+        spawn(_http_client, metrics, client)
+
@@ -0,0 +1,163 @@
+"""
+on-demand profiling of the running controller, w/o restart.
+
+sampling: SIGPROF every interval of cpu time, the handler records stack
+of whatever is running (with gevent, the stack of a greenlet starts with
+its function, e.g. pcc_handler, so it is visible which greenlet is burning
+cpu). after the window stacks are written in collapsed format, one
+'frame;frame;frame count' line per stack, for flamegraph.pl or speedscope.
+syscalls are restarted after SIGPROF, so sessions dont see EINTR.
+
+per pcc: cProfile enabled only around parsing, handling and encoding of
+msgs of that pcc (pce_controller.handle_pcep_msg), not around sending (it
+may block and switch greenlets), written as pstats file:
+    python -m pstats file.pstats
+one pcc at a time, python 3.12+ allows only one active profiler anyway.
+
+both are stopped by the timer (schedule, e.g. TimerWheel.schedule) after
+the window (so it is rounded to the ticks of the wheel) or by stop command.
+"""
+import os
+import time
+import signal
+import logging
+import cProfile
+import tempfile
+
+log = logging.getLogger(__name__)
+
+USAGE = ('start [seconds] [interval ms] | stop | pcc <ip> [seconds] | '
+         'pcc <ip> stop | status')
+
+
+def frame_label(code):
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class Profiler(object):
+    def __init__(self, schedule, directory=None, clock=time.time):
+        self._schedule = schedule
+        self.directory = directory or tempfile.gettempdir()
+        self._clock = clock
+        #stack of code objects (root first) -> samples
+        self._stacks = dict()
+        self._sampling = None
+        #pcc ip -> (cProfile.Profile, path, timer)
+        self.pccs = dict()
+
+    def _path(self, name, suffix):
+        return os.path.join(self.directory, 'pce-%s-%s-%s.%s' % (
+            os.getpid(), name, time.strftime('%Y%m%d-%H%M%S'), suffix))
+
+    def _sample(self, signum, frame):
+        stack = list()
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def start_sampling(self, seconds=30, interval=0.005):
+        """sampling profiler for seconds, returns path of the output"""
+        if self._sampling is not None:
+            return 'sampling is already running, output: %s' % (
+                self._sampling[0],)
+        path = self._path('cpu', 'collapsed')
+        self._stacks = dict()
+        previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        timer = self._schedule(seconds, self.stop_sampling)
+        self._sampling = (path, timer, previous, self._clock())
+        log.info('sampling profiler on for %s s, output: %s', seconds, path)
+        return 'sampling for %s s, output: %s' % (seconds, path)
+
+    def stop_sampling(self):
+        if self._sampling is None:
+            return 'sampling is not running'
+        path, timer, previous, started = self._sampling
+        self._sampling = None
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, previous or signal.SIG_DFL)
+        timer.cancel()
+        stacks, self._stacks = self._stacks, dict()
+        with open(path, 'w') as output:
+            for stack, count in sorted(stacks.items(),
+                                       key=lambda item: -item[1]):
+                output.write('%s %s\n' % (';'.join(
+                    [frame_label(code) for code in reversed(stack)]), count))
+        samples = sum(stacks.values())
+        log.info('sampling profiler off after %.1f s, %s samples in %s',
+                 self._clock() - started, samples, path)
+        return '%s samples, %s stacks: %s' % (samples, len(stacks), path)
+
+    def start_pcc(self, pcc_ip, seconds=30):
+        if self.pccs:
+            profiled = next(iter(self.pccs))
+            return '%s is already profiled, output: %s' % (
+                profiled, self.pccs[profiled][1])
+        profile = cProfile.Profile()
+        try:
+            #fails if another profiler (or debugger, coverage) is active
+            profile.enable()
+            profile.disable()
+        except ValueError as e:
+            return 'cannot profile %s: %s' % (pcc_ip, e)
+        path = self._path(pcc_ip, 'pstats')
+        timer = self._schedule(seconds, self.stop_pcc, pcc_ip)
+        self.pccs[pcc_ip] = (profile, path, timer)
+        log.info('profiling %s for %s s, output: %s', pcc_ip, seconds, path)
+        return 'profiling %s for %s s, output: %s' % (pcc_ip, seconds, path)
+
+    def runcall(self, pcc_ip, func, *args):
+        """
+        func(*args) under the profile of pcc_ip, w/o it if the profiler
+        can't be enabled (profiling of the pcc is stopped then)
+        """
+        profile = self.pccs[pcc_ip][0]
+        try:
+            profile.enable()
+        except ValueError as e:
+            log.warning('profiling of %s failed: %s', pcc_ip, e)
+            self.stop_pcc(pcc_ip)
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def stop_pcc(self, pcc_ip):
+        if pcc_ip not in self.pccs:
+            return '%s is not profiled' % (pcc_ip,)
+        profile, path, timer = self.pccs.pop(pcc_ip)
+        timer.cancel()
+        profile.dump_stats(path)
+        log.info('profiling of %s off, output: %s', pcc_ip, path)
+        return path
+
+    def status(self):
+        lines = list()
+        if self._sampling is not None:
+            lines.append('sampling: %s samples so far, output: %s' % (
+                sum(self._stacks.values()), self._sampling[0]))
+        for pcc_ip in sorted(self.pccs):
+            lines.append('pcc %s: output: %s' % (pcc_ip,
+                                                 self.pccs[pcc_ip][1]))
+        return '\n'.join(lines) or 'profiling is off'
+
+    def command(self, *args):
+        """control socket command, see USAGE"""
+        if not args or args[0] == 'status':
+            return self.status()
+        if args[0] == 'start':
+            seconds = float(args[1]) if len(args) > 1 else 30
+            interval = float(args[2]) / 1e3 if len(args) > 2 else 0.005
+            return self.start_sampling(seconds, interval)
+        if args[0] == 'stop':
+            return self.stop_sampling()
+        if args[0] == 'pcc' and len(args) > 1:
+            if len(args) > 2 and args[2] == 'stop':
+                return self.stop_pcc(args[1])
+            return self.start_pcc(args[1],
+                                  float(args[2]) if len(args) > 2 else 30)
+        return 'usage: profile %s' % (USAGE,)
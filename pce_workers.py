@@ -0,0 +1,277 @@
+"""
+multi-process mode of the controller (python 3.7+, unix).
+
+parent process accepts pcep sessions and passes accepted sockets
+(SCM_RIGHTS over unix socketpair) to one of N worker processes, chosen by
+hash of pcc address, so all sessions of the pcc are always on the same
+worker. (SO_REUSEPORT would be simpler, but kernel is balancing by
+4-tuple, not by source address only, so sessions of the same pcc could
+end up in different workers). each worker is asyncio server of
+pce_asyncio with its own PCEP parsing and TEController.
+
+coordination: worker is the owner of lsps of its pccs. changes of owned
+lsps (LSPStore) and of their reservations (TED) are batched once per loop
+iteration and sent to the parent, which relays them to all the other
+workers in the order it got them. so every worker has global LSP and
+bandwidth view for path computation, and updates of every lsp are
+applied everywhere in the same order (lsp has only one owner).
+
+if any worker exits, parent stops everything, there is no recovery of
+the state of the worker.
+"""
+import os
+import zlib
+import array
+import signal
+import socket
+import struct
+import pickle
+import asyncio
+import logging
+import lsp_store
+
+log = logging.getLogger(__name__)
+
+_frame_hdr = struct.Struct('!I')
+_ipv4_addr = struct.Struct('!I')
+
+
+def shard(pcc, workers):
+    """index of the worker responsible for the pcc (ipv4 as int)"""
+    return (zlib.crc32(_ipv4_addr.pack(pcc)) & 0xffffffff) % workers
+
+
+class SyncPublisher(object):
+    """
+    listener of LSPStore and TED of the worker. publishes changes of owned
+    lsps and applies changes of the others (which are not published again,
+    we dont own them):
+        ('lsp', key, lsp) - LSPStore update
+        ('del', key) - LSPStore delete
+        ('ted', key, node addresses, bandwidth, priority) - TED update
+        ('unted', key) - TED remove
+    TED link ids are local to the worker, so paths go as node addresses
+    """
+    def __init__(self, controller, index, workers):
+        self.controller = controller
+        self.index = index
+        self.workers = workers
+        self.writer = None
+        self._ops = list()
+        controller.lsp_dict.listeners.append(self)
+        controller.ted.lsp_listeners.append(self)
+
+    def owns(self, pcc):
+        return shard(pcc, self.workers) == self.index
+
+    def _publish(self, op):
+        self._ops.append(op)
+        if len(self._ops) == 1:
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        if not self._ops or self.writer is None:
+            return
+        payload = pickle.dumps(self._ops, pickle.HIGHEST_PROTOCOL)
+        self.writer.write(_frame_hdr.pack(len(payload)) + payload)
+        self._ops = list()
+
+    def lsp_updated(self, key, lsp):
+        if self.owns(key[0]):
+            self._publish(('lsp', key, lsp))
+
+    def lsp_deleted(self, key):
+        if self.owns(key[0]):
+            self._publish(('del', key))
+
+    def update_lsp(self, key, links, bandwidth, priority):
+        if self.owns(key[0]):
+            te_db = self.controller.ted
+            nodes = [te_db.nodes[te_db.link_dst[link]] for link in links]
+            self._publish(('ted', key, nodes, bandwidth, priority))
+
+    def remove_lsp(self, key):
+        if self.owns(key[0]):
+            self._publish(('unted', key))
+
+    def clear(self):
+        pass
+
+    def apply(self, ops):
+        lsp_dict = self.controller.lsp_dict
+        te_db = self.controller.ted
+        for op in ops:
+            if op[0] == 'lsp':
+                lsp_dict.update(op[1], op[2])
+            elif op[0] == 'del':
+                lsp_dict.delete(op[1])
+            elif op[0] == 'ted':
+                record = lsp_store.LSPRecord(op[1][0], op[1][1])
+                for addr in op[2]:
+                    record.add_rro_hop(addr, 32)
+                record.bandwidth = op[3]
+                record.hold_prio = op[4]
+                te_db.update_lsp(op[1], record)
+            elif op[0] == 'unted':
+                te_db.remove_lsp(op[1])
+
+
+class Worker(object):
+    def __init__(self, server, publisher, fd_sock, sync_sock):
+        self.server = server
+        self.publisher = publisher
+        self._fd_sock = fd_sock
+        self._sync_sock = sync_sock
+
+    def _receive_sockets(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                msg, ancdata, flags, addr = self._fd_sock.recvmsg(
+                    256, socket.CMSG_LEN(4))
+            except BlockingIOError:
+                return
+            if not msg and not ancdata:
+                log.error('parent closed fd channel')
+                loop.stop()
+                return
+            for level, cmsg_type, data in ancdata:
+                if level != socket.SOL_SOCKET or cmsg_type != socket.SCM_RIGHTS:
+                    continue
+                fds = array.array('i')
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+                for fd in fds:
+                    sock = socket.socket(fileno=fd)
+                    sock.setblocking(False)
+                    loop.create_task(self.server.add_socket(sock))
+
+    async def serve(self, control=None, reopt=None, metrics=None):
+        loop = asyncio.get_event_loop()
+        await self.server.start_services(control, reopt, metrics)
+        reader, writer = await asyncio.open_unix_connection(
+            sock=self._sync_sock)
+        self.publisher.writer = writer
+        self._fd_sock.setblocking(False)
+        loop.add_reader(self._fd_sock.fileno(), self._receive_sockets)
+        while True:
+            try:
+                hdr = await reader.readexactly(_frame_hdr.size)
+                payload = await reader.readexactly(
+                    _frame_hdr.unpack(hdr)[0])
+            except asyncio.IncompleteReadError:
+                log.info('parent closed sync channel, exiting')
+                return
+            self.publisher.apply(pickle.loads(payload))
+
+
+class Supervisor(object):
+    def __init__(self, workers, addr, port, backlog):
+        self.workers = workers
+        self.addr = addr
+        self.port = port
+        self.backlog = backlog
+        self._pids = list()
+        self._fd_socks = list()
+        self._sync_socks = list()
+
+    def start(self, worker_main):
+        """
+        forks workers, worker_main(index, fd_sock, sync_sock) is running
+        in each of them, then parent serves forever
+        """
+        for index in range(self.workers):
+            fd_sock, worker_fd_sock = socket.socketpair(socket.AF_UNIX,
+                                                        socket.SOCK_DGRAM)
+            sync_sock, worker_sync_sock = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                for sock in self._fd_socks + self._sync_socks + [
+                        fd_sock, sync_sock]:
+                    sock.close()
+                try:
+                    worker_main(index, worker_fd_sock, worker_sync_sock)
+                except Exception:
+                    log.exception('worker %s failed', index)
+                finally:
+                    os._exit(1)
+            worker_fd_sock.close()
+            worker_sync_sock.close()
+            #sessions are passed from the accept loop, it must not block
+            #on a worker which is not taking them (stuck or busy)
+            fd_sock.setblocking(False)
+            self._pids.append(pid)
+            self._fd_socks.append(fd_sock)
+            self._sync_socks.append(sync_sock)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.stop()
+
+    def stop(self):
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self._pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._pids = list()
+
+    async def _relay(self, index, reader, writers, stopped):
+        """sync frames of one worker to all the others"""
+        while True:
+            try:
+                hdr = await reader.readexactly(_frame_hdr.size)
+                payload = await reader.readexactly(
+                    _frame_hdr.unpack(hdr)[0])
+            except asyncio.IncompleteReadError:
+                log.error('worker %s exited, stopping', index)
+                stopped.set()
+                return
+            for other, writer in enumerate(writers):
+                if other != index:
+                    writer.write(hdr + payload)
+
+    async def _serve(self):
+        loop = asyncio.get_event_loop()
+        stopped = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stopped.set)
+        loop.add_signal_handler(signal.SIGINT, stopped.set)
+        streams = [await asyncio.open_unix_connection(sock=sock)
+                   for sock in self._sync_socks]
+        writers = [writer for reader, writer in streams]
+        for index, (reader, writer) in enumerate(streams):
+            loop.create_task(self._relay(index, reader, writers, stopped))
+        servsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        servsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        servsock.bind((self.addr, self.port))
+        servsock.listen(self.backlog)
+        servsock.setblocking(False)
+        log.info('%s workers, listening on %s', self.workers, self.port)
+        accept = loop.create_task(self._accept(servsock))
+        await stopped.wait()
+        accept.cancel()
+        servsock.close()
+
+    async def _accept(self, servsock):
+        loop = asyncio.get_event_loop()
+        while True:
+            conn, peer = await loop.sock_accept(servsock)
+            index = shard(lsp_store.ip2int(peer[0]), self.workers)
+            try:
+                self._fd_socks[index].sendmsg(
+                    [peer[0].encode('ascii')],
+                    [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                      array.array('i', [conn.fileno()]))])
+            except BlockingIOError:
+                #its queue is full, the pcc will reconnect
+                log.warning('worker %s is not taking sessions, closing '
+                            'session from %s', index, peer)
+            except OSError as e:
+                log.warning('cant pass session from %s to worker %s: %s',
+                            peer, index, e)
+            finally:
+                conn.close()
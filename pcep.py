@@ -1,6 +1,326 @@
 import struct
 import socket
-from string import join
+import logging
+from array import array
+
+log = logging.getLogger(__name__)
+#per-object tracing, enabled per session with PCEP.set_trace
+trace_log = logging.getLogger(__name__ + '.trace')
+
+MSG_NAMES = {1:'open', 2:'ka', 3:'pcreq', 4:'pcrep', 5:'ntf', 6:'error',
+             7:'close', 10:'pcc state report', 11:'pcc update'}
+
+#precompiled codecs. all parsers are working with one memoryview of the msg
+#and absolute offsets, so we dont copy the tail of the msg for each object
+_common_hdr = struct.Struct("!BBH")
+_common_obj_hdr = struct.Struct("!BBH")
+_open_obj = struct.Struct("!BBBB")
+_error_obj = struct.Struct("!BBBB")
+_tlv_hdr = struct.Struct("!HHI")
+_srp_obj = struct.Struct("!II")
+_rp_obj = struct.Struct("!II")
+_svec_obj = struct.Struct("!I")
+_req_id = struct.Struct("!I")
+_nopath_obj = struct.Struct("!BHB")
+_endpointsv4_obj = struct.Struct("!II")
+_bw_obj = struct.Struct("!I")
+_metric_obj = struct.Struct("!HBBI")
+_lspa_obj = struct.Struct("!IIIBBBB")
+_lsp_obj = struct.Struct("!I")
+_sobj_hdr = struct.Struct("!BB")
+_ipv4_sobj = struct.Struct("!BBIBB")
+_label_sobj = struct.Struct("!BBBBI")
+_ipv4_addr = struct.Struct("!I")
+#object header + body in one shot for the encoders
+_lsp_obj_full = struct.Struct("!BBHI")
+_bw_obj_full = struct.Struct("!BBHI")
+_lspa_obj_full = struct.Struct("!BBHIIIBBBB")
+
+#Message-Length is 16 bits
+MAX_MSG_LEN = 65535
+#what framing and parsers raise on malformed input (well framed msg with
+#broken body too), sessions are closed on them
+MSG_ERRORS = (ValueError, struct.error, IndexError)
+
+#Object-Class codes, parsed objects are dispatched on them (obj.oc)
+OC_OPEN = 1
+OC_RP = 2
+OC_NOPATH = 3
+OC_ENDPOINTS = 4
+OC_BW = 5
+OC_METRIC = 6
+OC_ERO = 7
+OC_RRO = 8
+OC_LSPA = 9
+OC_SVEC = 11
+OC_LSP = 32
+OC_SRP = 33
+
+
+class PCEPObject(object):
+    """
+    base of parsed objects: one slotted instance per object, fields are
+    __slots__ of the class, oc is its Object-Class. flags are kept in the
+    form parsers always returned them (masked, not shifted)
+    """
+    __slots__ = ()
+    oc = None
+
+    def astuple(self):
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.astuple() == other.astuple()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            ['%s=%r' % (slot, getattr(self, slot))
+             for slot in self.__slots__]))
+
+
+class Open(PCEPObject):
+    __slots__ = ('version', 'keepalive', 'deadtimer', 'sid')
+    oc = OC_OPEN
+
+    def __init__(self, version, keepalive, deadtimer, sid):
+        self.version = version
+        self.keepalive = keepalive
+        self.deadtimer = deadtimer
+        self.sid = sid
+
+
+class RP(PCEPObject):
+    __slots__ = ('req_id', 'priority', 'reopt', 'bidir', 'loose')
+    oc = OC_RP
+
+    def __init__(self, req_id, priority, reopt, bidir, loose):
+        self.req_id = req_id
+        self.priority = priority
+        self.reopt = reopt
+        self.bidir = bidir
+        self.loose = loose
+
+
+class EndPoints(PCEPObject):
+    """src and dst are None for unsupported (ipv6) Object-Type"""
+    __slots__ = ('src', 'dst')
+    oc = OC_ENDPOINTS
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+
+
+class Bandwidth(PCEPObject):
+    __slots__ = ('bandwidth',)
+    oc = OC_BW
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+
+
+class Metric(PCEPObject):
+    __slots__ = ('metric_type', 'bound', 'computed', 'value')
+    oc = OC_METRIC
+
+    def __init__(self, metric_type, bound, computed, value):
+        self.metric_type = metric_type
+        self.bound = bound
+        self.computed = computed
+        self.value = value
+
+
+def _ero_hops(raw):
+    """
+    ipv4 subobjects into array('I') of pairs (address, loose<<8 | prefix
+    length), stops on the first unsupported subobject
+    """
+    hops = array('I')
+    append = hops.append
+    unpack_sobj = _ipv4_sobj.unpack_from
+    sobj_offset = 0
+    end = len(raw)
+    while sobj_offset + 8 <= end:
+        sobj_type, sobj_len, addr, mask, _ = unpack_sobj(raw, sobj_offset)
+        if sobj_type & 127 != 1 or sobj_len < 8:
+            break
+        append(addr)
+        append(((sobj_type >> 7) << 8) | mask)
+        sobj_offset += sobj_len
+    return hops
+
+
+def _rro_hops(raw):
+    """
+    ipv4 subobjects into array('I') of pairs (address, prefix length) and
+    labels of label subobjects (empty tuple if there are none)
+    """
+    hops = array('I')
+    labels = ()
+    sobj_offset = 0
+    end = len(raw)
+    while sobj_offset + 8 <= end:
+        #both ipv4 and label subobjects are 8 bytes, ipv4 is the usual one
+        sobj = _ipv4_sobj.unpack_from(raw, sobj_offset)
+        sobj_type, sobj_len = sobj[0], sobj[1]
+        if sobj_len < 8:
+            break
+        if sobj_type == 1:
+            hops.append(sobj[2])
+            hops.append(sobj[3])
+        elif sobj_type == 3:
+            if not labels:
+                labels = array('I')
+            labels.append(_label_sobj.unpack_from(raw, sobj_offset)[4])
+        else:
+            #the same as parse_rro_subobject
+            break
+        sobj_offset += sobj_len
+    return hops, labels
+
+
+class ERO(PCEPObject):
+    """
+    raw is memoryview of the subobjects in the received msg, so it is valid
+    only as long as the msg buffer is (see PCEPRecvBuffer). hops are decoded
+    on first access into array('I') pairs (address, loose<<8 | prefix
+    length), the same as LSPRecord.ero. whether the path changed is
+    decided on raw bytes (key), w/o decoding
+    """
+    __slots__ = ('raw', '_hops')
+    oc = OC_ERO
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._hops = None
+
+    @property
+    def hops(self):
+        if self._hops is None:
+            self._hops = _ero_hops(self.raw)
+        return self._hops
+
+    def key(self):
+        """raw subobjects as bytes, equal keys are equal paths"""
+        return self.raw.tobytes()
+
+    def astuple(self):
+        return (self.key(),)
+
+    def __repr__(self):
+        return 'ERO(%r)' % (self.subobjects(),)
+
+    def subobjects(self):
+        """list of (loose, address, prefix length), as encoders take them"""
+        hops = self.hops
+        return [(hops[i+1] >> 8, hops[i], hops[i+1] & 255)
+                for i in range(0, len(hops), 2)]
+
+
+class RRO(PCEPObject):
+    """
+    lazy the same way as ERO: hops are decoded from raw on first access
+    into array('I') of pairs (address, prefix length), the same as
+    LSPRecord.rro; labels of label subobjects in their own array (empty
+    tuple if there are none)
+    """
+    __slots__ = ('raw', '_hops', '_labels')
+    oc = OC_RRO
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._hops = None
+        self._labels = None
+
+    @property
+    def hops(self):
+        if self._hops is None:
+            self._hops, self._labels = _rro_hops(self.raw)
+        return self._hops
+
+    @property
+    def labels(self):
+        if self._hops is None:
+            self._hops, self._labels = _rro_hops(self.raw)
+        return self._labels
+
+    def key(self):
+        """raw subobjects as bytes, equal keys are equal paths"""
+        return self.raw.tobytes()
+
+    def astuple(self):
+        return (self.key(),)
+
+    def __repr__(self):
+        return 'RRO(%r, labels=%r)' % (self.subobjects(), self.labels)
+
+    def subobjects(self):
+        """list of (address, prefix length)"""
+        hops = self.hops
+        return [(hops[i], hops[i+1]) for i in range(0, len(hops), 2)]
+
+
+class LSPA(PCEPObject):
+    __slots__ = ('setup_prio', 'hold_prio', 'local_protection')
+    oc = OC_LSPA
+
+    def __init__(self, setup_prio, hold_prio, local_protection):
+        self.setup_prio = setup_prio
+        self.hold_prio = hold_prio
+        self.local_protection = local_protection
+
+
+class SVEC(PCEPObject):
+    __slots__ = ('link_diverse', 'node_diverse', 'srlg_diverse', 'req_ids')
+    oc = OC_SVEC
+
+    def __init__(self, link_diverse, node_diverse, srlg_diverse, req_ids):
+        self.link_diverse = link_diverse
+        self.node_diverse = node_diverse
+        self.srlg_diverse = srlg_diverse
+        self.req_ids = req_ids
+
+
+class LSP(PCEPObject):
+    """
+    both drafts are parsed into it, old draft doesnt have administrative
+    flag (always 0)
+    """
+    __slots__ = ('plsp_id', 'delegated', 'sync', 'remove', 'administrative',
+                 'operational')
+    oc = OC_LSP
+
+    def __init__(self, plsp_id, delegated, sync, remove, administrative,
+                 operational):
+        self.plsp_id = plsp_id
+        self.delegated = delegated
+        self.sync = sync
+        self.remove = remove
+        self.administrative = administrative
+        self.operational = operational
+
+
+class SRP(PCEPObject):
+    __slots__ = ('flags', 'srp_id')
+    oc = OC_SRP
+
+    def __init__(self, flags, srp_id):
+        self.flags = flags
+        self.srp_id = srp_id
+
+
+class Unknown(PCEPObject):
+    """object we dont parse, kept so the order of objects is intact"""
+    __slots__ = ('object_class', 'object_type')
+
+    def __init__(self, object_class, object_type):
+        self.object_class = object_class
+        self.object_type = object_type
 
 
 class PCEP(object):
@@ -68,13 +388,13 @@ Where:
    <path>::= <ERO><attribute-list>[<RRO>]
 
     """
-    def __init__(self, open_sid = 0):
-        self._common_hdr_fmt="!BBH"
-        self._common_obj_hdr_fmt="!BBH"
-        self._open_obj_fmt="!BBBB"
-        self._error_obj_fmt="!BBBB"
+    def __init__(self, open_sid = 0, peer = None):
         """ TLV Stateful PCE Capability: Update Capability 1, Include DB version: 0"""
-        self._spc_tlv = struct.pack('!HHI',16,4,1)
+        self._spc_tlv = _tlv_hdr.pack(16,4,1)
+        self._open_sid = open_sid % 255
+        #used only to tag log records of this session
+        self._session = peer if peer is not None else 'sid %s' % (open_sid,)
+        self._trace = False
         """
        SRP Object-Class is 33.
        SRP Object-Type is 1.
@@ -93,66 +413,79 @@ Where:
       +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
 
         """
-        self._srp_obj_fmt = "!II"
-        self._rp_obj_fmt = "!II"
-        self._nopath_obj_fmt = "!BHB"
-        self._endpointsv4_obj_fmt = "!II"
-        self._endpointsv6_obj_ftm = "!4I4I"
-        self._bw_obj_fmt = "!I"
-        self._metric_obj_fmt = "!HBBI"
-        self._lspa_obj_fmt = "!IIIBBBB"
-        self._lsp_obj_fmt = "!I"
-        self._open_sid = open_sid % 255
         self._srp_id = 1 
         self._state = 'not_initialized'
+        #object parsers by Object-Class<<4 | Object-Type
         self._functions_dict = dict()
-        self._functions_dict[4,1] = self.parse_endpoints_object
-        self._functions_dict[5,1] = self.parse_bw_object
-        self._functions_dict[5,2] = self.parse_bw_object
-        self._functions_dict[6,1] = self.parse_metric_object
-        self._functions_dict[7,1] = self.parse_ero_object
-        self._functions_dict[8,1] = self.parse_rro_object
-        self._functions_dict[9,1] = self.parse_lspa_object
+        self._functions_dict[OC_RP<<4 | 1] = self.parse_rp_object
+        self._functions_dict[OC_ENDPOINTS<<4 | 1] = self.parse_endpoints_object
+        self._functions_dict[OC_ENDPOINTS<<4 | 2] = self.parse_endpoints_object
+        self._functions_dict[OC_BW<<4 | 1] = self.parse_bw_object
+        self._functions_dict[OC_BW<<4 | 2] = self.parse_bw_object
+        self._functions_dict[OC_METRIC<<4 | 1] = self.parse_metric_object
+        self._functions_dict[OC_ERO<<4 | 1] = self.parse_ero_object
+        self._functions_dict[OC_RRO<<4 | 1] = self.parse_rro_object
+        self._functions_dict[OC_LSPA<<4 | 1] = self.parse_lspa_object
+        self._functions_dict[OC_SVEC<<4 | 1] = self.parse_svec_object
         #atm we are going to use _od version for old-draft juniper
-        self._functions_dict[32,1] = self.parse_lsp_object_od
+        self._functions_dict[OC_LSP<<4 | 1] = self.parse_lsp_object_od
+        self._functions_dict[OC_SRP<<4 | 1] = self.parse_srp_object
+        #PCUpd object encoders: (size of the object, pack_into function)
+        self._upd_encoders = dict()
+        self._upd_encoders['lsp_obj'] = (lambda obj: 8, self.pack_lsp_object_into)
+        self._upd_encoders['ero'] = (self.ero_object_size, self.pack_ero_object_into)
+        self._upd_encoders['lspa'] = (lambda obj: 20, self.pack_lspa_object_into)
+        self._upd_encoders_od = dict(self._upd_encoders)
+        self._upd_encoders_od['lsp_obj'] = (lambda obj: 8, self.pack_lsp_object_od_into)
+        self._upd_encoders_od['bw'] = (lambda obj: 8, self.pack_bw_object_into)
+        self._rep_encoders = dict()
+        self._rep_encoders['rp'] = (lambda obj: 12, self.pack_rp_object_into)
+        self._rep_encoders['nopath'] = (lambda obj: 8, self.pack_nopath_object_into)
+        self._rep_encoders['ero'] = (self.ero_object_size, self.pack_ero_object_into)
+        self._rep_encoders['bw'] = (lambda obj: 8, self.pack_bw_object_into)
+        self._rep_encoders['metric'] = (lambda obj: 12, self.pack_metric_object_into)
+        self._req_encoders = dict(self._rep_encoders)
+        del self._req_encoders['nopath']
+        self._req_encoders['endpoints'] = (lambda obj: 12, self.pack_endpoints_object_into)
+        self._req_encoders['lspa'] = (lambda obj: 20, self.pack_lspa_object_into)
+        self._req_encoders['svec'] = (self.svec_object_size,
+                                      self.pack_svec_object_into)
 
     def ip2int(self, addr):                                                               
-        return struct.unpack_from("!I", socket.inet_aton(addr))[0]                       
+        return _ipv4_addr.unpack(socket.inet_aton(addr))[0]                       
 
     def int2ip(self, addr):                                                               
-        return socket.inet_ntoa(struct.pack("!I", addr)) 
+        return socket.inet_ntoa(_ipv4_addr.pack(addr)) 
     
+    def set_trace(self, enabled):
+        """per-object tracing of everything we parse in this session"""
+        self._trace = bool(enabled)
+
     def parse_rcved_msg(self, msg):
-        common_hdr = struct.unpack(self._common_hdr_fmt,msg[0:4])
-        print(common_hdr)
+        msg = memoryview(msg)
+        common_hdr = _common_hdr.unpack_from(msg)
+        log.debug('%s: %s msg recved, hdr %s', self._session,
+                  MSG_NAMES.get(common_hdr[1], 'unknown'), common_hdr)
         if common_hdr[1] == 1:
-            print('open msg recved')
-            self.parse_open_msg(common_hdr, msg)
+            return self.parse_open_msg(common_hdr, msg)
         elif common_hdr[1] == 2:
-            print('ka msg recved')
             return self.parse_ka_msg(common_hdr, msg)
         elif common_hdr[1] == 3:
-            print('pcreq msg recved')
-        elif common_hdr[1] == 4:
-            print('pcrep msg recved')
-        elif common_hdr[1] == 5:
-            print('ntf msg recved')
+            return self.parse_pcreq_msg(common_hdr, msg)
         elif common_hdr[1] == 6:
-            print('error msg recved')
             self.parse_error_msg(common_hdr,msg)
-        elif common_hdr[1] == 7:
-            print('close msg recved')
         elif common_hdr[1] == 10:
-            print('pcc state report msg recved')
             return self.parse_state_report_msg(common_hdr,msg)
-        elif common_hdr[1] == 11:
-            print('pcc update msg recved')
         return ('NotImplemented',None) 
     
     def generate_pcep_msg(self,msg):
-        print('generating pcep msg')
+        log.debug('%s: generating %s msg', self._session, msg[0])
         if msg[0] == 'lsp_upd':
             return self.generate_lsp_upd_msg_od(msg[1])
+        if msg[0] == 'lsp_upd_list':
+            return self.generate_lsp_upd_msgs_od(msg[1])
+        if msg[0] == 'pcrep':
+            return self.generate_pcrep_msg(msg[1])
         return None
 
     """
@@ -177,13 +510,18 @@ Where:
 
     def parse_open_msg(self,common_hdr, msg):
         self.parse_common_obj_hdr(msg)
-        open_msg = struct.unpack_from(self._open_obj_fmt,msg[8:])
+        open_msg = _open_obj.unpack_from(msg, 8)
         self._peer_ka_timer = open_msg[1]
-        self._test_openmsg = msg
+        #we declare session down if nothing is received for this long
+        self._peer_dead_timer = open_msg[2]
+        self._test_openmsg = msg.tobytes()
+        tlv = None
         if(common_hdr[2] > 12):
-            print(struct.unpack_from('!HHI',msg[12:]))
+            tlv = _tlv_hdr.unpack_from(msg, 12)
         self._state = 'initialized'
-        print(open_msg)
+        log.info('%s: open msg: %s tlv: %s', self._session, open_msg, tlv)
+        return ('open',Open(open_msg[0] >> 5, open_msg[1], open_msg[2],
+                            open_msg[3]))
 
     """
     0                   1                   2                   3
@@ -200,20 +538,20 @@ Where:
     """
 
     def parse_common_obj_hdr(self,msg,offset=0):
-        obj_hdr = struct.unpack_from(self._common_obj_hdr_fmt,msg[4+offset:])
+        obj_hdr = _common_obj_hdr.unpack_from(msg, 4+offset)
         object_class = obj_hdr[0]
         object_type = obj_hdr[1]>>4
         object_length = obj_hdr[2]
         # 3 = 00000011
         PI_flags = obj_hdr[1]&3 
-        print("obj header: oc:%s  ot:%s len:%s flags:%s"%(object_class,
-                                                          object_type,
-                                                          object_length,
-                                                          PI_flags,))
+        if self._trace:
+            trace_log.debug("%s: obj header: oc:%s  ot:%s len:%s flags:%s",
+                            self._session, object_class, object_type,
+                            object_length, PI_flags)
         return (object_class, object_type, object_length, PI_flags)
 
     def generate_common_obj_hdr(self,oc,ot,length,PI_flags=0):
-        return struct.pack(self._common_obj_hdr_fmt,oc,((ot<<4)|PI_flags),length)
+        return _common_obj_hdr.pack(oc,((ot<<4)|PI_flags),length)
 
     """
         request parameters object
@@ -239,15 +577,22 @@ Where:
     """
 
     def parse_rp_object(self, msg, com_obj_hdr, offset=0):
-        rp_object = struct.unpack_from(self._rp_obj_fmt,msg[8+offset:]) 
+        rp_object = _rp_obj.unpack_from(msg, 8+offset)
         rp_req_id = rp_object[1]
         rp_priority_flag = rp_object[0]&7
         rp_reopt_flag = rp_object[0]&8 
         rp_bidir_flag = rp_object[0]&16
         #strict/loose; 1 - loose is acceptable
         rp_o_flag = rp_object[0]&32
-        return ('rp',(rp_req_id, rp_priority_flag, rp_reopt_flag, rp_bidir_flag,
-                rp_o_flag))
+        return RP(rp_req_id, rp_priority_flag, rp_reopt_flag, rp_bidir_flag,
+                  rp_o_flag)
+
+    def pack_rp_object_into(self, buf, offset, obj):
+        #flags are in the same (not shifted) form as parse_rp_object returns them
+        flags = obj[1] | obj[2] | obj[3] | obj[4]
+        _common_obj_hdr.pack_into(buf,offset,2,1<<4,12)
+        _rp_obj.pack_into(buf,offset+4,flags,obj[0])
+        return offset+12
 
         """
         used in pcreq
@@ -274,11 +619,61 @@ Where:
   
     def parse_endpoints_object(self, msg, com_obj_hdr, offset=0):
         if com_obj_hdr[1] == 1:
-            endpointsv4_obj = struct.unpack_from(self._endpointsv4_obj_fmt,
-                                                 msg[8+offset:])
+            endpointsv4_obj = _endpointsv4_obj.unpack_from(msg, 8+offset)
             src_ipv4 = endpointsv4_obj[0]
             dst_ipv4 = endpointsv4_obj[1]
-            return ('endpoints',(src_ipv4, dst_ipv4))
+            return EndPoints(src_ipv4, dst_ipv4)
+        return EndPoints(None, None)
+
+    def pack_endpoints_object_into(self, buf, offset, obj):
+        _common_obj_hdr.pack_into(buf,offset,4,1<<4,12)
+        _endpointsv4_obj.pack_into(buf,offset+4,obj[0],obj[1])
+        return offset+12
+
+    """
+   SVEC Object-Class is 11.
+   SVEC Object-Type is 1.
+
+    0                   1                   2                   3
+    0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+   |   Reserved    |                   Flags                 |S|N|L|
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+   |                     Request-ID-number #1                      |
+   //                                                             //
+   |                     Request-ID-number #M                      |
+   +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+
+                   Figure 19: SVEC Body Object Format
+
+   L (Link diverse) bit, N (Node diverse) bit, S (SRLG diverse) bit:
+   computed paths of the set must not have any link/node/SRLG in common.
+   Request-ID-number: identifies requests of the synchronized set.
+    """
+
+    def parse_svec_object(self, msg, com_obj_hdr, offset=0):
+        svec_flags = _svec_obj.unpack_from(msg, 8+offset)[0]
+        link_diverse = svec_flags&1
+        node_diverse = svec_flags&2
+        srlg_diverse = svec_flags&4
+        req_ids = tuple([_req_id.unpack_from(msg, req_offset)[0]
+                         for req_offset in range(12+offset,
+                                                 4+com_obj_hdr[2]+offset, 4)])
+        return SVEC(link_diverse, node_diverse, srlg_diverse, req_ids)
+
+    def svec_object_size(self, obj):
+        return 8+4*len(obj[3])
+
+    def pack_svec_object_into(self, buf, offset, obj):
+        #flags are in the same (not shifted) form as parse_svec_object returns
+        flags = obj[0] | obj[1] | obj[2]
+        obj_len = self.svec_object_size(obj)
+        _common_obj_hdr.pack_into(buf,offset,11,1<<4,obj_len)
+        _svec_obj.pack_into(buf,offset+4,flags)
+        for req_offset, req_id in zip(range(offset+8, offset+obj_len, 4),
+                                      obj[3]):
+            _req_id.pack_into(buf,req_offset,req_id)
+        return offset+obj_len
     """
 The BANDWIDTH object may be carried within PCReq and PCRep messages.
    BANDWIDTH Object-Class is 5.
@@ -297,16 +692,17 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
     """
 
     def parse_bw_object(self, msg, com_obj_hdr, offset=0):
-        bw_obj = struct.unpack_from(self._bw_obj_fmt,msg[8+offset:])
-        print(bw_obj)
-        return ('bw',(bw_obj[0],))
+        bw_obj = _bw_obj.unpack_from(msg, 8+offset)
+        if self._trace:
+            trace_log.debug('%s: bw obj: %s', self._session, bw_obj)
+        return Bandwidth(bw_obj[0])
 
     def generate_bw_object(self, obj):
-        size = 4
-        bw = obj[0]
-        packed_obj = struct.pack(self._bw_obj_fmt,bw)
-        packed_common_hdr = self.generate_common_obj_hdr(5,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        return (8,_bw_obj_full.pack(5,1<<4,8,obj[0]))
+
+    def pack_bw_object_into(self, buf, offset, obj):
+        _bw_obj_full.pack_into(buf,offset,5,1<<4,8,obj[0])
+        return offset+8
  
 
         """
@@ -323,13 +719,21 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
         """
     def parse_metric_object(self, msg, com_obj_hdr, offset=0):
-        metric_obj = struct.unpack_from(self._metric_obj_fmt,msg[8+offset:])
+        metric_obj = _metric_obj.unpack_from(msg, 8+offset)
         metric_type = metric_obj[2]
         bound_flag = metric_obj[1]&1
         comp_met_flag = metric_obj[1]&2
         met_value = metric_obj[3]
-        print(met_value)
-        return ('metric',(metric_type, bound_flag, comp_met_flag, met_value))
+        if self._trace:
+            trace_log.debug('%s: metric obj: %s', self._session, metric_obj)
+        return Metric(metric_type, bound_flag, comp_met_flag, met_value)
+
+    def pack_metric_object_into(self, buf, offset, obj):
+        metric_type, bound_flag, comp_met_flag, met_value = obj
+        flags = (1 if bound_flag else 0) | (2 if comp_met_flag else 0)
+        _common_obj_hdr.pack_into(buf,offset,6,1<<4,12)
+        _metric_obj.pack_into(buf,offset+4,0,flags,metric_type,met_value)
+        return offset+12
   
 
         """
@@ -341,8 +745,8 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
    |L|    Type     |     Length    | (Subobject contents)          |
    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-------------//----------------+
         """
-    def parse_ero_subobject(self, ero_obj):
-        tlv_type = struct.unpack_from("!BB",ero_obj)
+    def parse_ero_subobject(self, msg, offset=0):
+        tlv_type = _sobj_hdr.unpack_from(msg, offset)
         #loose or strict:
         l_flag = tlv_type[0]>>7
         sobj_type = tlv_type[0]&127
@@ -358,17 +762,17 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
    | IPv4 address (continued)      | Prefix Length |      Resvd    |
    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
             """
-            ero_sobj = struct.unpack_from("!BBIBB",ero_obj)
+            ero_sobj = _ipv4_sobj.unpack_from(msg, offset)
             return (sobj_length, l_flag, ero_sobj)
         #placeholder for safety, so we wont iterate forever if we dont know sobj_type (aka != 1)
         return(1000,None,None)
 
-    def generate_ero_subobject(self, rro_subobj):
+    def generate_ero_subobject(self, ero_subobj):
         #atm only subj type 1 will be implemented
-        l_flag = rro_subobj[0]
-        ipv4_addr = rro_subobj[1]
-        ipv4_mask = rro_subobj[2]
-        return (8,struct.pack("!BBIBB",(l_flag<<7)|1,8,ipv4_addr,ipv4_mask,0))
+        l_flag = ero_subobj[0]
+        ipv4_addr = ero_subobj[1]
+        ipv4_mask = ero_subobj[2]
+        return (8,_ipv4_sobj.pack((l_flag<<7)|1,8,ipv4_addr,ipv4_mask,0))
 
 
         """
@@ -379,24 +783,30 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         """
 
     def parse_ero_object(self, msg, com_obj_hdr, offset=0):
-        parsed_ero_size = 0
-        ero_list = list()
-        while parsed_ero_size + 4 < com_obj_hdr[2]:
-            sobj = self.parse_ero_subobject(msg[8+offset+parsed_ero_size:])
-            parsed_ero_size += sobj[0]
-            ero_list.append(sobj)
-            print(sobj) 
-        return ('ero',ero_list)
+        #subobjects are decoded only if someone needs them, see ERO
+        ero = ERO(msg[8+offset:4+offset+com_obj_hdr[2]])
+        if self._trace:
+            trace_log.debug('%s: ero obj: %s', self._session, ero)
+        return ero
 
     def generate_ero_object(self, obj):
-        size = 0
-        packed_obj = ''
-        for ero_subobj in obj:
-            packed_subobj = self.generate_ero_subobject(ero_subobj)
-            packed_obj = join((packed_obj,packed_subobj[1]),sep='')
-            size += packed_subobj[0]
-        packed_common_hdr = self.generate_common_obj_hdr(7,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        size = self.ero_object_size(obj)
+        buf = bytearray(size)
+        self.pack_ero_object_into(buf, 0, obj)
+        return (size,bytes(buf))
+
+    def ero_object_size(self, obj):
+        return 4 + 8*len(obj)
+
+    def pack_ero_object_into(self, buf, offset, obj):
+        size = 4 + 8*len(obj)
+        _common_obj_hdr.pack_into(buf,offset,7,1<<4,size)
+        pack_sobj = _ipv4_sobj.pack_into
+        sobj_offset = offset + 4
+        for l_flag, ipv4_addr, ipv4_mask in obj:
+            pack_sobj(buf,sobj_offset,(l_flag<<7)|1,8,ipv4_addr,ipv4_mask,0)
+            sobj_offset += 8
+        return sobj_offset
  
 
     """
@@ -418,16 +828,16 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
    |       Contents of Label Object                                |
    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
     """
-    def parse_rro_subobject(self,rro_obj):
-        tlv_type = struct.unpack_from("!BB",rro_obj)
+    def parse_rro_subobject(self, msg, offset=0):
+        tlv_type = _sobj_hdr.unpack_from(msg, offset)
         sobj_type = tlv_type[0]
         sobj_length = tlv_type[1]
         #atm only ipv4 and label subobjects will be implemented
         if sobj_type == 1:
-            rro_sobj = struct.unpack_from("!BBIBB",rro_obj)
+            rro_sobj = _ipv4_sobj.unpack_from(msg, offset)
             return (sobj_length, rro_sobj)
         if sobj_type == 3:
-            rro_sobj = struct.unpack_from("!BBBBI",rro_obj)
+            rro_sobj = _label_sobj.unpack_from(msg, offset)
             return (sobj_length, rro_sobj)         
         #placeholder for safety, so we wont iterate forever if we dont know sobj_type (aka != 1)
         return(1000,None)
@@ -438,15 +848,10 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         Object-Type = 1
     """
     def parse_rro_object(self, msg, com_obj_hdr, offset=0):
-        parsed_rro_size = 0
-        rro_list = list()
-        while parsed_rro_size + 4 < com_obj_hdr[2]:
-            sobj = self.parse_rro_subobject(msg[8+offset+parsed_rro_size:])
-            parsed_rro_size += sobj[0]
-            rro_list.append(sobj)
-            print(sobj)
-            print(self.int2ip(sobj[1][2]))
-        return ('rro',rro_list)
+        rro = RRO(msg[8+offset:4+offset+com_obj_hdr[2]])
+        if self._trace:
+            trace_log.debug('%s: rro obj: %s', self._session, rro)
+        return rro
 
 
     """
@@ -471,23 +876,28 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
     """
     def parse_lspa_object(self, msg, com_obj_hdr, offset=0):
-        lspa_obj = struct.unpack_from(self._lspa_obj_fmt,msg[8+offset:])
+        lspa_obj = _lspa_obj.unpack_from(msg, 8+offset)
         setup_pri = lspa_obj[3]
         hold_pri = lspa_obj[4]
         #local protection desired
         L_flag = lspa_obj[5]&1
-        print("lspa obj: %s %s %s"%(setup_pri,hold_pri,L_flag,))
-        return ('lspa',(setup_pri, hold_pri, L_flag))
+        if self._trace:
+            trace_log.debug("%s: lspa obj: %s %s %s", self._session,
+                            setup_pri, hold_pri, L_flag)
+        return LSPA(setup_pri, hold_pri, L_flag)
     
     def generate_lspa_object(self, obj):
-        size = 16
+        buf = bytearray(20)
+        self.pack_lspa_object_into(buf, 0, obj)
+        return (20,bytes(buf))
+
+    def pack_lspa_object_into(self, buf, offset, obj):
         setup_pri = obj[0]
         hold_pri = obj[1]
         L_flag = obj[2]
-        packed_obj = struct.pack(self._lspa_obj_fmt,0,0,0,setup_pri,
-                                 hold_pri, L_flag,0)
-        packed_common_hdr = self.generate_common_obj_hdr(9,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        _lspa_obj_full.pack_into(buf,offset,9,1<<4,20,0,0,0,setup_pri,
+                                 hold_pri,L_flag,0)
+        return offset+20
     
         """
         TODO: need to implement it, gonna remove extensive description afterwards.
@@ -536,7 +946,7 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
      +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
     """
     def parse_lsp_object(self, msg, com_obj_hdr, offset=0):
-        lsp_obj = struct.unpack_from(self._lsp_obj_fmt,msg[8+offset:])
+        lsp_obj = _lsp_obj.unpack_from(msg, 8+offset)
         plsp_id = lsp_obj[0] >> 12
         """
            Flags (12 bits):
@@ -558,12 +968,17 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         r_flag = lsp_obj[0] & 4
         a_flag = lsp_obj[0] & 8
         o_flag = lsp_obj[0] & 112
-        if com_obj_hdr > 8:
-            print('lsp_obj has TLVs')
+        if com_obj_hdr[2] > 8 and self._trace:
+            trace_log.debug('%s: lsp_obj has TLVs', self._session)
             #TODO: add tlv's parsing
-        return ('lsp_obj',(plsp_id,d_flag,s_flag,r_flag,a_flag,o_flag))
+        return LSP(plsp_id, d_flag, s_flag, r_flag, a_flag, o_flag)
 
     def generate_lsp_object(self,obj):
+        buf = bytearray(8)
+        self.pack_lsp_object_into(buf, 0, obj)
+        return (8,bytes(buf))
+
+    def pack_lsp_object_into(self, buf, offset, obj):
         plsp_id = obj[0]
         d_flag = obj[1]
         s_flag = obj[2]
@@ -574,10 +989,8 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         summary_obj |= (d_flag | (s_flag << 1) | (r_flag<<2) | (a_flag << 3) |
                         o_flag << 4)
         #w/o tlv support atm, so size = 4
-        size = 4
-        packed_obj = struct.pack("!I", summary_obj)
-        packed_common_hdr = self.generate_common_obj_hdr(32,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        _lsp_obj_full.pack_into(buf,offset,32,1<<4,8,summary_obj)
+        return offset+8
     
     """
     od suffix means old drafts (preor -07, for example
@@ -585,18 +998,23 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
     """
 
     def parse_lsp_object_od(self, msg, com_obj_hdr, offset=0):
-        lsp_obj = struct.unpack_from(self._lsp_obj_fmt,msg[8+offset:])
+        lsp_obj = _lsp_obj.unpack_from(msg, 8+offset)
         plsp_id = lsp_obj[0] >> 12
         d_flag = lsp_obj[0] & 1
         s_flag = lsp_obj[0] & 2
         o_flag = lsp_obj[0] & 4
         r_flag = lsp_obj[0] & 8
-        if com_obj_hdr > 8:
-            print('lsp_obj has TLVs')
+        if com_obj_hdr[2] > 8 and self._trace:
+            trace_log.debug('%s: lsp_obj has TLVs', self._session)
             #TODO: add tlv's parsing
-        return ('lsp_obj',(plsp_id,d_flag,s_flag,o_flag,r_flag,))
+        return LSP(plsp_id, d_flag, s_flag, r_flag, 0, o_flag)
 
     def generate_lsp_object_od(self,obj):
+        buf = bytearray(8)
+        self.pack_lsp_object_od_into(buf, 0, obj)
+        return (8,bytes(buf))
+
+    def pack_lsp_object_od_into(self, buf, offset, obj):
         plsp_id = obj[0]
         d_flag = obj[1]
         s_flag = obj[2]
@@ -604,49 +1022,103 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         r_flag = obj[4]
         summary_obj = plsp_id << 12
         summary_obj |= (d_flag | (s_flag << 1) | (o_flag<<2) | (r_flag << 3))
-        print(summary_obj)
         #w/o tlv support atm, so size = 4
-        size = 4
-        packed_obj = struct.pack("!I", summary_obj)
-        packed_common_hdr = self.generate_common_obj_hdr(32,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        _lsp_obj_full.pack_into(buf,offset,32,1<<4,8,summary_obj)
+        return offset+8
     
  
 
 
     
+    def parse_srp_object(self, msg, com_obj_hdr, offset=0):
+        srp_obj = _srp_obj.unpack_from(msg, 8+offset)
+        if self._trace:
+            trace_log.debug('%s: srp obj: %s', self._session, srp_obj)
+        return SRP(srp_obj[0], srp_obj[1])
+
     def generate_srp_object(self):
         #w/o tlv support atm
         size = 8
-        packed_obj = struct.pack(self._srp_obj_fmt,0,self._srp_id)
+        packed_obj = _srp_obj.pack(0,self._srp_id)
         self._srp_id += 1
         if (self._srp_id > (2<<32-2)):
             self._srp_id = 1
         packed_common_hdr = self.generate_common_obj_hdr(33,1,size+4)
-        return (size+4,join((packed_common_hdr,packed_obj),sep=''))
+        return (size+4,packed_common_hdr + packed_obj)
  
     def parse_error_msg(self, common_hdr, msg):
         self.parse_common_obj_hdr(msg)
-        error_msg = struct.unpack_from(self._error_obj_fmt,msg[8:])
-        print(error_msg)
+        error_msg = _error_obj.unpack_from(msg, 8)
+        log.warning('%s: error msg: %s', self._session, error_msg)
  
     def parse_state_report_msg(self,common_hdr, msg):
+        parsed_state_report = self.parse_obj_list(common_hdr, msg)
+        if self._trace:
+            trace_log.debug('%s: parsed_state_report: %s', self._session,
+                            parsed_state_report)
+        return('state_report',parsed_state_report)
+
+    def parse_pcreq_msg(self, common_hdr, msg):
+        """
+        <PCReq Message>::= <Common Header>
+                           [<svec-list>]
+                           <request-list>
+        <request>::= <RP>
+                     <END-POINTS>
+                     [<LSPA>]
+                     [<BANDWIDTH>]
+                     [<metric-list>]
+                     [<RRO>[<BANDWIDTH>]]
+                     [<IRO>]
+                     [<LOAD-BALANCING>]
+
+        returns ('pcreq', (SVEC list, request list)), each request is
+        the list of its objects, starting with RP. objects before the
+        first RP (except SVECs) doesnt belong to any request and dropped
+        """
+        svecs = list()
+        requests = list()
+        request = None
+        for parsed_obj in self.parse_obj_list(common_hdr, msg):
+            if parsed_obj.oc == OC_SVEC:
+                svecs.append(parsed_obj)
+            elif parsed_obj.oc == OC_RP:
+                request = [parsed_obj]
+                requests.append(request)
+            elif request is not None:
+                request.append(parsed_obj)
+        parsed_pcreq = (svecs, requests)
+        if self._trace:
+            trace_log.debug('%s: parsed_pcreq: %s', self._session,
+                            parsed_pcreq)
+        return ('pcreq',parsed_pcreq)
+
+    def parse_obj_list(self, common_hdr, msg):
+        """
+        list of parsed objects (PCEPObject) of the msg, in the order they
+        were sent. objects we dont parse are Unknown
+        """
         offset = 0
-        parsed_state_report = list()
+        parsed_objects = list()
+        append = parsed_objects.append
+        functions = self._functions_dict
+        unpack_obj_hdr = _common_obj_hdr.unpack_from
         while offset+4 < common_hdr[2]:
-            parsed_obj_hdr=self.parse_common_obj_hdr(msg,offset)
-            if (parsed_obj_hdr[0],parsed_obj_hdr[1]) in self._functions_dict:
-                #lspa = self.parse_lspa_object(msg, parsed_obj_hdr, offset)
-                oc_ot = (parsed_obj_hdr[0],parsed_obj_hdr[1])
-                parsed_obj = self._functions_dict[oc_ot](msg,parsed_obj_hdr,
-                                                         offset)
-                parsed_state_report.append(parsed_obj)
+            if self._trace:
+                self.parse_common_obj_hdr(msg,offset)
+            #the same as parse_common_obj_hdr, w/o a method call per object
+            oc, ot_flags, obj_len = unpack_obj_hdr(msg, 4+offset)
+            parsed_obj_hdr = (oc, ot_flags>>4, obj_len, ot_flags&3)
+            if parsed_obj_hdr[2] < 4:
+                #broken object length, we would loop forever on it
+                break
+            parse = functions.get(parsed_obj_hdr[0]<<4 | parsed_obj_hdr[1])
+            if parse is not None:
+                append(parse(msg,parsed_obj_hdr,offset))
             else:
-                parsed_state_report.append(('unknow obj',))
+                append(Unknown(parsed_obj_hdr[0],parsed_obj_hdr[1]))
             offset+=parsed_obj_hdr[2]
-        print('parsed_state_report:')
-        print(parsed_state_report)
-        return('state_report',parsed_state_report)
+        return parsed_objects
  
     def parse_ka_msg(self,common_hdr,msg):
         return ('ka_msg',)
@@ -673,63 +1145,201 @@ The BANDWIDTH object may be carried within PCReq and PCRep messages.
         """
         C_flag <<=15
         #TODO: NO-PATH-VECTOR
-        return struct.pack(self._nopath_obj_fmt,NI_flag,C_flag,0)
+        return _nopath_obj.pack(NI_flag,C_flag,0)
+
+    def pack_nopath_object_into(self, buf, offset, obj):
+        NI_flag = obj[0]
+        C_flag = obj[1] << 15
+        _common_obj_hdr.pack_into(buf,offset,3,1<<4,8)
+        _nopath_obj.pack_into(buf,offset+4,NI_flag,C_flag,0)
+        return offset+8
    
     def generate_open_msg(self,ka_timer):
         self._ka_timer = ka_timer
-        common_hdr = struct.pack(self._common_hdr_fmt,32,1,20)
-        common_obj_hdr = struct.pack(self._common_obj_hdr_fmt,1,16,16)
-        open_obj = struct.pack(self._open_obj_fmt,32,ka_timer,ka_timer*4,self._open_sid)
-        return join((common_hdr,common_obj_hdr,open_obj,self._spc_tlv),sep='')
+        common_hdr = _common_hdr.pack(32,1,20)
+        common_obj_hdr = _common_obj_hdr.pack(1,16,16)
+        open_obj = _open_obj.pack(32,ka_timer,ka_timer*4,self._open_sid)
+        return b''.join((common_hdr,common_obj_hdr,open_obj,self._spc_tlv))
 
     def generate_ka_msg(self):
-        common_hdr = struct.pack(self._common_hdr_fmt,32,2,4)
+        common_hdr = _common_hdr.pack(32,2,4)
         return common_hdr
     
-    def generate_lsp_upd_msg(self,obj_list):
+    """
+    PCUpd encoders. sizes of all objects are known before packing, so
+    we are allocating the whole msg once and packing objects into it,
+    w/o concatenation of partial results.
+    old-draft juniper doesnt want SRP object in PCUpd, so we dont add it
+    """
+    def _upd_size(self, obj_list, encoders):
         size = 0
-        packed_lspupd_msg = ''
-        packed_obj = self.generate_srp_object()
-        #size += packed_obj[0]
-        #packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
         for obj in obj_list:
-            if obj[0] == 'lsp_obj':
-                packed_obj = self.generate_lsp_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-            elif obj[0] == 'ero':
-                packed_obj = self.generate_ero_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-            elif obj[0] == 'lspa':
-                packed_obj = self.generate_lspa_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-        common_hdr = struct.pack(self._common_hdr_fmt,32,11,size+4)
-        return join((common_hdr,packed_lspupd_msg),sep='')
+            encoder = encoders.get(obj[0])
+            if encoder is not None:
+                size += encoder[0](obj[1])
+        return size
 
-    def generate_lsp_upd_msg_od(self,obj_list):
-        size = 0
-        packed_lspupd_msg = ''
-        packed_obj = self.generate_srp_object()
-        #size += packed_obj[0]
-        #packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
+    def _pack_upd_into(self, buf, offset, obj_list, encoders):
         for obj in obj_list:
-            if obj[0] == 'lsp_obj':
-                packed_obj = self.generate_lsp_object_od(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-            elif obj[0] == 'ero':
-                packed_obj = self.generate_ero_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-            elif obj[0] == 'lspa':
-                packed_obj = self.generate_lspa_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-            elif obj[0] == 'bw':
-                packed_obj = self.generate_bw_object(obj[1])
-                size += packed_obj[0]
-                packed_lspupd_msg = join((packed_lspupd_msg,packed_obj[1]), sep='')
-        common_hdr = struct.pack(self._common_hdr_fmt,32,11,size+4)
-        return join((common_hdr,packed_lspupd_msg),sep='')
+            encoder = encoders.get(obj[0])
+            if encoder is not None:
+                offset = encoder[1](buf, offset, obj[1])
+        return offset
+
+    def _generate_upd_msg(self, obj_list, encoders, msg_type=11):
+        size = self._upd_size(obj_list, encoders) + 4
+        buf = bytearray(size)
+        _common_hdr.pack_into(buf,0,32,msg_type,size)
+        self._pack_upd_into(buf, 4, obj_list, encoders)
+        return bytes(buf)
+
+    def generate_pcrep_msg(self, obj_list):
+        """
+        <PCRep Message> ::= <Common Header>
+                            <response-list>
+        <response>::=<RP>
+                    [<NO-PATH>]
+                    [<attribute-list>]
+                    [<path-list>]
+        obj_list is list of ('rp', ..), ('nopath', (NI, C)), ('ero', ..),
+        ('bw', ..), ('metric', ..) objects
+        """
+        return self._generate_upd_msg(obj_list, self._rep_encoders, 4)
+
+    def generate_pcreq_msg(self, obj_list):
+        """
+        we are pce, so it's not for us, but it's handy for tests and
+        benchmarks: ('svec', ..), ('rp', ..), ('endpoints', (src, dst)),
+        ('bw', ..), ('lspa', ..), ('metric', ..)
+        """
+        return self._generate_upd_msg(obj_list, self._req_encoders, 3)
+
+    def generate_lsp_upd_msg(self,obj_list):
+        return self._generate_upd_msg(obj_list, self._upd_encoders)
+
+    def generate_lsp_upd_msg_od(self,obj_list):
+        return self._generate_upd_msg(obj_list, self._upd_encoders_od)
+
+    def generate_lsp_upd_msgs_od(self,upd_list):
+        """
+        fast path for a lot of updates at once. upd_list is a list of
+        per lsp obj_lists. all of them are packed into one buffer as a
+        stream of PCUpd msgs; new msg is started when the next lsp wont fit
+        into Message-Length
+        """
+        encoders = self._upd_encoders_od
+        sizes = [self._upd_size(obj_list, encoders) for obj_list in upd_list]
+        msgs = list()
+        msg_size = 4
+        msg_start = 0
+        for index, size in enumerate(sizes):
+            if msg_size + size > MAX_MSG_LEN and index > msg_start:
+                msgs.append((msg_start, index, msg_size))
+                msg_start = index
+                msg_size = 4
+            msg_size += size
+        if upd_list:
+            msgs.append((msg_start, len(upd_list), msg_size))
+        buf = bytearray(sum([msg[2] for msg in msgs]))
+        offset = 0
+        for msg_start, msg_end, msg_size in msgs:
+            _common_hdr.pack_into(buf,offset,32,11,msg_size)
+            offset += 4
+            for index in range(msg_start, msg_end):
+                offset = self._pack_upd_into(buf, offset, upd_list[index],
+                                             encoders)
+        return bytes(buf)
+
+
+class PCEPFramer(object):
+    """
+    per-session receive buffer. tcp gives us a byte stream, not messages:
+    one recv can carry several coalesced msgs (PCRpt + KA for example) and
+    a big state report can span several recvs. we are using Message-Length
+    from the common header to cut complete msgs out of the stream and keep
+    partial tail till the next feed().
+    """
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """
+        appends data to the buffer and returns list of all complete msgs
+        (could be empty). raises ValueError if the stream is broken
+        (Message-Length smaller than common header)
+        """
+        buf = self._buf
+        buf.extend(data)
+        msgs = list()
+        offset = 0
+        buf_len = len(buf)
+        while buf_len - offset >= 4:
+            msg_len = _common_hdr.unpack_from(buf, offset)[2]
+            if msg_len < 4:
+                raise ValueError('bad pcep msg length: %s' % (msg_len,))
+            if buf_len - offset < msg_len:
+                break
+            msgs.append(bytes(buf[offset:offset+msg_len]))
+            offset += msg_len
+        if offset:
+            del buf[:offset]
+        return msgs
+
+    def pending(self):
+        """number of buffered bytes of not yet complete msg"""
+        return len(self._buf)
+
+
+class PCEPRecvBuffer(object):
+    """
+    preallocated receive buffer for readinto-style transports (e.g.
+    asyncio.BufferedProtocol): transport writes directly into get_buffer(),
+    complete msgs are returned as memoryviews into the same buffer, so
+    nothing is allocated per read. views are valid only till the next
+    get_buffer()/feed() call, msgs must be parsed and handled before that
+    (parsed ERO and RRO objects are views into the msg).
+    partial msg at the end is moved to the start of the buffer only when
+    there is not enough free space left for the biggest possible msg.
+    """
+    def __init__(self, size=2*(MAX_MSG_LEN+1)):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def get_buffer(self):
+        """free part of the buffer to receive into"""
+        if len(self._buf) - self._end < MAX_MSG_LEN + 1:
+            pending = self._end - self._start
+            self._buf[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def feed(self, nbytes):
+        """
+        nbytes were received into get_buffer(), returns list of complete
+        msgs. raises ValueError if the stream is broken
+        """
+        self._end += nbytes
+        view = self._view
+        start = self._start
+        end = self._end
+        msgs = list()
+        while end - start >= 4:
+            msg_len = _common_hdr.unpack_from(view, start)[2]
+            if msg_len < 4:
+                raise ValueError('bad pcep msg length: %s' % (msg_len,))
+            if end - start < msg_len:
+                break
+            msgs.append(view[start:start+msg_len])
+            start += msg_len
+        if start == end:
+            start = end = 0
+        self._start = start
+        self._end = end
+        return msgs
+
+    def pending(self):
+        """number of buffered bytes of not yet complete msg"""
+        return self._end - self._start
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+"""
+micro benchmarks for pcep codec.
+
+usage: pcep_bench.py [--against path/to/old_pcep.py]
+
+--against loads other implementation of pcep module and runs the same
+benchmarks on it, so we could compare. old version could be taken from git:
+    git show HEAD~1:pcep.py > /tmp/old_pcep.py
+"""
+import gc
+import os
+import sys
+import struct
+import random
+import timeit
+import argparse
+import pcep
+
+
+def load_module(name, path):
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Quiet(object):
+    """older codec versions print a lot, we dont want to measure the terminal"""
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+def best_of(func, repeat=5, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def build_rro_object(ctx, hops):
+    packed = b''.join([struct.pack("!BBIBB", 1, 8, hop, 32, 0)
+                       for hop in hops])
+    return ctx.generate_common_obj_hdr(8, 1, len(packed)+4) + packed
+
+
+def build_pcrpt(ctx, lsps, hops=4):
+    """synthetic PCRpt with lsps state reports, each with ero and rro"""
+    body = list()
+    for plsp_id in range(1, lsps+1):
+        path = [0x0a000000 + (plsp_id << 4) + hop for hop in range(hops)]
+        body.append(ctx.generate_lsp_object_od((plsp_id,1,0,1,0))[1])
+        body.append(ctx.generate_ero_object([(0, addr, 32)
+                                             for addr in path])[1])
+        body.append(ctx.generate_lspa_object((7,7,0))[1])
+        body.append(ctx.generate_bw_object((1000,))[1])
+        body.append(build_rro_object(ctx, path))
+    body = b''.join(body)
+    return struct.pack("!BBH", 32, 10, len(body)+4) + body
+
+
+def build_updates(lsps, hops=4):
+    """per lsp obj_lists, the same as TEController is generating"""
+    updates = list()
+    for plsp_id in range(1, lsps+1):
+        path = [0x0a000000 + (plsp_id << 4) + hop for hop in range(hops)]
+        updates.append([('lsp_obj',(plsp_id,1,0,1,0)),
+                        ('ero',[(0, addr, 32) for addr in path]),
+                        ('lspa',(7,7,0)),
+                        ('bw',(1000,))])
+    return updates
+
+
+def chunked_encoder(ctx, lsps_per_msg=500):
+    """
+    implementations w/o batch encoder could put only that much lsps into
+    one PCUpd before overflowing Message-Length
+    """
+    def encode(updates):
+        msgs = list()
+        for start in range(0, len(updates), lsps_per_msg):
+            obj_list = list()
+            for upd in updates[start:start+lsps_per_msg]:
+                obj_list.extend(upd)
+            msgs.append(ctx.generate_lsp_upd_msg_od(obj_list))
+        return b''.join(msgs)
+    return encode
+
+
+def random_chunks(rnd, stream, small=0.25):
+    """
+    stream split at random offsets: tiny chunks (cutting common headers)
+    mixed with ones bigger than the biggest msg
+    """
+    chunks = list()
+    offset = 0
+    while offset < len(stream):
+        if rnd.random() < small:
+            size = rnd.randint(1, 5)
+        else:
+            size = rnd.randint(1, 2*pcep.MAX_MSG_LEN)
+        chunks.append(stream[offset:offset+size])
+        offset += size
+    return chunks
+
+
+def recv_buffer_feed(recv_buf, chunk):
+    """readinto-style transport: never more than get_buffer() at once"""
+    msgs = list()
+    while chunk:
+        free = recv_buf.get_buffer()
+        size = min(len(free), len(chunk))
+        free[:size] = chunk[:size]
+        chunk = chunk[size:]
+        msgs.extend([msg.tobytes() for msg in recv_buf.feed(size)])
+    return msgs
+
+
+def check_framing(trials=20, msgs=300, seed=1):
+    """
+    PCEPFramer and PCEPRecvBuffer cut the same msgs out of the stream for
+    any chunking. stream has KAs, small PCRpts and ones close to
+    MAX_MSG_LEN, so partial msgs are moved to start of PCEPRecvBuffer
+    many times
+    """
+    ctx = pcep.PCEP()
+    kinds = [struct.pack("!BBH", 32, 2, 4), build_pcrpt(ctx, 1),
+             build_pcrpt(ctx, 100), build_pcrpt(ctx, 520)]
+    assert len(kinds[-1]) <= pcep.MAX_MSG_LEN
+    rnd = random.Random(seed)
+    for trial in range(trials):
+        expected = [rnd.choice(kinds) for i in range(msgs)]
+        stream = b''.join(expected)
+        #some trials cut almost everything into tiny pieces
+        chunks = random_chunks(rnd, stream, 0.25 if trial % 4 else 0.9)
+        framer = pcep.PCEPFramer()
+        recv_buf = pcep.PCEPRecvBuffer()
+        framed = list()
+        received = list()
+        for chunk in chunks:
+            framed.extend(framer.feed(chunk))
+            received.extend(recv_buffer_feed(recv_buf, chunk))
+        assert framed == expected, 'PCEPFramer, seed %s, trial %s' % (
+            seed, trial)
+        assert received == expected, 'PCEPRecvBuffer, seed %s, trial %s' % (
+            seed, trial)
+        assert framer.pending() == 0 and recv_buf.pending() == 0
+    print('framing: %s streams of %s msgs split at random offsets, ok' % (
+        trials, msgs))
+
+
+def check_malformed(msgs=20000, seed=1):
+    """
+    well framed msgs with random bytes of the body changed (or cut short):
+    parsers raise only pcep.MSG_ERRORS, sessions are closed on those
+    """
+    ctx = pcep.PCEP()
+    valid = [build_pcrpt(ctx, 3), ctx.generate_open_msg(20)]
+    rnd = random.Random(seed)
+    errors = 0
+    for _ in range(msgs):
+        msg = bytearray(rnd.choice(valid))
+        for _ in range(rnd.randint(1, 4)):
+            msg[rnd.randrange(4, len(msg))] = rnd.randrange(256)
+        if rnd.random() < 0.3:
+            msg = msg[:rnd.randrange(4, len(msg) + 1)]
+            struct.pack_into("!H", msg, 2, len(msg))
+        try:
+            with Quiet():
+                pcep.PCEP().parse_rcved_msg(bytes(msg))
+        except pcep.MSG_ERRORS:
+            errors += 1
+    print('malformed: %s msgs, %s rejected' % (msgs, errors))
+
+
+def bench_encode(codec, sizes=(10, 100, 10000)):
+    print('encode PCUpd (%s)' % (codec.__file__,))
+    ctx = codec.PCEP()
+    if hasattr(ctx, 'generate_lsp_upd_msgs_od'):
+        encode = ctx.generate_lsp_upd_msgs_od
+    else:
+        encode = chunked_encoder(ctx)
+    for lsps in sizes:
+        updates = build_updates(lsps)
+        with Quiet():
+            elapsed = best_of(lambda: encode(updates))
+        print('  %6s lsps: %10.1f us %8.2f us/lsp' % (
+            lsps, elapsed*1e6, elapsed*1e6/lsps))
+
+
+def bench_parse(codec, sizes=(10, 100, 500)):
+    print('parse PCRpt (%s)' % (codec.__file__,))
+    for lsps in sizes:
+        ctx = codec.PCEP()
+        with Quiet():
+            msg = build_pcrpt(ctx, lsps)
+            elapsed = best_of(lambda: ctx.parse_rcved_msg(msg))
+        print('  %6s lsps %6s bytes: %10.1f us/msg %8.2f us/lsp' % (
+            lsps, len(msg), elapsed*1e6, elapsed*1e6/lsps))
+
+
+def reachable(root):
+    """objects reachable from root, classes excluded"""
+    seen = dict()
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen[id(obj)] = obj
+        stack.extend(gc.get_referents(obj))
+    return list(seen.values())
+
+
+def bench_allocations(codec, lsps=100):
+    """
+    objects held by parsed PCRpt. the msg is parsed twice, objects found
+    in both results (small ints, constants) are not allocated per parse
+    """
+    ctx = codec.PCEP()
+    with Quiet():
+        msg = build_pcrpt(ctx, lsps)
+        parsed = ctx.parse_rcved_msg(msg)
+        again = ctx.parse_rcved_msg(msg)
+    shared = set([id(obj) for obj in reachable(again)])
+    held = [obj for obj in reachable(parsed) if id(obj) not in shared]
+    print('parsed PCRpt, %s lsps: %.1f objects/lsp, %.0f bytes/lsp (%s)' % (
+        lsps, float(len(held))/lsps,
+        float(sum([sys.getsizeof(obj) for obj in held]))/lsps,
+        codec.__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pcep codec benchmarks')
+    parser.add_argument('--against', help='other pcep.py to compare with')
+    args = parser.parse_args()
+    check_framing()
+    check_malformed()
+    codecs = [pcep]
+    if args.against:
+        codecs.append(load_module('pcep_against', args.against))
+    for codec in codecs:
+        bench_parse(codec)
+        bench_allocations(codec)
+        bench_encode(codec)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+capture of received pcep byte streams, for offline replay (pcep_replay.py).
+
+file is header !4sI (magic, version) and records:
+    !dIBI timestamp, session id, event, length, then length bytes of data
+events:
+    OPEN - new session, data is peer address as 'ip:port'
+    DATA - bytes exactly as they were received from the socket (not cut
+           into msgs, so framing is replayed too)
+    CLOSE - end of session, no data
+"""
+import time
+import struct
+
+MAGIC = b'PCEC'
+VERSION = 1
+OPEN = 1
+DATA = 2
+CLOSE = 3
+
+_file_hdr = struct.Struct('!4sI')
+_record_hdr = struct.Struct('!dIBI')
+
+
+class CaptureWriter(object):
+    """
+    appends records to the capture file. writes are buffered and flushed
+    at most once per flush_interval seconds (checked on write), so
+    recording costs one buffered write per recv, not a syscall
+    """
+    def __init__(self, path, flush_interval=1.0, clock=time.time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._file = open(path, 'wb', 1 << 16)
+        self._file.write(_file_hdr.pack(MAGIC, VERSION))
+        self._flushed = clock()
+        self.records = 0
+
+    def _write(self, sid, event, data=b''):
+        now = self._clock()
+        self._file.write(_record_hdr.pack(now, sid, event, len(data)))
+        if data:
+            self._file.write(data)
+        self.records += 1
+        if now - self._flushed >= self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def opened(self, sid, peer):
+        self._write(sid, OPEN, ('%s:%s' % (peer[0], peer[1])).encode('ascii'))
+
+    def data(self, sid, data):
+        self._write(sid, DATA, data)
+
+    def closed(self, sid):
+        self._write(sid, CLOSE)
+        #controller is usually stopped by signal w/o any cleanup, so
+        #at least finished sessions are complete in the file
+        self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._flushed = self._clock()
+
+    def close(self):
+        self._file.close()
+
+
+def parse_peer(data):
+    """OPEN data back to (ip, port)"""
+    addr, port = data.decode('ascii').rsplit(':', 1)
+    return (addr, int(port))
+
+
+def read_capture(path):
+    """list of (timestamp, sid, event, data) records of the capture"""
+    with open(path, 'rb') as capture:
+        raw = capture.read()
+    if len(raw) < _file_hdr.size:
+        raise ValueError('%s: not a pcep capture' % (path,))
+    magic, version = _file_hdr.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s: not a pcep capture (or unknown version %s)' %
+                         (path, version))
+    records = list()
+    offset = _file_hdr.size
+    hdr_size = _record_hdr.size
+    while len(raw) - offset >= hdr_size:
+        timestamp, sid, event, length = _record_hdr.unpack_from(raw, offset)
+        offset += hdr_size
+        if len(raw) - offset < length:
+            #cut short by unclean stop of recording process
+            break
+        records.append((timestamp, sid, event, raw[offset:offset+length]))
+        offset += length
+    return records
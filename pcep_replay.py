@@ -0,0 +1,382 @@
+#!/usr/bin/python
+"""
+offline replay of pcep captures (pce_controller.py --record, see
+pcep_capture) as a repeatable throughput benchmark of parser and
+controller.
+
+every DATA record goes through PCEPFramer, every msg through
+PCEP.parse_rcved_msg, TEController.handle_pce_message and encoding of the
+reply, the same as in pce_controller.handle_pcep_msg (replies are
+dropped). captures of several files (e.g. of workers) are merged by
+timestamps into one controller. timers are not replayed, keepalives are
+just parsed.
+
+usage: pcep_replay.py [--speed X] [--allocations] capture [capture ...]
+       pcep_replay.py synth [--dir captures]
+
+speed 0 (default) is as fast as possible, 1 is the original pacing.
+synth writes synthetic captures (no routers needed):
+    sync - pccs sending their lsp db in S flagged PCRpts, end-of-sync
+           marker, keepalives
+    churn - pccs reporting delegated lsps one by one, then rerouting them
+            (every reroute is answered with PCUpd)
+    pcreq - topology learned from reports, then PCReqs, single and in
+            SVEC batches
+"""
+import gc
+import os
+import time
+import random
+import argparse
+import pcep
+import pcep_bench
+import pcep_capture
+import te_controller
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def load(paths):
+    """records of all the captures ordered by time, sid is (file, sid)"""
+    records = list()
+    for index, path in enumerate(paths):
+        records.extend([(timestamp, (index, sid), event, data)
+                        for timestamp, sid, event, data in
+                        pcep_capture.read_capture(path)])
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+class Replay(object):
+    """
+    feeds records into fresh TEController. latencies are per msg type,
+    in seconds, time of parse + handle + reply encoding of each msg
+    """
+    def __init__(self, controller, clock=time.time):
+        self.controller = controller
+        self.clock = clock
+        self.sessions = dict()
+        self.latencies = dict()
+        self.msgs = 0
+        self.replies = 0
+        self.reply_bytes = 0
+
+    def _msg(self, session, msg):
+        ctx, framer, peer = session[:3]
+        msg_type = pcep._common_hdr.unpack_from(msg)[1]
+        start = self.clock()
+        if not session[3]:
+            #first msg in session must be open
+            ctx.parse_rcved_msg(msg)
+            reply = ctx.generate_open_msg(20)
+            session[3] = True
+        else:
+            result = self.controller.handle_pce_message(
+                peer, ctx.parse_rcved_msg(msg))
+            reply = None
+            if result:
+                reply = ctx.generate_pcep_msg(result)
+        elapsed = self.clock() - start
+        self.latencies.setdefault(msg_type, list()).append(elapsed)
+        self.msgs += 1
+        if reply:
+            self.replies += 1
+            self.reply_bytes += len(reply)
+
+    def record(self, sid, event, data):
+        if event == pcep_capture.DATA:
+            session = self.sessions.get(sid)
+            if session is None:
+                return
+            for msg in session[1].feed(data):
+                self._msg(session, msg)
+        elif event == pcep_capture.OPEN:
+            peer = pcep_capture.parse_peer(data)
+            self.sessions[sid] = [pcep.PCEP(open_sid=sid[1], peer=peer[0]),
+                                  pcep.PCEPFramer(), peer, False]
+        elif event == pcep_capture.CLOSE:
+            session = self.sessions.pop(sid, None)
+            if session is not None:
+                self.controller.session_closed(session[2])
+
+    def run(self, records, speed=0, sleep=time.sleep):
+        """returns wall time of the replay"""
+        start = self.clock()
+        if not records:
+            return 0.0
+        first = records[0][0]
+        for timestamp, sid, event, data in records:
+            if speed:
+                delay = (timestamp - first) / speed - (self.clock() - start)
+                if delay > 0:
+                    sleep(delay)
+            self.record(sid, event, data)
+        return self.clock() - start
+
+
+def percentile(values, fraction):
+    """values must be sorted"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(replay, elapsed, allocated=None):
+    busy = sum([sum(values) for values in replay.latencies.values()])
+    print('  %s msgs, %s replies (%s bytes) in %.3f s, busy %.3f s' % (
+        replay.msgs, replay.replies, replay.reply_bytes, elapsed, busy))
+    if busy:
+        print('  %.0f msgs/s (%.0f msgs/s wall)' % (
+            replay.msgs / busy, replay.msgs / elapsed if elapsed else 0))
+    print('  %-18s %8s %9s %9s %9s %9s%s' % (
+        'msg', 'count', 'p50 us', 'p90 us', 'p99 us', 'max us',
+        '' if allocated is None else '  retained B/msg'))
+    for msg_type in sorted(replay.latencies):
+        values = sorted(replay.latencies[msg_type])
+        line = '  %-18s %8s %9.1f %9.1f %9.1f %9.1f' % (
+            pcep.MSG_NAMES.get(msg_type, msg_type), len(values),
+            percentile(values, 0.5)*1e6, percentile(values, 0.9)*1e6,
+            percentile(values, 0.99)*1e6, values[-1]*1e6)
+        if allocated is not None:
+            line += '  %15.0f' % (allocated.get(msg_type, 0) / len(values),)
+        print(line)
+
+
+class TracedReplay(Replay):
+    """
+    the same replay under tracemalloc: net traced memory per msg type
+    (what stays allocated after the msg, e.g. lsp records) and peak
+    """
+    def __init__(self, controller, clock=time.time):
+        Replay.__init__(self, controller, clock)
+        self.allocated = dict()
+
+    def _msg(self, session, msg):
+        msg_type = pcep._common_hdr.unpack_from(msg)[1]
+        before = tracemalloc.get_traced_memory()[0]
+        Replay._msg(self, session, msg)
+        self.allocated[msg_type] = self.allocated.get(msg_type, 0) + (
+            tracemalloc.get_traced_memory()[0] - before)
+
+
+def gc_collections():
+    if not hasattr(gc, 'get_stats'):
+        return None
+    return sum([stats['collections'] for stats in gc.get_stats()])
+
+
+def replay(args):
+    start = time.time()
+    records = load(args.captures)
+    print('%s records of %s sessions loaded in %.3f s' % (
+        len(records), len(set([record[1] for record in records])),
+        time.time() - start))
+    print('replay%s' % (' at %sx speed' % (args.speed,)
+                        if args.speed else ''))
+    controller = te_controller.TEController(args.path_cache_size,
+                                            args.link_state)
+    runner = Replay(controller)
+    collections = gc_collections()
+    elapsed = runner.run(records, args.speed)
+    report(runner, elapsed)
+    if collections is not None:
+        print('  gc collections: %s' % (gc_collections() - collections,))
+    if args.allocations:
+        if tracemalloc is None:
+            print('tracemalloc is not available, no allocations')
+            return
+        print('replay under tracemalloc (latencies are not comparable)')
+        traced = TracedReplay(te_controller.TEController(
+            args.path_cache_size, args.link_state))
+        tracemalloc.start()
+        elapsed = traced.run(records)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report(traced, elapsed, traced.allocated)
+        print('  retained %.1f KB, peak %.1f KB' % (size / 1024.0,
+                                                    peak / 1024.0))
+
+
+class SynthSession(object):
+    """pcc side of synthetic capture, msgs are written as they are sent"""
+    def __init__(self, writer, sid, addr, clock):
+        self.writer = writer
+        self.sid = sid
+        self.ctx = pcep.PCEP()
+        self.clock = clock
+        writer.opened(sid, (addr, 40000 + sid))
+        self.send(self.ctx.generate_open_msg(30))
+
+    def send(self, data, chunk=1 << 16):
+        #big bursts are cut the way they would come out of recv
+        for offset in range(0, len(data), chunk):
+            self.writer.data(self.sid, data[offset:offset+chunk])
+
+    def close(self):
+        self.writer.closed(self.sid)
+
+
+def synth_node(row, col):
+    return 0x0a000000 + (row << 8) + col
+
+
+def synth_path(rnd, side, src=None, dst=None):
+    """monotone random walk over side x side grid, so no loops"""
+    if src is None:
+        src = (rnd.randrange(side // 2), rnd.randrange(side // 2))
+    if dst is None:
+        dst = (rnd.randrange(src[0], side), rnd.randrange(src[1], side))
+    row, col = src
+    path = [synth_node(row, col)]
+    while (row, col) != dst:
+        if col == dst[1] or (row != dst[0] and rnd.random() < 0.5):
+            row += 1
+        else:
+            col += 1
+        path.append(synth_node(row, col))
+    return path
+
+
+def synth_lsp(ctx, plsp_id, path, sync=0, delegated=1):
+    if not plsp_id:
+        return ctx.generate_lsp_object_od((0,0,0,0,0))[1]
+    return b''.join([
+        ctx.generate_lsp_object_od((plsp_id,delegated,sync,1,0))[1],
+        ctx.generate_ero_object([(0, addr, 32) for addr in path])[1],
+        ctx.generate_lspa_object((7,7,0))[1],
+        ctx.generate_bw_object((1000,))[1],
+        pcep_bench.build_rro_object(ctx, path)])
+
+
+def synth_pcrpt(lsp_bodies):
+    body = b''.join(lsp_bodies)
+    return pcep._common_hdr.pack(32, 10, len(body)+4) + body
+
+
+class SynthClock(object):
+    def __init__(self, step):
+        self.now = 1e9
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def synth_sync(path, pccs=10, lsps=200, per_msg=20, side=10):
+    rnd = random.Random(20)
+    clock = SynthClock(0.001)
+    writer = pcep_capture.CaptureWriter(path, clock=clock)
+    sessions = [SynthSession(writer, sid, '10.1.0.%s' % (sid + 1,), clock)
+                for sid in range(pccs)]
+    for session in sessions:
+        msgs = list()
+        for start in range(1, lsps + 1, per_msg):
+            msgs.append(synth_pcrpt([
+                synth_lsp(session.ctx, plsp_id, synth_path(rnd, side),
+                          sync=1, delegated=plsp_id % 2)
+                for plsp_id in range(start, min(start + per_msg, lsps + 1))]))
+        msgs.append(synth_pcrpt([synth_lsp(session.ctx, 0, None)]))
+        session.send(b''.join(msgs))
+    for ka in range(3):
+        for session in sessions:
+            session.send(session.ctx.generate_ka_msg())
+    for session in sessions:
+        session.close()
+    writer.close()
+
+
+def synth_churn(path, pccs=10, lsps=100, reroutes=2, side=10):
+    rnd = random.Random(21)
+    clock = SynthClock(0.0005)
+    writer = pcep_capture.CaptureWriter(path, clock=clock)
+    sessions = [SynthSession(writer, sid, '10.2.0.%s' % (sid + 1,), clock)
+                for sid in range(pccs)]
+    ends = dict()
+    for session in sessions:
+        for plsp_id in range(1, lsps + 1):
+            lsp_path = synth_path(rnd, side)
+            ends[(session.sid, plsp_id)] = (lsp_path[0], lsp_path[-1])
+            session.send(synth_pcrpt([synth_lsp(session.ctx, plsp_id,
+                                                lsp_path)]))
+    for reroute in range(reroutes):
+        for plsp_id in range(1, lsps + 1):
+            for session in sessions:
+                src, dst = ends[(session.sid, plsp_id)]
+                lsp_path = synth_path(rnd, side, (src >> 8 & 0xff, src & 0xff),
+                                      (dst >> 8 & 0xff, dst & 0xff))
+                session.send(synth_pcrpt([synth_lsp(session.ctx, plsp_id,
+                                                    lsp_path)]))
+        for session in sessions:
+            session.send(session.ctx.generate_ka_msg())
+    for session in sessions:
+        session.close()
+    writer.close()
+
+
+def synth_pcreq(path, pccs=4, lsps=300, requests=500, batch=20, side=10):
+    rnd = random.Random(22)
+    clock = SynthClock(0.001)
+    writer = pcep_capture.CaptureWriter(path, clock=clock)
+    sessions = [SynthSession(writer, sid, '10.3.0.%s' % (sid + 1,), clock)
+                for sid in range(pccs)]
+    #reported lsps are the only source of topology
+    for session in sessions:
+        session.send(synth_pcrpt([
+            synth_lsp(session.ctx, plsp_id, synth_path(rnd, side))
+            for plsp_id in range(1, lsps // pccs + 1)]))
+    req_id = 1
+    for index in range(requests // batch):
+        for session in sessions:
+            svec = index % 2
+            obj_list = list()
+            if svec:
+                obj_list.append(('svec', (0, 0, 0, tuple(
+                    range(req_id, req_id + batch)))))
+            for request in range(batch if svec else 1):
+                src = synth_node(rnd.randrange(side), rnd.randrange(side))
+                dst = synth_node(rnd.randrange(side), rnd.randrange(side))
+                obj_list += [('rp', (req_id, 0, 0, 0, 0)),
+                             ('endpoints', (src, dst)),
+                             ('bw', (rnd.choice((100, 1000, 10000)),))]
+                req_id += 1
+            session.send(session.ctx.generate_pcreq_msg(obj_list))
+    for session in sessions:
+        session.close()
+    writer.close()
+
+
+def synth(args):
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    for name, generate in (('sync', synth_sync), ('churn', synth_churn),
+                           ('pcreq', synth_pcreq)):
+        path = os.path.join(args.dir, '%s.pcepcap' % (name,))
+        generate(path)
+        print('%s: %s bytes' % (path, os.path.getsize(path)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay of pcep captures')
+    parser.add_argument('captures', nargs='+',
+                        help="capture files, or 'synth' to generate them")
+    parser.add_argument('--speed', type=float, default=0,
+                        help='pacing relative to the capture, 0 is as '
+                             'fast as possible')
+    parser.add_argument('--allocations', action='store_true',
+                        help='second replay under tracemalloc')
+    parser.add_argument('--link-state', action='store_true',
+                        help='per priority link accounting (needs numpy)')
+    parser.add_argument('--path-cache-size', type=int, default=10000)
+    parser.add_argument('--dir', default='captures',
+                        help='where synth writes captures')
+    args = parser.parse_args()
+    if args.captures == ['synth']:
+        synth(args)
+    else:
+        replay(args)
+
+
+if __name__ == '__main__':
+    main()
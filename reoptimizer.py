@@ -0,0 +1,209 @@
+"""
+background re-optimization of delegated lsps.
+
+every interval all delegated lsps from lsp_dict are recomputed with CSPF
+against current TED (in priority order, best setup/hold priority first)
+and PCUpd is sent only if the new path is better than current one by more
+than threshold. bandwidth of the lsp is moved to the new path in TED right
+away, so next lsps of the wave see it (PCC's report of the new path
+doesnt change anything then, report of the old one moves it back).
+PCUpds are rate limited with token buckets, per PCC and
+overall, so one wave can't overload headends or our own event loop.
+"""
+import time
+import logging
+from array import array
+import lsp_store
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """rate tokens per second, up to burst tokens could be spent at once"""
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._tokens = self.burst
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def available(self):
+        self._refill()
+        return self._tokens >= 1
+
+    def consume(self, tokens=1):
+        """returns False (and consumes nothing) if there is not enough"""
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def wait_time(self, tokens=1):
+        """seconds until tokens are available"""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+
+class Reoptimizer(object):
+    """
+    send(pcc ip, list of updates) sends PCUpd to the pcc and returns False
+    if there is no session with it (or it is congested, the lsp is tried
+    again by the next wave). sleep is used for waiting on overall
+    token bucket and to give other greenlets a chance every yield_every
+    lsps, e.g. gevent.sleep (see wave for other event loops)
+    """
+    yield_every = 100
+
+    def __init__(self, controller, send, interval=60, threshold=0.1,
+                 pcc_rate=10, pcc_burst=20, rate=100, burst=100,
+                 sleep=time.sleep, clock=time.time, owns=None):
+        self.controller = controller
+        #optional filter of pccs this process is responsible for
+        self.owns = owns
+        self.send = send
+        self.interval = interval
+        self.threshold = threshold
+        self.pcc_rate = pcc_rate
+        self.pcc_burst = pcc_burst
+        self._sleep = sleep
+        self._clock = clock
+        self._bucket = TokenBucket(rate, burst, clock)
+        self._pcc_buckets = dict()
+        self.stats = {'waves': 0, 'checked': 0, 'updates': 0,
+                      'deferred': 0, 'no_session': 0}
+
+    def pcc_bucket(self, pcc):
+        bucket = self._pcc_buckets.get(pcc)
+        if bucket is None:
+            bucket = self._pcc_buckets[pcc] = TokenBucket(
+                self.pcc_rate, self.pcc_burst, self._clock)
+        return bucket
+
+    def candidates(self):
+        """delegated lsps in priority order (0 is the best priority)"""
+        lsps = self.controller.lsp_dict.delegated_lsps()
+        if self.owns is not None:
+            lsps = [lsp for lsp in lsps if self.owns(lsp.pcc)]
+        return sorted(lsps,
+                      key=lambda lsp: (lsp.setup_prio, lsp.hold_prio,
+                                       lsp.pcc, lsp.plsp_id))
+
+    def path_cost(self, links):
+        metric = self.controller.ted.metric
+        return sum([metric[link] for link in links])
+
+    def better_path(self, lsp):
+        """
+        links of the new path if it is better than current one by more
+        than threshold, None otherwise
+        """
+        te_db = self.controller.ted
+        links = te_db.lsp_links(lsp.key())[0]
+        if not links:
+            return None
+        path = self.controller.cspf.shortest_path(
+            lsp.pcc, te_db.nodes[te_db.link_dst[links[-1]]], lsp.bandwidth,
+            own_links=set(links))
+        if path is None:
+            return None
+        if path[0] >= self.path_cost(links) * (1 - self.threshold):
+            return None
+        return path[1]
+
+    def updated_lsp(self, lsp, links):
+        """copy of lsp with strict ero along the links (and w/o rro)"""
+        new_lsp = lsp.copy()
+        new_lsp.ero = array('I')
+        new_lsp.rro = array('I')
+        for loose, addr, mask in self.controller.cspf.ero(links):
+            new_lsp.add_ero_hop(loose, addr, mask)
+        return new_lsp
+
+    def run_once(self):
+        """one wave over all delegated lsps, returns number of PCUpds"""
+        sent = [0]
+        for delay in self.wave(sent):
+            self._sleep(delay)
+        return sent[0]
+
+    def wave(self, sent):
+        """
+        one wave as generator of delays (seconds) it wants to sleep for,
+        so it could be driven by any event loop; see run_once.
+        number of PCUpds is added to sent[0].
+        lsps could be reported, removed or undelegated while we are yielding,
+        so queued updates are sent before each yield and lsps are taken
+        from lsp_dict again after it
+        """
+        self.stats['waves'] += 1
+        updates = dict()
+        lsp_dict = self.controller.lsp_dict
+        for checked, lsp in enumerate(self.candidates()):
+            self.stats['checked'] += 1
+            if checked % self.yield_every == self.yield_every - 1:
+                sent[0] += self._flush(updates)
+                yield 0
+            pcc_bucket = self.pcc_bucket(lsp.pcc)
+            if not pcc_bucket.available():
+                #this pcc had enough for now, next wave will get it
+                self.stats['deferred'] += 1
+                continue
+            wait = self._bucket.wait_time()
+            if wait:
+                sent[0] += self._flush(updates)
+                yield wait
+            lsp = lsp_dict.get(lsp.key())
+            if lsp is None or not lsp.delegated:
+                continue
+            links = self.better_path(lsp)
+            if links is None:
+                continue
+            pcc_bucket.consume()
+            self._bucket.consume()
+            new_lsp = self.updated_lsp(lsp, links)
+            self.controller.ted.update_lsp(lsp.key(), new_lsp)
+            updates.setdefault(lsp.pcc, list()).append(
+                (lsp, self.controller.generate_lsp_upd_msg_od(new_lsp)))
+        sent[0] += self._flush(updates)
+
+    def _flush(self, updates):
+        sent = 0
+        for pcc, pcc_updates in updates.items():
+            if self.send(lsp_store.int2ip(pcc),
+                         [upd for lsp, upd in pcc_updates]):
+                sent += len(pcc_updates)
+                continue
+            self.stats['no_session'] += len(pcc_updates)
+            for lsp, upd in pcc_updates:
+                #nothing was sent, bandwidth goes back to the old path, or
+                #to whatever is stored now (send could switch greenlets)
+                key = lsp.key()
+                current = self.controller.lsp_dict.get(key)
+                if current is None:
+                    self.controller.ted.remove_lsp(key)
+                else:
+                    self.controller.ted.update_lsp(key, current)
+        updates.clear()
+        self.stats['updates'] += sent
+        return sent
+
+    def run_forever(self):
+        while True:
+            self._sleep(self.interval)
+            start = self._clock()
+            try:
+                sent = self.run_once()
+            except Exception:
+                log.exception('reoptimization failed')
+                continue
+            log.info('reoptimization: %s updates in %.3f s', sent,
+                     self._clock() - start)
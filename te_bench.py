@@ -0,0 +1,702 @@
+#!/usr/bin/python
+"""
+benchmarks of the controller side: lsp db, te computations etc.
+
+usage: te_bench.py [store] [records] [ted] [cspf] [pathcache] [batch]
+                   [reopt] [linkstate] [journal] [sync] [reports]
+                   [metrics]
+                   [--lsps N] [--nodes N]
+"""
+import gc
+import shutil
+import timeit
+import tempfile
+import pcep
+import pcep_bench
+import random
+import argparse
+import lsp_store
+import ted
+import cspf
+import te_controller
+import reoptimizer
+import link_state
+import lsp_journal
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def timed(func):
+    start = timeit.default_timer()
+    result = func()
+    return timeit.default_timer() - start, result
+
+
+def synthetic_path(pcc, plsp_id, nodes, hops):
+    """pseudo random, but stable path of hops nodes out of nodes"""
+    return [0x0a000000 + ((pcc * 7919 + plsp_id * 104729 + hop * 31) % nodes)
+            for hop in range(hops)]
+
+
+def make_lsp(pcc, plsp_id, path, delegated=True, bandwidth=1000):
+    lsp = lsp_store.LSPRecord(pcc, plsp_id)
+    lsp.delegated = delegated
+    lsp.setup_prio = 7
+    lsp.hold_prio = 7
+    lsp.bandwidth = bandwidth
+    for hop in path:
+        lsp.add_ero_hop(0, hop, 32)
+        lsp.add_rro_hop(hop, 32)
+    return lsp
+
+
+def make_pb_lsp(pcc, plsp_id, path, delegated=True, bandwidth=1000):
+    """the way lsps were stored before LSPRecord"""
+    return make_lsp(pcc, plsp_id, path, delegated, bandwidth).to_pb()
+
+
+class PBLSPStore(lsp_store.LSPStore):
+    """LSPStore on top of protobuf LSPs, for comparison"""
+    def lsp_hops(self, lsp):
+        hops = lsp.rro if lsp.rro else lsp.ero
+        return set([lsp_store.ip2int(hop.node_ip) for hop in hops])
+
+    def lsp_delegated(self, lsp):
+        return lsp.lsp_obj.delegated
+
+
+def synthetic_lsps(lsps, pccs=100, nodes=1000, hops=6, make=make_lsp):
+    result = list()
+    for index in range(lsps):
+        pcc = 0xc0a80000 + index % pccs
+        plsp_id = index // pccs + 1
+        path = synthetic_path(pcc, plsp_id, nodes, hops)
+        result.append(((pcc, plsp_id),
+                       make(pcc, plsp_id, path, delegated=index % 2)))
+    return result
+
+
+def report(name, elapsed, ops):
+    print('  %-28s %10.1f ms %10.2f us/op' % (name, elapsed*1e3,
+                                              elapsed*1e6/max(ops, 1)))
+
+
+def bench_store(lsps):
+    print('lsp store, %s lsps' % (lsps,))
+    records = synthetic_lsps(lsps)
+    store = lsp_store.LSPStore()
+
+    def insert():
+        for key, lsp in records:
+            store.update(key, lsp)
+    report('insert', timed(insert)[0], lsps)
+
+    moved = synthetic_lsps(lsps, nodes=997)
+
+    def update():
+        for key, lsp in moved:
+            store.update(key, lsp)
+    report('update (path moved)', timed(update)[0], lsps)
+
+    pcc = records[0][0][0]
+    elapsed, result = timed(lambda: store.lsps_by_pcc(pcc))
+    report('lsps_by_pcc (%s)' % (len(result),), elapsed, 1)
+    elapsed, result = timed(store.delegated_lsps)
+    report('delegated_lsps (%s)' % (len(result),), elapsed, 1)
+    elapsed, result = timed(lambda: store.lsps_via_node(0x0a000001))
+    report('lsps_via_node (%s)' % (len(result),), elapsed, 1)
+
+    def full_scan():
+        return [lsp for key, lsp in store.items()
+                if key[0] == pcc]
+    report('full scan for comparison', timed(full_scan)[0], 1)
+
+    def delete():
+        for key, lsp in moved:
+            store.delete(key)
+    report('delete', timed(delete)[0], lsps)
+
+
+def measure_memory(func):
+    """returns (elapsed, bytes allocated and still alive, result)"""
+    gc.collect()
+    if tracemalloc is None:
+        elapsed, result = timed(func)
+        return elapsed, None, result
+    tracemalloc.start()
+    elapsed, result = timed(func)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, result
+
+
+def bench_records(lsps):
+    """memory and throughput of slotted records vs protobuf messages"""
+    print('lsp records, %s lsps' % (lsps,))
+    kinds = [('LSPRecord', make_lsp, lsp_store.LSPStore)]
+    try:
+        import mpls_lsp_pb2
+        kinds.append(('mpls_lsp_pb2.LSP', make_pb_lsp, PBLSPStore))
+    except ImportError:
+        print('  protobuf is not available, skipping mpls_lsp_pb2.LSP')
+    for name, make, store_class in kinds:
+        elapsed, size, records = measure_memory(
+            lambda: synthetic_lsps(lsps, make=make))
+        if size is not None:
+            print('  %-18s %8.1f MB %8.1f bytes/lsp' % (
+                name, size/1e6, float(size)/lsps))
+        report('%s build' % (name,), elapsed, lsps)
+        store = store_class()
+
+        def insert():
+            for key, lsp in records:
+                store.update(key, lsp)
+        report('%s store insert' % (name,), timed(insert)[0], lsps)
+
+        def compare():
+            for key, lsp in records:
+                store.get(key) == lsp
+        report('%s compare' % (name,), timed(compare)[0], lsps)
+    bench_reported_records(lsps)
+
+
+def bench_reported_records(lsps, hops=8):
+    """
+    memory of LSPRecords built out of PCRpts (with path_key of their raw
+    ERO/RRO), the way the controller is storing them
+    """
+    ctx = pcep.PCEP()
+    msg = pcep_bench.build_pcrpt(ctx, 100, hops)
+    controller = te_controller.TEController()
+    pccs = range(1, max(1, lsps // 100) + 1)
+
+    def reported():
+        records = list()
+        for pcc in pccs:
+            records.extend(controller.report_to_lsps(
+                pcc, ctx.parse_rcved_msg(memoryview(msg)))[0])
+        return records
+    elapsed, size, records = measure_memory(reported)
+    if size is not None:
+        print('  %-18s %8.1f MB %8.1f bytes/lsp (%s hops)' % (
+            'LSPRecord reported', size/1e6, float(size)/len(records), hops))
+    report('LSPRecord from PCRpt', elapsed, len(records))
+
+
+def bench_ted(lsps):
+    print('ted, %s lsps' % (lsps,))
+    records = synthetic_lsps(lsps)
+    te_db = ted.TED()
+
+    def add():
+        for key, lsp in records:
+            te_db.update_lsp(key, lsp)
+    report('incremental add', timed(add)[0], lsps)
+    print('  %s nodes %s links' % (te_db.node_count(), te_db.link_count()))
+    moved = synthetic_lsps(lsps, nodes=997)
+
+    def move():
+        for key, lsp in moved:
+            te_db.update_lsp(key, lsp)
+    report('incremental move', timed(move)[0], lsps)
+    report('rebuild', timed(lambda: te_db.rebuild(records))[0], lsps)
+
+    def remove():
+        for key, lsp in records:
+            te_db.remove_lsp(key)
+    report('remove', timed(remove)[0], lsps)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*pct/100.0))]
+
+
+def grid_topology(nodes, capacity=10000):
+    """square grid, links in both directions"""
+    side = int(nodes ** 0.5)
+    te_db = ted.TED()
+    for row in range(side):
+        for col in range(side):
+            node = row * side + col + 1
+            if col + 1 < side:
+                te_db.add_link(node, node + 1, capacity)
+                te_db.add_link(node + 1, node, capacity)
+            if row + 1 < side:
+                te_db.add_link(node, node + side, capacity)
+                te_db.add_link(node + side, node, capacity)
+    return te_db
+
+
+def random_topology(nodes, degree=4, capacity=10000, seed=1, te_db=None):
+    """ring (so it is connected) plus random chords, random metrics"""
+    rnd = random.Random(seed)
+    if te_db is None:
+        te_db = ted.TED()
+    for node in range(1, nodes+1):
+        nbr = node % nodes + 1
+        metric = rnd.randint(1, 10)
+        te_db.add_link(node, nbr, capacity, metric)
+        te_db.add_link(nbr, node, capacity, metric)
+    for _ in range(nodes * (degree - 2) // 2):
+        src = rnd.randint(1, nodes)
+        dst = rnd.randint(1, nodes)
+        if src != dst:
+            metric = rnd.randint(1, 10)
+            te_db.add_link(src, dst, capacity, metric)
+            te_db.add_link(dst, src, capacity, metric)
+    return te_db
+
+
+def load_topology(te_db, fraction=0.3, seed=2):
+    """reserves random part of capacity on fraction of links"""
+    rnd = random.Random(seed)
+    for link in range(te_db.link_count()):
+        if rnd.random() < fraction:
+            te_db.reserved[link] = te_db.capacity[link] * rnd.random()
+
+
+def bench_cspf(nodes, queries=2000):
+    print('cspf, %s nodes, %s queries' % (nodes, queries))
+    rnd = random.Random(3)
+    for name, te_db in (('grid', grid_topology(nodes)),
+                        ('random', random_topology(nodes))):
+        load_topology(te_db)
+        engine = cspf.CSPF(te_db)
+        node_count = te_db.node_count()
+        pairs = [(rnd.randint(1, node_count), rnd.randint(1, node_count))
+                 for _ in range(queries)]
+        for bandwidth in (0, 5000):
+            latencies = list()
+            found = 0
+            for src, dst in pairs:
+                elapsed, path = timed(
+                    lambda: engine.shortest_path(src, dst, bandwidth))
+                latencies.append(elapsed)
+                found += path is not None
+            print('  %-7s %5s links bw %5s: mean %7.1f us p50 %7.1f us '
+                  'p99 %7.1f us, %s/%s paths' % (
+                      name, te_db.link_count(), bandwidth,
+                      sum(latencies)/len(latencies)*1e6,
+                      percentile(latencies, 50)*1e6,
+                      percentile(latencies, 99)*1e6, found, queries))
+
+
+def bench_path_cache(nodes, queries=20000, distinct=500):
+    """requests repeating out of small set, like re-signalling after flap"""
+    print('path cache, %s nodes, %s queries, %s distinct' % (
+        nodes, queries, distinct))
+    rnd = random.Random(4)
+    controller = te_controller.TEController()
+    load_topology(random_topology(nodes, te_db=controller.ted))
+    distinct_requests = [
+        {'rp':(1, 1, 0, 0, 0), 'endpoints':(rnd.randint(1, nodes),
+                                            rnd.randint(1, nodes)),
+         'bw':rnd.choice((0, 1000, 5000)), 'lspa':(7, 7, 0),
+         'metric':[(2, 0, 1, 0)]} for _ in range(distinct)]
+    requests = [rnd.choice(distinct_requests) for _ in range(queries)]
+
+    def uncached():
+        for request in requests:
+            controller.compute_path_objects(request)
+    report('cspf only', timed(uncached)[0], queries)
+
+    def cached():
+        for request in requests:
+            controller.compute_request(request)
+    report('through path cache', timed(cached)[0], queries)
+    print('  %s' % (controller.path_cache.stats(),))
+
+
+def bench_batch(nodes, requests=500, headends=(1, 4, 50)):
+    """headends re-signalling all their lsps in one PCReq each"""
+    print('batched pcreq, %s nodes, %s requests' % (nodes, requests))
+    rnd = random.Random(5)
+    controller = te_controller.TEController()
+    load_topology(random_topology(nodes, te_db=controller.ted))
+    for count in headends:
+        batch = [{'rp':(index, 1, 0, 0, 0),
+                  'endpoints':(index % count + 1, rnd.randint(1, nodes)),
+                  'bw':1000, 'lspa':(7, 7, 0), 'metric':list()}
+                 for index in range(requests)]
+
+        def one_by_one():
+            for request in batch:
+                controller.compute_path_objects(request)
+        report('%s headends one by one' % (count,), timed(one_by_one)[0],
+               requests)
+        controller.path_cache.clear()
+        report('%s headends batch' % (count,),
+               timed(lambda: controller.compute_requests(batch))[0],
+               requests)
+
+
+def check_reopt_changes(lsps=200, nodes=64, hops=8):
+    """
+    pcc removed (its session is dead) or undelegating its lsps while the
+    wave is yielding: no TED reservations left behind, no PCUpds for them
+    """
+    for change in ('remove', 'undelegate'):
+        rnd = random.Random(7)
+        controller = te_controller.TEController()
+        te_db = random_topology(nodes, te_db=controller.ted)
+        for plsp_id in range(1, lsps+1):
+            path = list()
+            node = 1
+            for _ in range(hops):
+                node = rnd.choice(te_db.neighbours(node))[0]
+                if node == 1 or node in path:
+                    break
+                path.append(node)
+            if not path:
+                continue
+            lsp = make_lsp(1, plsp_id, path, bandwidth=1)
+            controller.lsp_dict.update(lsp.key(), lsp)
+            te_db.update_lsp(lsp.key(), lsp)
+        updates = list()
+
+        def send(pcc_ip, upd_list):
+            if change == 'remove':
+                #no session
+                return False
+            updates.extend(upd_list)
+            return True
+        reopt = reoptimizer.Reoptimizer(
+            controller, send, pcc_rate=1e9, pcc_burst=1e9, rate=1e9,
+            burst=1e9)
+        wave = reopt.wave([0])
+        next(wave)
+        sent = len(updates)
+        assert reopt.stats['updates'] + reopt.stats['no_session']
+        if change == 'remove':
+            controller.remove_pcc('0.0.0.1')
+        else:
+            for lsp in controller.lsp_dict.delegated_lsps():
+                lsp = lsp.copy()
+                lsp.delegated = 0
+                controller.lsp_dict.update(lsp.key(), lsp)
+        for delay in wave:
+            pass
+        if change == 'remove':
+            assert sum(te_db.reserved) == 0, sum(te_db.reserved)
+            assert not te_db._lsp_links
+        else:
+            assert len(updates) == sent
+            assert sum(te_db.reserved) == sum(
+                [lsp.bandwidth * len(te_db.lsp_links(key)[0])
+                 for key, lsp in controller.lsp_dict.items()])
+
+
+def bench_reopt(lsps, nodes, hops=8):
+    """one reoptimization wave over delegated lsps on random walk paths"""
+    print('reoptimization, %s lsps, %s nodes' % (lsps, nodes))
+    check_reopt_changes()
+    rnd = random.Random(6)
+    controller = te_controller.TEController()
+    te_db = random_topology(nodes, te_db=controller.ted)
+    for plsp_id in range(1, lsps+1):
+        pcc = rnd.randint(1, nodes)
+        path = list()
+        node = pcc
+        for _ in range(hops):
+            node = rnd.choice(te_db.neighbours(node))[0]
+            if node == pcc or node in path:
+                break
+            path.append(node)
+        if not path:
+            continue
+        lsp = make_lsp(pcc, plsp_id, path, delegated=plsp_id % 2,
+                       bandwidth=rnd.randint(1, 100))
+        controller.lsp_dict.update(lsp.key(), lsp)
+        te_db.update_lsp(lsp.key(), lsp)
+    reopt = reoptimizer.Reoptimizer(
+        controller, lambda pcc_ip, upd_list: True,
+        pcc_rate=1e9, pcc_burst=1e9, rate=1e9, burst=1e9,
+        sleep=lambda seconds: None)
+    checked = len(controller.lsp_dict.delegated_lsps())
+    report('wave over %s delegated' % (checked,),
+           timed(reopt.run_once)[0], checked)
+    report('next wave', timed(reopt.run_once)[0], checked)
+    print('  %s' % (reopt.stats,))
+
+
+def check_link_state(links=3000):
+    """
+    queries of LinkState over TED with more links than its initial size,
+    most of them learned w/o any lsp accounted on them
+    """
+    te_db = ted.TED()
+    for link in range(links):
+        te_db.set_link_capacity(link + 1, link + 2, 1000)
+    state = link_state.LinkState(te_db)
+    te_db.lsp_listeners.append(state)
+    lsp = make_lsp(1, 1, [2, 3, 4], bandwidth=100)
+    lsp.hold_prio = 3
+    te_db.update_lsp(lsp.key(), lsp)
+    tail = (links - 2, links - 1)
+    assert len(state.reserved()) == links
+    assert len(state.unreserved(3)) == links
+    assert len(state.utilization()) == links
+    assert state.most_utilized(1)[0] == (0, 0.1)
+    assert state.headroom(tail) == 1000
+    assert state.headroom((0, 1, 2), 3) == 900
+    assert state.headroom((0, 1, 2), 2) == 1000
+    assert list(state.headroom_paths([tail, (0, 1)], 3)) == [1000, 900]
+    #the same path (and hops array) only at a better hold priority
+    moved = lsp.copy()
+    moved.hold_prio = 1
+    assert te_db.update_lsp(moved.key(), moved)
+    assert state.headroom((0, 1, 2), 0) == 1000
+    assert state.headroom((0, 1, 2), 1) == 900
+    assert not te_db.update_lsp(moved.key(), moved)
+
+
+def bench_link_state(lsps):
+    print('link state, %s lsps' % (lsps,))
+    if link_state.numpy is None:
+        print('  numpy is not available, skipping')
+        return
+    check_link_state()
+    records = synthetic_lsps(lsps)
+    te_db = ted.TED()
+    for key, lsp in records:
+        te_db.update_lsp(key, lsp)
+    state = link_state.LinkState(te_db)
+    batch = [(key, te_db.lsp_links(key)[0], lsp.bandwidth, lsp.hold_prio)
+             for key, lsp in records]
+
+    def one_by_one():
+        for key, links, bandwidth, priority in batch:
+            state.update_lsp(key, links, bandwidth, priority)
+    report('update_lsp one by one', timed(one_by_one)[0], lsps)
+    state.clear()
+    report('update_lsps bulk', timed(lambda: state.update_lsps(batch))[0],
+           lsps)
+    report('bulk move (same lsps again)',
+           timed(lambda: state.update_lsps(batch))[0], lsps)
+
+    report('most_utilized(10)', timed(lambda: state.most_utilized(10))[0], 1)
+    report('links_above(0.5)', timed(lambda: state.links_above(0.5))[0], 1)
+    paths = [links for key, links, bandwidth, priority in batch]
+    report('headroom_paths (%s paths)' % (len(paths),),
+           timed(lambda: state.headroom_paths(paths, 3))[0], len(paths))
+
+    def python_headroom():
+        #totals only, python would need per priority sums on top of it
+        capacity = te_db.capacity
+        reserved = te_db.reserved
+        return [min([capacity[link] - reserved[link] for link in links])
+                for links in paths]
+    report('same in python loop', timed(python_headroom)[0], len(paths))
+
+
+def bench_journal(lsps):
+    print('lsp journal, %s lsps' % (lsps,))
+    records = synthetic_lsps(lsps)
+    path = tempfile.mkdtemp()
+    try:
+        journal = lsp_journal.LSPJournal(path)
+        journal.start(lsp_store.LSPStore(), writer_thread=False)
+        report('queue changes (listener)', timed(lambda: [
+            journal.lsp_updated(key, lsp) for key, lsp in records])[0], lsps)
+        report('encode and write batch', timed(journal.flush)[0], lsps)
+        report('compact', timed(journal.compact)[0], lsps)
+        journal.stop()
+        controller = te_controller.TEController()
+        report('load (store and ted)', timed(lambda: lsp_journal.LSPJournal(
+            path).load(controller))[0], lsps)
+        encoded = [lsp_journal.encode_lsp(lsp) for key, lsp in records]
+        hops = dict()
+        report('decode_lsp', timed(lambda: [
+            lsp_journal.decode_lsp(data, key, hops) for data, (key, lsp) in
+            zip(encoded, records)])[0], lsps)
+    finally:
+        shutil.rmtree(path)
+    try:
+        import mpls_lsp_pb2
+    except ImportError:
+        print('  protobuf is not available, skipping mpls_lsp_pb2.LSP')
+        return
+    serialized = [lsp.to_pb().SerializeToString() for key, lsp in records]
+
+    def pb_decode():
+        for data in serialized:
+            lsp = mpls_lsp_pb2.LSP()
+            lsp.ParseFromString(data)
+            lsp_store.LSPRecord.from_pb(lsp)
+    report('protobuf decode + from_pb', timed(pb_decode)[0], lsps)
+
+
+def state_report_msg(ctx, pcc, plsp_id, sync):
+    """PCRpt with one lsp, the way pcc is sending its db"""
+    if not plsp_id:
+        body = ctx.generate_lsp_object_od((0,0,0,0,0))[1]
+    else:
+        path = synthetic_path(pcc, plsp_id, 1000, 6)
+        body = b''.join([
+            ctx.generate_lsp_object_od((plsp_id,plsp_id % 2,sync,1,0))[1],
+            ctx.generate_ero_object([(0, addr, 32) for addr in path])[1],
+            ctx.generate_lspa_object((7,7,0))[1],
+            ctx.generate_bw_object((1000,))[1],
+            pcep_bench.build_rro_object(ctx, path)])
+    return pcep._common_hdr.pack(32, 10, len(body)+4) + body
+
+
+def state_report(ctx, pcc, plsp_id, sync):
+    """parsed PCRpt with one lsp, the way pcc is sending its db"""
+    return ctx.parse_rcved_msg(memoryview(
+        state_report_msg(ctx, pcc, plsp_id, sync)))
+
+
+def check_sync_marker():
+    """lsps in the same PCRpt after end of sync marker are synced too"""
+    ctx = pcep.PCEP()
+    pcc_ip = ('192.168.0.1', 40000)
+    pcc = lsp_store.ip2int(pcc_ip[0])
+    body = b''.join([state_report_msg(ctx, pcc, plsp_id, 1)[4:]
+                     for plsp_id in (1, 0, 2)])
+    msg = pcep._common_hdr.pack(32, 10, len(body)+4) + body
+    controller = te_controller.TEController()
+    controller.handle_pce_message(pcc_ip, ctx.parse_rcved_msg(
+        memoryview(msg)))
+    assert sorted([lsp.plsp_id for lsp in
+                   controller.lsp_dict.lsps_by_pcc(pcc)]) == [1, 2]
+    assert pcc_ip not in controller._syncs
+
+
+def bench_sync(lsps):
+    print('state sync of one pcc, %s lsps, one lsp per PCRpt' % (lsps,))
+    check_sync_marker()
+    ctx = pcep.PCEP()
+    pcc_ip = ('192.168.0.1', 40000)
+    pcc = lsp_store.ip2int(pcc_ip[0])
+    variants = [(False, False), (False, True)]
+    if link_state.numpy is not None:
+        variants += [(True, False), (True, True)]
+    for with_link_state, sync in variants:
+        msgs = [state_report(ctx, pcc, plsp_id, int(sync))
+                for plsp_id in range(1, lsps+1)]
+        if sync:
+            msgs.append(state_report(ctx, pcc, 0, 0))
+        controller = te_controller.TEController(
+            with_link_state=with_link_state)
+
+        def run():
+            return sum([len(result[1]) for result in
+                        [controller.handle_pce_message(pcc_ip, msg)
+                         for msg in msgs] if result[0]])
+        name = '%s%s' % ('bulk sync' if sync else 'per report',
+                         ', link state' if with_link_state else '')
+        elapsed, updates = timed(run)
+        report('%s (%s upds)' % (name, updates), elapsed, lsps)
+        elapsed, updates = timed(run)
+        report('  again, same state (%s upds)' % (updates,), elapsed, lsps)
+
+
+def bench_reports(lsps, hops_list=(4, 16, 32)):
+    """
+    PCRpts of 100 lsps each (one per pcc), new lsps and then the same
+    reports again. unchanged paths are not decoded, so repeated reports
+    should cost about the same for any path length
+    """
+    print('state reports, %s lsps, 100 lsps per PCRpt' % (lsps,))
+    ctx = pcep.PCEP()
+    peers = [('10.%s.%s.%s' % (pcc >> 16, (pcc >> 8) & 255, pcc & 255),
+              40000) for pcc in range(1, max(1, lsps // 100) + 1)]
+    for hops in hops_list:
+        msg = pcep_bench.build_pcrpt(ctx, 100, hops)
+        controller = te_controller.TEController()
+
+        def run():
+            for peer in peers:
+                controller.handle_pce_message(peer, ctx.parse_rcved_msg(msg))
+        report('%s hops, new lsps' % (hops,), timed(run)[0], len(peers)*100)
+        report('  again, unchanged', timed(run)[0], len(peers)*100)
+
+
+class NullSession(object):
+    def send(self, data, timeout=None, force=False):
+        return True
+
+
+def bench_metrics(lsps, pccs=100):
+    """overhead of pce_metrics in pce_controller.handle_pcep_msg"""
+    import pce_metrics
+    import pce_controller
+    print('metrics overhead, %s PCRpts (one new delegated lsp each)' % (
+        lsps,))
+    ctx = pcep.PCEP()
+    peers = [('192.168.%s.%s' % (pcc // 250, pcc % 250 + 1), 40000)
+             for pcc in range(pccs)]
+    msgs = [(peers[index % pccs], state_report_msg(
+                ctx, lsp_store.ip2int(peers[index % pccs][0]),
+                index // pccs + 1, 0))
+            for index in range(lsps)]
+    session = NullSession()
+
+    def plain(controller):
+        #handle_pcep_msg before metrics
+        for peer, msg in msgs:
+            result = controller.handle_pce_message(
+                peer, ctx.parse_rcved_msg(msg))
+            if result:
+                pcep_msg = ctx.generate_pcep_msg(result)
+                if pcep_msg:
+                    session.send(pcep_msg)
+
+    def with_metrics(controller):
+        for peer, msg in msgs:
+            pce_controller.handle_pcep_msg(ctx, session, peer, msg,
+                                           controller)
+    for name, func in (('w/o metrics', plain),
+                       ('with metrics', with_metrics)):
+        elapsed = min([timed(lambda: func(te_controller.TEController()))[0]
+                       for attempt in range(3)])
+        report(name, elapsed, lsps)
+    metrics = pce_metrics.Metrics()
+    histogram = metrics.parse[10]
+    report('  Histogram.observe', timed(lambda: [
+        histogram.observe(0.00003) for index in range(lsps)])[0], lsps)
+    report('  Metrics.received', timed(lambda: [
+        metrics.received(peer[0], 10, 100) for peer, msg in msgs])[0], lsps)
+    report('  Metrics.render, %s pccs' % (pccs,),
+           timed(metrics.render)[0], 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='controller benchmarks')
+    parser.add_argument('benchmarks', nargs='*', default=['store'])
+    parser.add_argument('--lsps', type=int, default=100000)
+    parser.add_argument('--nodes', type=int, default=1024)
+    args = parser.parse_args()
+    if 'store' in args.benchmarks:
+        bench_store(args.lsps)
+    if 'records' in args.benchmarks:
+        bench_records(args.lsps)
+    if 'ted' in args.benchmarks:
+        bench_ted(args.lsps)
+    if 'cspf' in args.benchmarks:
+        bench_cspf(args.nodes)
+    if 'pathcache' in args.benchmarks:
+        bench_path_cache(args.nodes)
+    if 'batch' in args.benchmarks:
+        bench_batch(args.nodes)
+    if 'reopt' in args.benchmarks:
+        bench_reopt(args.lsps, args.nodes)
+    if 'linkstate' in args.benchmarks:
+        bench_link_state(args.lsps)
+    if 'journal' in args.benchmarks:
+        bench_journal(args.lsps)
+    if 'sync' in args.benchmarks:
+        bench_sync(args.lsps)
+    if 'reports' in args.benchmarks:
+        bench_reports(args.lsps)
+    if 'metrics' in args.benchmarks:
+        bench_metrics(args.lsps)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,156 +1,447 @@
-import socket
-import mpls_lsp_pb2
 import struct
+import hashlib
+import logging
+import pcep
+import lsp_store
+import ted
+import cspf
+import path_cache
+import link_state
+
+log = logging.getLogger(__name__)
+#per-pcc tracing, enabled with TEController.set_trace
+trace_log = logging.getLogger(__name__ + '.trace')
+
+#lengths of raw ERO and RRO (-1 if there is none) for path_key
+_path_lengths = struct.Struct('!ii')
+if hasattr(hashlib, 'blake2b'):
+    def _path_digest():
+        return hashlib.blake2b(digest_size=16)
+else:
+    #python 2
+    _path_digest = hashlib.md5
+
+def path_key(ero, rro):
+    """
+    16 bytes digest of raw ERO and RRO subobjects, kept in LSPRecord to
+    recognize unchanged path of the next report. digest (not the bytes)
+    to keep the records small, lengths are hashed too
+    """
+    digest = _path_digest()
+    digest.update(_path_lengths.pack(-1 if ero is None else len(ero.raw),
+                                     -1 if rro is None else len(rro.raw)))
+    if ero is not None:
+        digest.update(ero.raw)
+    if rro is not None:
+        digest.update(rro.raw)
+    return digest.digest()
 
 class TEController(object):
-    def __init__(self):
-        self.lsp_dict = dict()
+    def __init__(self, path_cache_size=10000, with_link_state=False):
+        self.lsp_dict = lsp_store.LSPStore()
+        self.ted = ted.TED()
+        self.cspf = cspf.CSPF(self.ted)
+        self.path_cache = path_cache.PathCache(self.ted, path_cache_size)
+        #per priority link accounting for what-if analysis, needs numpy
+        self.link_state = None
+        if with_link_state:
+            self.link_state = link_state.LinkState(self.ted)
+            self.ted.lsp_listeners.append(self.link_state)
+        self._traced_pccs = set()
+        #peer (ip, port) of sessions in initial state sync ->
+        #plsp_id -> reported lsp
+        self._syncs = dict()
+
+    def set_trace(self, pcc_ip, enabled):
+        if enabled:
+            self._traced_pccs.add(pcc_ip)
+        else:
+            self._traced_pccs.discard(pcc_ip)
 
     def ip2int(self, addr):
-        return struct.unpack_from("!I", socket.inet_aton(addr))[0]
+        return lsp_store.ip2int(addr)
     def int2ip(self, addr):
-        return socket.inet_ntoa(struct.pack("!I", addr)) 
+        return lsp_store.int2ip(addr)
 
     def handle_pce_message(self, pcc_ip, message):
         if message[0] == 'state_report':
             result = self.handle_state_report_od(pcc_ip, message)
             return result
+        if message[0] == 'pcreq':
+            return self.handle_pcreq(pcc_ip, message)
         return (None,)
-    def handle_state_report(self, pcc_ip, message):
-        lsp = mpls_lsp_pb2.LSP()
-        first_lsp = 1
-        for report_object in message[1]:
-            if report_object[0] == 'lsp_obj':
-                if first_lsp != 1:
-                    lsp_dict_index = (self.ip2int(pcc_ip[0]),lsp.lsp_obj.plsp_id)
-                    new_lsp = mpls_lsp_pb2.LSP()
-                    new_lsp.CopyFrom(lsp)
-                    self.lsp_dict[lsp_dict_index] = new_lsp
+
+    def pcreq_requests(self, message):
+        """
+        requests of parsed PCReq (see PCEP.parse_pcreq_msg), as list of
+        dicts: rp, endpoints, bw, lspa, metric (list). objects are turned
+        into tuples, the form encoders and path cache keys are using
+        """
+        requests = list()
+        for req_objects in message[1][1]:
+            request = {'rp':req_objects[0].astuple(), 'endpoints':None,
+                       'bw':0, 'lspa':None, 'metric':list()}
+            for req_object in req_objects[1:]:
+                oc = req_object.oc
+                if oc == pcep.OC_ENDPOINTS:
+                    if req_object.src is not None:
+                        request['endpoints'] = (req_object.src,
+                                                req_object.dst)
+                elif oc == pcep.OC_BW:
+                    #first one is requested bw, one after RRO is existing lsp's
+                    if not request['bw']:
+                        request['bw'] = req_object.bandwidth
+                elif oc == pcep.OC_LSPA:
+                    request['lspa'] = req_object.astuple()
+                elif oc == pcep.OC_METRIC:
+                    request['metric'].append(req_object.astuple())
+            requests.append(request)
+        return requests
+
+    def compute_request(self, request):
+        """
+        reply objects for one request: RP and ERO, or RP and NO-PATH.
+        everything after RP comes from path cache if it is still valid
+        """
+        key = self.path_cache.request_key(request)
+        objects = self.path_cache.get(key)
+        if objects is None:
+            objects, links = self.compute_path_objects(request)
+            self.path_cache.put(key, objects, links)
+        reply = [('rp',request['rp'])]
+        reply.extend(objects)
+        return reply
+
+    def compute_requests(self, requests, svecs=()):
+        """
+        computes the whole batch of requests in one pass, returns list of
+        replies in the same order as requests.
+        requests which are not in path cache are grouped by
+        (source, bandwidth) and each group with more than one request is
+        answered from one shortest path tree, so the cost depends on the
+        number of distinct headends, not on the number of requests.
+        requests of diverse SVEC sets are computed separately, see
+        compute_diverse
+        """
+        replies = [None] * len(requests)
+        index_by_id = dict()
+        for index, request in enumerate(requests):
+            index_by_id[request['rp'][0]] = index
+        for svec in svecs:
+            if not (svec.link_diverse or svec.node_diverse or
+                    svec.srlg_diverse):
+                #only synchronization, any batch is synchronized
+                continue
+            indexes = [index_by_id[req_id] for req_id in svec.req_ids
+                       if req_id in index_by_id and
+                       replies[index_by_id[req_id]] is None]
+            self.compute_diverse(requests, indexes, replies,
+                                 node_diverse=svec.node_diverse)
+        groups = dict()
+        for index, request in enumerate(requests):
+            if replies[index] is not None:
+                continue
+            key = self.path_cache.request_key(request)
+            objects = self.path_cache.get(key)
+            if objects is not None:
+                replies[index] = [('rp',request['rp'])] + objects
+            elif request['endpoints'] is None:
+                replies[index] = [('rp',request['rp'])] + (
+                    self.path_objects(request, None)[0])
+            else:
+                group_key = (request['endpoints'][0], request['bw'])
+                groups.setdefault(group_key, list()).append((index, key))
+        for (src, bandwidth), group in groups.items():
+            tree = None
+            if len(group) > 1:
+                tree = self.cspf.shortest_path_tree(src, bandwidth)
+            for index, key in group:
+                request = requests[index]
+                if tree is None:
+                    path = self.cspf.shortest_path(src,
+                                                   request['endpoints'][1],
+                                                   bandwidth)
                 else:
-                    first_lsp = 0
-                lsp.Clear()
-                lsp.pcc_ip = pcc_ip[0]
-                lsp.lsp_obj.plsp_id = report_object[1][0]
-                lsp.lsp_obj.delegated = report_object[1][1]
-                lsp.lsp_obj.administrative = report_object[1][4]
-                lsp.lsp_obj.operational = report_object[1][5]
-            if report_object[0] == 'bw':
-                lsp.bandwidth = report_object[1][0]
-            if report_object[0] == 'lspa':
-                lsp.lspa_obj.setup_prio = report_object[1][0]
-                lsp.lspa_obj.hold_prio = report_object[1][1]
-                lsp.lspa_obj.local_protection = report_object[1][2]
-            if report_object[0] == 'ero':
-                if len(report_object[1]) > 0:
-                    for ero_node in report_object[1]:
-                        ero = lsp.ero.add()
-                        ero.loose = ero_node[1]
-                        ero.node_ip = self.int2ip(ero_node[2][2])
-                        ero.node_mask = ero_node[2][3]
-            if report_object[0] == 'rro':
-                if len(report_object[1]) > 0:
-                    for rro_node in report_object[1]:
-                        rro = lsp.rro.add()
-                        rro.node_ip = self.int2ip(rro_node[1][2])
-                        rro.node_mask = rro_node[1][3]
-        lsp_dict_index = (self.ip2int(pcc_ip[0]),lsp.lsp_obj.plsp_id)
-        self.lsp_dict[lsp_dict_index] = lsp
-        delegated_lsps = list()
-        for key in self.lsp_dict:
-            lsp = self.lsp_dict[key]
-            if lsp.lsp_obj.delegated:
-                delegated_lsps.append(lsp)
-            print(lsp)
-        if len(delegated_lsps) > 0:
-            resp = list()
-            for lsp in delegated_lsps:
-                resp.extend(self.generate_lsp_upd_msg(lsp))
-            print(resp)
-            return ('lsp_upd',resp)
+                    path = self.cspf.tree_path(tree, request['endpoints'][1])
+                objects, links = self.path_objects(request, path)
+                self.path_cache.put(key, objects, links)
+                replies[index] = [('rp',request['rp'])] + objects
+        return replies
+
+    def compute_diverse(self, requests, indexes, replies, node_diverse=0):
+        """
+        greedy diverse paths for one SVEC set: requests are computed one by
+        one and links (both directions) of already computed paths are
+        excluded for the next ones; with node_diverse all links of their
+        transit nodes. TED doesnt know SRLGs, so SRLG diversity is treated
+        as link diversity. results depend on the other requests of the
+        set, so path cache is not used
+        """
+        excluded = set()
+        for index in indexes:
+            request = requests[index]
+            objects, links = self.compute_path_objects(request, excluded)
+            replies[index] = [('rp',request['rp'])] + objects
+            for link in links:
+                excluded.add(link)
+                reverse = self.ted.adj[self.ted.link_dst[link]].get(
+                    self.ted.link_src[link])
+                if reverse is not None:
+                    excluded.add(reverse)
+            if node_diverse:
+                excluded.update(self.cspf.node_links(links))
+
+    def compute_path_objects(self, request, excluded=None):
+        """runs CSPF, returns (reply objects w/o RP, links of the path)"""
+        path = None
+        if request['endpoints'] is not None:
+            src, dst = request['endpoints']
+            path = self.cspf.shortest_path(src, dst, request['bw'], excluded)
+        return self.path_objects(request, path)
+
+    def path_objects(self, request, path):
+        """
+        (reply objects w/o RP, links of the path) for the path computed by
+        CSPF, path is (cost, links) or None
+        """
+        if path is not None:
+            for metric_type, bound, computed, value in request['metric']:
+                if bound and path[0] > value:
+                    path = None
+                    break
+        if path is None:
+            return [('nopath',(0,0))], ()
+        objects = [('ero',self.cspf.ero(path[1]))]
+        if request['bw']:
+            objects.append(('bw',(request['bw'],)))
+        for metric_type, bound, computed, value in request['metric']:
+            if computed:
+                objects.append(('metric',(metric_type,0,0,path[0])))
+        return objects, path[1]
+
+    def handle_pcreq(self, pcc_ip, message):
+        """
+        computes paths for all the requests of PCReq with CSPF over TED,
+        all replies are going back in one PCRep
+        """
+        resp = list()
+        for reply in self.compute_requests(self.pcreq_requests(message),
+                                           message[1][0]):
+            resp.extend(reply)
+        if pcc_ip[0] in self._traced_pccs:
+            trace_log.debug('%s: pcrep: %s', pcc_ip[0], resp)
+        if len(resp) > 0:
+            return ('pcrep',resp)
         return (None,)
 
+    def report_to_lsps(self, pcc, message):
+        """
+        builds LSPRecords out of parsed state report. returns list of
+        reported lsps, set of plsp_ids with R flag and set of plsp_ids with
+        S (SYNC) flag. objects are dispatched on Object-Class, hops are set
+        by set_lsp_path (the last ERO/RRO of the lsp)
+        """
+        reported_lsps = list()
+        removed_lsps = set()
+        synced_lsps = set()
+        lsp = None
+        #[lsp, ero, rro]
+        paths = list()
+        for report_object in message[1]:
+            oc = report_object.oc
+            if oc == pcep.OC_LSP:
+                plsp_id = report_object.plsp_id
+                lsp = lsp_store.LSPRecord(pcc, plsp_id)
+                reported_lsps.append(lsp)
+                path = [lsp, None, None]
+                paths.append(path)
+                if report_object.sync:
+                    synced_lsps.add(plsp_id)
+                if report_object.remove:
+                    removed_lsps.add(plsp_id)
+                lsp.delegated = report_object.delegated
+                lsp.administrative = report_object.administrative
+                lsp.operational = report_object.operational
+            elif lsp is None:
+                #objects before first lsp object (e.g. SRP) are not ours
+                continue
+            elif oc == pcep.OC_ERO:
+                path[1] = report_object
+            elif oc == pcep.OC_RRO:
+                path[2] = report_object
+            elif oc == pcep.OC_BW:
+                lsp.bandwidth = report_object.bandwidth
+            elif oc == pcep.OC_LSPA:
+                lsp.setup_prio = report_object.setup_prio
+                lsp.hold_prio = report_object.hold_prio
+                lsp.local_protection = report_object.local_protection
+        for lsp, ero, rro in paths:
+            self.set_lsp_path(lsp, ero, rro)
+        return reported_lsps, removed_lsps, synced_lsps
+
+    def set_lsp_path(self, lsp, ero, rro):
+        """
+        hops of reported lsp. most reports are repeating unchanged path, so
+        digest of raw ERO/RRO is kept and if the stored version of the lsp
+        has the same path_key its hop arrays are taken as they are, w/o
+        decoding. ERO and RRO are views into the msg, so it has to be done
+        while handling it
+        """
+        lsp.path_key = path_key(ero, rro)
+        old_lsp = self.lsp_dict.get(lsp.key())
+        if old_lsp is not None and old_lsp.path_key == lsp.path_key:
+            lsp.ero = old_lsp.ero
+            lsp.rro = old_lsp.rro
+            return
+        if ero is not None:
+            lsp.ero = ero.hops
+        if rro is not None:
+            lsp.rro = rro.hops
+
+    def handle_state_report(self, pcc_ip, message):
+        reported_lsps, removed_lsps, synced_lsps = self.report_to_lsps(
+            self.ip2int(pcc_ip[0]), message)
+        return self.update_reported_lsps(pcc_ip, reported_lsps,
+                                         self.generate_lsp_upd_msg,
+                                         removed_lsps, synced_lsps)
+
     def generate_lsp_upd_msg(self,lsp):
         upd_msg = list()
-        upd_msg.append(('lsp_obj',(lsp.lsp_obj.plsp_id,lsp.lsp_obj.delegated,0,0,
-                                   lsp.lsp_obj.administrative,
-                                   lsp.lsp_obj.operational)))
+        upd_msg.append(('lsp_obj',(lsp.plsp_id,lsp.delegated,0,0,
+                                   lsp.administrative,
+                                   lsp.operational)))
         if lsp.ero:
-            ero_list = list()
-            for ero in lsp.ero:
-                ero_list.append((ero.loose,self.ip2int(ero.node_ip),
-                                 ero.node_mask))
-            upd_msg.append(('ero',ero_list))
+            upd_msg.append(('ero',lsp.ero_hops()))
         else:
             upd_msg.append(('ero',((0,0,0),)))
-        upd_msg.append(('lspa',(lsp.lspa_obj.setup_prio,lsp.lspa_obj.hold_prio,
-                                lsp.lspa_obj.local_protection)))
+        upd_msg.append(('lspa',(lsp.setup_prio,lsp.hold_prio,
+                                lsp.local_protection)))
         return upd_msg
 
     def handle_state_report_od(self, pcc_ip, message):
-        lsp = mpls_lsp_pb2.LSP()
-        first_lsp = 1
-        for report_object in message[1]:
-            if report_object[0] == 'lsp_obj':
-                if first_lsp != 1:
-                    lsp_dict_index = (self.ip2int(pcc_ip[0]),lsp.lsp_obj.plsp_id)
-                    new_lsp = mpls_lsp_pb2.LSP()
-                    new_lsp.CopyFrom(lsp)
-                    self.lsp_dict[lsp_dict_index] = new_lsp
-                else:
-                    first_lsp = 0
-                lsp.Clear()
-                lsp.pcc_ip = pcc_ip[0]
-                lsp.lsp_obj.plsp_id = report_object[1][0]
-                lsp.lsp_obj.delegated = report_object[1][1]
-                lsp.lsp_obj.operational = report_object[1][3]
-            if report_object[0] == 'bw':
-                lsp.bandwidth = report_object[1][0]
-            if report_object[0] == 'lspa':
-                lsp.lspa_obj.setup_prio = report_object[1][0]
-                lsp.lspa_obj.hold_prio = report_object[1][1]
-                lsp.lspa_obj.local_protection = report_object[1][2]
-            if report_object[0] == 'ero':
-                if len(report_object[1]) > 0:
-                    for ero_node in report_object[1]:
-                        ero = lsp.ero.add()
-                        ero.loose = ero_node[1]
-                        ero.node_ip = self.int2ip(ero_node[2][2])
-                        ero.node_mask = ero_node[2][3]
-            if report_object[0] == 'rro':
-                if len(report_object[1]) > 0:
-                    for rro_node in report_object[1]:
-                        rro = lsp.rro.add()
-                        rro.node_ip = self.int2ip(rro_node[1][2])
-                        rro.node_mask = rro_node[1][3]
-        lsp_dict_index = (self.ip2int(pcc_ip[0]),lsp.lsp_obj.plsp_id)
-        self.lsp_dict[lsp_dict_index] = lsp
-        delegated_lsps = list()
-        for key in self.lsp_dict:
-            lsp = self.lsp_dict[key]
-            if lsp.lsp_obj.delegated:
-                delegated_lsps.append(lsp)
-            print(lsp)
-        if len(delegated_lsps) > 0:
-            resp = list()
-            for lsp in delegated_lsps:
-                resp.extend(self.generate_lsp_upd_msg_od(lsp))
-            print(resp)
-            return ('lsp_upd',resp)
+        reported_lsps, removed_lsps, synced_lsps = self.report_to_lsps(
+            self.ip2int(pcc_ip[0]), message)
+        return self.update_reported_lsps(pcc_ip, reported_lsps,
+                                         self.generate_lsp_upd_msg_od,
+                                         removed_lsps, synced_lsps)
+
+    def update_reported_lsps(self, pcc_ip, reported_lsps, generate_upd,
+                             removed_lsps=(), synced_lsps=()):
+        """
+        stores reported lsps and generates updates only for delegated lsps
+        which are new or changed since the last report. all of them are
+        owned by the reporting pcc, so updates are going back only to it
+        and cost of the report doesnt depend on the size of lsp_dict.
+        lsps with R flag (plsp_ids in removed_lsps) are deleted.
+        reports of initial state sync (S flag, synced_lsps) go to
+        sync_reported_lsps instead
+        """
+        if synced_lsps or pcc_ip in self._syncs or [
+                lsp for lsp in reported_lsps if lsp.plsp_id == 0]:
+            return self.sync_reported_lsps(pcc_ip, reported_lsps,
+                                           generate_upd, removed_lsps)
+        traced = pcc_ip[0] in self._traced_pccs
+        pcc = self.ip2int(pcc_ip[0])
+        resp = list()
+        for lsp in reported_lsps:
+            lsp_dict_index = (pcc,lsp.plsp_id)
+            if lsp.plsp_id in removed_lsps:
+                self.lsp_dict.delete(lsp_dict_index)
+                self.ted.remove_lsp(lsp_dict_index)
+                continue
+            old_lsp = self.lsp_dict.update(lsp_dict_index, lsp)
+            self.ted.update_lsp(lsp_dict_index, lsp)
+            if traced:
+                trace_log.debug('%s: reported lsp: %s', pcc_ip[0], lsp)
+            if lsp.delegated and lsp != old_lsp:
+                resp.append(generate_upd(lsp))
+        if len(resp) > 0:
+            if traced:
+                trace_log.debug('%s: lsp updates: %s', pcc_ip[0], resp)
+            return ('lsp_upd_list',resp)
+        return (None,)
+
+    def remove_pcc(self, pcc_ip):
+        """
+        drops all lsps of the pcc with their TED reservations (e.g. its
+        session is dead), returns number of removed lsps
+        """
+        removed = self.lsp_dict.delete_pcc(self.ip2int(pcc_ip))
+        for lsp in removed:
+            self.ted.remove_lsp(lsp.key())
+        return len(removed)
+
+    def sync_reported_lsps(self, pcc_ip, reported_lsps, generate_upd,
+                           removed_lsps=()):
+        """
+        initial state sync of the session: reports are only collected, w/o
+        touching lsp_dict/TED or generating updates, till end of sync
+        marker (lsp with plsp_id 0), then finish_sync does it all at once.
+        whole msg is collected first, lsps after the marker are not lost
+        """
+        synced = self._syncs.get(pcc_ip)
+        if synced is None:
+            synced = self._syncs[pcc_ip] = dict()
+        end_of_sync = False
+        for lsp in reported_lsps:
+            if lsp.plsp_id == 0:
+                end_of_sync = True
+            elif lsp.plsp_id in removed_lsps:
+                synced.pop(lsp.plsp_id, None)
+            else:
+                synced[lsp.plsp_id] = lsp
+        if end_of_sync:
+            return self.finish_sync(pcc_ip, generate_upd)
         return (None,)
 
+    def finish_sync(self, pcc_ip, generate_upd):
+        """
+        end of state sync: lsps of the pcc we know about, but it didnt
+        report (e.g. restored from journal) are deleted, new or changed
+        ones are stored and accounted in TED in one batch and updates are
+        generated for delegated ones, all in one pass. lsps we already have
+        in the same state are not touched at all (no lsp_dict listeners,
+        journal or TED work), so reconnect after restart is cheap
+        """
+        pcc = self.ip2int(pcc_ip[0])
+        synced = self._syncs.pop(pcc_ip, None) or dict()
+        stale = [lsp.key() for lsp in self.lsp_dict.lsps_by_pcc(pcc)
+                 if lsp.plsp_id not in synced]
+        for key in stale:
+            self.lsp_dict.delete(key)
+            self.ted.remove_lsp(key)
+        resp = list()
+        stored = list()
+        lsp_dict = self.lsp_dict
+        for plsp_id, lsp in synced.items():
+            key = (pcc, plsp_id)
+            if lsp == lsp_dict.get(key):
+                continue
+            lsp_dict.update(key, lsp)
+            stored.append((key, lsp))
+            if lsp.delegated:
+                resp.append(generate_upd(lsp))
+        self.ted.update_lsps(stored)
+        log.info('%s: state synchronized, %s lsps, %s changed, %s stale '
+                 'deleted, %s updates', pcc_ip[0], len(synced), len(stored),
+                 len(stale), len(resp))
+        if resp:
+            return ('lsp_upd_list', resp)
+        return (None,)
+
+    def session_closed(self, pcc_ip):
+        """drops unfinished state sync of the session"""
+        self._syncs.pop(pcc_ip, None)
+
     def generate_lsp_upd_msg_od(self,lsp):
         upd_msg = list()
-        upd_msg.append(('lsp_obj',(lsp.lsp_obj.plsp_id,lsp.lsp_obj.delegated,0,
-                                   lsp.lsp_obj.operational,0)))
+        upd_msg.append(('lsp_obj',(lsp.plsp_id,lsp.delegated,0,
+                                   lsp.operational,0)))
         if lsp.ero:
-            ero_list = list()
-            for ero in lsp.ero:
-                ero_list.append((ero.loose,self.ip2int(ero.node_ip),
-                                 ero.node_mask))
-            upd_msg.append(('ero',ero_list))
+            upd_msg.append(('ero',lsp.ero_hops()))
         else:
             upd_msg.append(('ero',((0,0,0),)))
-        upd_msg.append(('lspa',(lsp.lspa_obj.setup_prio,lsp.lspa_obj.hold_prio,
-                                lsp.lspa_obj.local_protection)))
+        upd_msg.append(('lspa',(lsp.setup_prio,lsp.hold_prio,
+                                lsp.local_protection)))
         upd_msg.append(('bw',(lsp.bandwidth,)))
         return upd_msg
@@ -0,0 +1,255 @@
+from array import array
+
+
+class TED(object):
+    """
+    Traffic Engineering Database, learned from paths of reported lsps
+    (rro if we have it, ero otherwise; headend is the pcc itself).
+
+    nodes are ipv4 addresses (as ints) interned into dense indexes.
+    adjacency is a list (by node index) of dicts: neighbour index -> link id,
+    so neighbour lookup is O(1) and iteration over neighbours is cheap.
+    links are directed and described by parallel arrays indexed by link id:
+        link_src, link_dst - node indexes
+        capacity, reserved - bandwidth in the same units as BANDWIDTH object
+        metric - te metric, 1 by default (hop count)
+        link_lsps - number of lsps going through the link
+        link_version - incremented when residual bandwidth of the link
+            goes down (more reserved or less capacity)
+    links we have seen once are kept even when no lsp is using them anymore,
+    it is still our knowledge about topology.
+
+    generation is incremented on every change which could make some path
+    better or feasible (new node/link, released bandwidth, more capacity).
+    topology_version is incremented only when nodes, links or metrics change
+
+    lsp_listeners are notified about accounted lsps (e.g. link_state):
+        update_lsp(key, links, bandwidth, hold priority), remove_lsp(key),
+        clear()
+    and optionally update_lsps(list of update_lsp args) for bulk updates
+    """
+    def __init__(self, default_capacity=float('inf'), default_metric=1):
+        self.default_capacity = default_capacity
+        self.default_metric = default_metric
+        self.generation = 0
+        self.topology_version = 0
+        self.lsp_listeners = list()
+        self.clear()
+
+    def clear(self):
+        self.nodes = array('I')
+        self.adj = list()
+        self._node_index = dict()
+        self.link_src = array('I')
+        self.link_dst = array('I')
+        self.capacity = array('d')
+        self.reserved = array('d')
+        self.metric = array('I')
+        self.link_lsps = array('I')
+        self.link_version = array('I')
+        #lsp key -> (tuple of link ids, reserved bandwidth, hold priority,
+        #hops array the links were computed from). priority isnt used here,
+        #but listeners (per priority accounting) have to see its changes
+        self._lsp_links = dict()
+        self.generation += 1
+        self.topology_version += 1
+        for listener in self.lsp_listeners:
+            listener.clear()
+
+    def node_count(self):
+        return len(self.nodes)
+
+    def link_count(self):
+        return len(self.link_src)
+
+    def node_index(self, addr):
+        """index of the node, None if we never saw it"""
+        return self._node_index.get(addr)
+
+    def add_node(self, addr):
+        index = self._node_index.get(addr)
+        if index is None:
+            index = len(self.nodes)
+            self._node_index[addr] = index
+            self.nodes.append(addr)
+            self.adj.append(dict())
+            self.generation += 1
+            self.topology_version += 1
+        return index
+
+    def add_link(self, src, dst, capacity=None, metric=None):
+        """src and dst are node addresses, returns link id"""
+        src_index = self.add_node(src)
+        dst_index = self.add_node(dst)
+        return self._add_link(src_index, dst_index, capacity, metric)
+
+    def _add_link(self, src_index, dst_index, capacity=None, metric=None):
+        link = self.adj[src_index].get(dst_index)
+        if link is not None:
+            return link
+        link = len(self.link_src)
+        self.adj[src_index][dst_index] = link
+        self.link_src.append(src_index)
+        self.link_dst.append(dst_index)
+        self.capacity.append(self.default_capacity if capacity is None
+                             else capacity)
+        self.reserved.append(0.0)
+        self.metric.append(self.default_metric if metric is None else metric)
+        self.link_lsps.append(0)
+        self.link_version.append(0)
+        self.generation += 1
+        self.topology_version += 1
+        return link
+
+    def link(self, src, dst):
+        """link id between two node addresses, None if there is no such link"""
+        src_index = self._node_index.get(src)
+        dst_index = self._node_index.get(dst)
+        if src_index is None or dst_index is None:
+            return None
+        return self.adj[src_index].get(dst_index)
+
+    def set_link_capacity(self, src, dst, capacity):
+        link = self.add_link(src, dst)
+        if capacity > self.capacity[link]:
+            self.generation += 1
+        elif capacity < self.capacity[link]:
+            self.link_version[link] += 1
+        self.capacity[link] = capacity
+        return link
+
+    def set_link_metric(self, src, dst, metric):
+        link = self.add_link(src, dst)
+        self.metric[link] = metric
+        self.generation += 1
+        self.topology_version += 1
+        return link
+
+    def residual(self, link):
+        return self.capacity[link] - self.reserved[link]
+
+    def lsp_nodes(self, lsp):
+        """addresses of the nodes lsp goes through, starting from headend"""
+        nodes = [lsp.pcc]
+        for addr in lsp.path():
+            if addr != nodes[-1]:
+                nodes.append(addr)
+        return nodes
+
+    def path_links(self, nodes):
+        """link ids along the list of node addresses, adding missing ones"""
+        indexes = [self.add_node(addr) for addr in nodes]
+        return tuple([self._add_link(indexes[i], indexes[i+1])
+                      for i in range(len(indexes)-1)])
+
+    def lsp_links(self, key):
+        """
+        links and bandwidth (and hold priority, hops) accounted for lsp,
+        (None, 0, 0, None) if it's unknown
+        """
+        return self._lsp_links.get(key, (None, 0, 0, None))
+
+    def update_lsp(self, key, lsp):
+        """
+        accounts lsp path and bandwidth. if lsp moved or changed bandwidth,
+        old reservation is released first. returns True if anything changed
+        """
+        links = self._account(key, lsp)
+        if links is None:
+            return False
+        for listener in self.lsp_listeners:
+            listener.update_lsp(key, links, lsp.bandwidth, lsp.hold_prio)
+        return True
+
+    def update_lsps(self, lsps):
+        """
+        update_lsp for many (key, lsp) pairs at once (e.g. end of state
+        sync), listeners with update_lsps get them in one batch. returns
+        number of changed lsps
+        """
+        changed = list()
+        for key, lsp in lsps:
+            links = self._account(key, lsp)
+            if links is not None:
+                changed.append((key, links, lsp.bandwidth, lsp.hold_prio))
+        if not changed:
+            return 0
+        for listener in self.lsp_listeners:
+            update_lsps = getattr(listener, 'update_lsps', None)
+            if update_lsps is not None:
+                update_lsps(changed)
+                continue
+            for args in changed:
+                listener.update_lsp(*args)
+        return len(changed)
+
+    def _account(self, key, lsp):
+        """reservation of lsp, links or None if nothing changed"""
+        hops = lsp.rro if lsp.rro else lsp.ero
+        bandwidth = lsp.bandwidth
+        priority = lsp.hold_prio
+        old = self._lsp_links.get(key)
+        if (old is not None and old[1] == bandwidth and old[2] == priority
+                and (old[3] is hops or old[3] == hops)):
+            #the same path, w/o walking it hop by hop
+            return None
+        links = self.path_links(self.lsp_nodes(lsp))
+        if old is not None:
+            if old[0] == links and old[1] == bandwidth:
+                self._lsp_links[key] = (links, bandwidth, priority, hops)
+                if old[2] == priority:
+                    return None
+                #only priority changed, nothing to do with our totals
+                return links
+            self._release(old[0], old[1])
+        self._lsp_links[key] = (links, bandwidth, priority, hops)
+        reserved = self.reserved
+        link_lsps = self.link_lsps
+        link_version = self.link_version
+        for link in links:
+            reserved[link] += bandwidth
+            link_lsps[link] += 1
+            if bandwidth:
+                link_version[link] += 1
+        return links
+
+    def remove_lsp(self, key):
+        old = self._lsp_links.pop(key, None)
+        if old is None:
+            return False
+        self._release(old[0], old[1])
+        for listener in self.lsp_listeners:
+            listener.remove_lsp(key)
+        return True
+
+    def _release(self, links, bandwidth):
+        reserved = self.reserved
+        link_lsps = self.link_lsps
+        for link in links:
+            reserved[link] -= bandwidth
+            link_lsps[link] -= 1
+        if links and bandwidth:
+            self.generation += 1
+
+    def rebuild(self, lsps):
+        """
+        rebuilds ted from scratch out of (key, lsp) pairs, e.g. from
+        LSPStore.items(). capacities and metrics of known links are kept
+        """
+        capacities = dict()
+        for link in range(len(self.link_src)):
+            capacities[(self.nodes[self.link_src[link]],
+                        self.nodes[self.link_dst[link]])] = (
+                self.capacity[link], self.metric[link])
+        self.clear()
+        for (src, dst), (capacity, metric) in capacities.items():
+            self.add_link(src, dst, capacity, metric)
+        self.update_lsps(lsps)
+
+    def neighbours(self, addr):
+        """list of (neighbour address, link id)"""
+        index = self._node_index.get(addr)
+        if index is None:
+            return []
+        nodes = self.nodes
+        return [(nodes[nbr], link) for nbr, link in self.adj[index].items()]
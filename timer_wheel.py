@@ -0,0 +1,190 @@
+"""
+hierarchical timer wheel for per-session timers (keepalive, DeadTimer).
+
+time is counted in ticks (tick seconds each). level 0 has one slot per
+tick, every next level has slots covering a whole turn of the level
+below it. timer goes to the lowest level which could hold its expiration;
+when lower level turns around, the next slot of the level above is
+cascaded down. so schedule and cancel are O(1) and each tick touches one
+slot (plus occasional cascade), no matter how many sessions we have,
+instead of greenlet/call_later per session.
+
+wheel is not running by itself, advance() must be called at least once
+per tick (run_forever for gevent, see pce_asyncio for asyncio).
+"""
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Timer(object):
+    __slots__ = ('expires', 'callback', 'args', 'slot')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+    def cancel(self):
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+
+
+class TimerWheel(object):
+    def __init__(self, tick=1.0, slot_bits=6, levels=4, clock=time.time):
+        self.tick = float(tick)
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._levels = [[set() for slot in range(1 << slot_bits)]
+                        for level in range(levels)]
+        self._clock = clock
+        self._start = clock()
+        #ticks already processed, timestamps of sessions are in ticks too
+        self.ticks = 0
+        self.stats = {'scheduled': 0, 'fired': 0, 'cascaded': 0}
+
+    def __len__(self):
+        return sum([len(slot) for level in self._levels for slot in level])
+
+    def to_ticks(self, seconds):
+        """seconds as ticks, at least one tick"""
+        return max(1, int(-(-seconds // self.tick)))
+
+    def _place(self, timer):
+        diff = timer.expires - self.ticks
+        level = 0
+        while diff >> (self._bits * (level + 1)) and (
+                level < len(self._levels) - 1):
+            level += 1
+        slot = self._levels[level][
+            (timer.expires >> (self._bits * level)) & self._mask]
+        slot.add(timer)
+        timer.slot = slot
+
+    def schedule_at(self, expires, callback, *args):
+        """callback(*args) when tick expires is processed"""
+        timer = Timer(max(expires, self.ticks + 1), callback, args)
+        self._place(timer)
+        self.stats['scheduled'] += 1
+        return timer
+
+    def schedule(self, delay, callback, *args):
+        """callback(*args) after delay seconds (rounded up to ticks)"""
+        return self.schedule_at(self.ticks + self.to_ticks(delay), callback,
+                                *args)
+
+    def _cascade(self, level):
+        index = (self.ticks >> (self._bits * level)) & self._mask
+        timers = self._levels[level][index]
+        self._levels[level][index] = set()
+        for timer in timers:
+            self._place(timer)
+        self.stats['cascaded'] += len(timers)
+
+    def _tick(self):
+        self.ticks += 1
+        ticks = self.ticks
+        #highest level first, its timers could land in the lower slots
+        #being cascaded at the same tick
+        for level in range(len(self._levels) - 1, 0, -1):
+            if not ticks & ((1 << (self._bits * level)) - 1):
+                self._cascade(level)
+        level0 = self._levels[0]
+        timers = level0[ticks & self._mask]
+        if not timers:
+            return
+        level0[ticks & self._mask] = set()
+        for timer in timers:
+            timer.slot = None
+            self.stats['fired'] += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.exception('timer callback failed')
+
+    def advance(self, now=None):
+        """processes all the ticks till now"""
+        if now is None:
+            now = self._clock()
+        target = int((now - self._start) / self.tick)
+        while self.ticks < target:
+            self._tick()
+
+    def next_tick_in(self):
+        """seconds till the next tick is due"""
+        return max(0.0, self._start + (self.ticks + 1) * self.tick -
+                   self._clock())
+
+    def run_forever(self, sleep):
+        """for gevent: sleep is gevent.sleep"""
+        while True:
+            sleep(self.next_tick_in())
+            self.advance()
+
+
+class SessionTimers(object):
+    """
+    keepalive and DeadTimer of one pcep session. transport calls sent()
+    and received() (tick timestamp, no rescheduling per msg); when the
+    timer fires it checks the timestamp and if there was traffic, timer is
+    just moved to interval after it. so keepalive is sent only if nothing
+    else was sent for keepalive seconds (rfc5440 7.3) and session is
+    expired only if nothing was received for dead_timer seconds.
+    0 disables the timer.
+    """
+    __slots__ = ('_wheel', '_send_ka', '_expire', '_ka_ticks', '_dead_ticks',
+                 '_ka', '_dead', 'last_sent', 'last_rcvd')
+
+    def __init__(self, wheel, keepalive, dead_timer, send_ka, expire):
+        self._wheel = wheel
+        self._send_ka = send_ka
+        self._expire = expire
+        self._ka = self._dead = None
+        self.last_sent = self.last_rcvd = wheel.ticks
+        self._ka_ticks = self._dead_ticks = 0
+        if keepalive:
+            self._ka_ticks = wheel.to_ticks(keepalive)
+            self._ka = wheel.schedule_at(wheel.ticks + self._ka_ticks,
+                                         self._keepalive)
+        if dead_timer:
+            #timestamps are rounded down to tick, so one more tick to
+            #never expire the session too early
+            self._dead_ticks = wheel.to_ticks(dead_timer) + 1
+            self._dead = wheel.schedule_at(wheel.ticks + self._dead_ticks,
+                                           self._dead_timer)
+
+    def sent(self):
+        self.last_sent = self._wheel.ticks
+
+    def received(self):
+        self.last_rcvd = self._wheel.ticks
+
+    def _keepalive(self):
+        wheel = self._wheel
+        if self.last_sent + self._ka_ticks > wheel.ticks:
+            self._ka = wheel.schedule_at(self.last_sent + self._ka_ticks,
+                                         self._keepalive)
+            return
+        self._ka = wheel.schedule_at(wheel.ticks + self._ka_ticks,
+                                     self._keepalive)
+        self.last_sent = wheel.ticks
+        self._send_ka()
+
+    def _dead_timer(self):
+        wheel = self._wheel
+        if self.last_rcvd + self._dead_ticks > wheel.ticks:
+            self._dead = wheel.schedule_at(self.last_rcvd + self._dead_ticks,
+                                           self._dead_timer)
+            return
+        self._dead = None
+        self.cancel()
+        self._expire()
+
+    def cancel(self):
+        for timer in (self._ka, self._dead):
+            if timer is not None:
+                timer.cancel()
+        self._ka = self._dead = None
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+end to end benchmark of controller transports (gevent vs asyncio).
+
+starts pce_controller.py with each transport, opens N pcep sessions (each
+one from its own 127.x.y.z address, so they are different pccs) and sends
+M PCRpts per session, each with new delegated lsp, so every report is
+answered with PCUpd. measures time to bring sessions up and PCRpt->PCUpd
+throughput. client is asyncio, so it needs python 3.7+.
+
+usage: transport_bench.py [--sessions 10,100,1000] [--reports 200]
+                          [--transports gevent,asyncio,workers4]
+
+workersN is asyncio transport in pce_controller.py --workers N mode
+"""
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import pcep
+import pcep_bench
+
+
+def build_report(ctx, plsp_id, hops=4):
+    """PCRpt with one delegated lsp"""
+    path = [0x0a000000 + (plsp_id << 4) + hop for hop in range(hops)]
+    body = b''.join([
+        ctx.generate_lsp_object_od((plsp_id,1,0,1,0))[1],
+        ctx.generate_ero_object([(0, addr, 32) for addr in path])[1],
+        ctx.generate_lspa_object((7,7,0))[1],
+        ctx.generate_bw_object((1000,))[1],
+        pcep_bench.build_rro_object(ctx, path)])
+    return pcep._common_hdr.pack(32, 10, len(body)+4) + body
+
+
+def session_addr(index):
+    return '127.%s.%s.%s' % (1 + index // 62500, index // 250 % 250,
+                             index % 250 + 1)
+
+
+async def read_until(reader, framer, msg_type, count):
+    """reads msgs till count msgs of msg_type, returns number of them"""
+    got = 0
+    while got < count:
+        data = await reader.read(65536)
+        if not data:
+            break
+        for msg in framer.feed(data):
+            if pcep._common_hdr.unpack_from(msg)[1] == msg_type:
+                got += 1
+    return got
+
+
+async def open_session(port, index):
+    ctx = pcep.PCEP()
+    reader, writer = await asyncio.open_connection(
+        '127.0.0.1', port, local_addr=(session_addr(index), 0))
+    framer = pcep.PCEPFramer()
+    writer.write(ctx.generate_open_msg(30))
+    await read_until(reader, framer, 1, 1)
+    return ctx, reader, writer, framer
+
+
+async def run_reports(session, reports):
+    ctx, reader, writer, framer = session
+    writer.write(b''.join([build_report(ctx, plsp_id)
+                           for plsp_id in range(1, reports+1)]))
+    return await read_until(reader, framer, 11, reports)
+
+
+async def run_client(port, sessions, reports):
+    start = time.time()
+    opened = await asyncio.gather(*[open_session(port, index)
+                                    for index in range(sessions)])
+    setup = time.time() - start
+    start = time.time()
+    updates = await asyncio.gather(*[run_reports(session, reports)
+                                     for session in opened])
+    elapsed = time.time() - start
+    for session in opened:
+        session[2].close()
+    return setup, elapsed, sum(updates)
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('controller didnt start on port %s' % (port,))
+
+
+def bench_transport(transport, port, sessions, reports):
+    cmd = [sys.executable, 'pce_controller.py', '--port', str(port),
+           '--log-levels', 'warning']
+    if transport.startswith('workers'):
+        cmd += ['--workers', transport[len('workers'):]]
+    else:
+        cmd += ['--transport', transport]
+    server = subprocess.Popen(cmd)
+    try:
+        wait_for_port(port)
+        setup, elapsed, updates = asyncio.run(
+            run_client(port, sessions, reports))
+    finally:
+        server.terminate()
+        server.wait()
+    print('  %-9s %5s sessions: setup %7.1f ms, %6s PCUpds in %7.1f ms, '
+          '%8.0f msgs/s' % (transport, sessions, setup*1e3, updates,
+                            elapsed*1e3, updates/elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='transport benchmark')
+    parser.add_argument('--sessions', default='10,100,1000')
+    parser.add_argument('--reports', type=int, default=200,
+                        help='PCRpts per session')
+    parser.add_argument('--transports', default='gevent,asyncio')
+    parser.add_argument('--port', type=int, default=14189)
+    args = parser.parse_args()
+    print('transports, %s PCRpts per session' % (args.reports,))
+    for sessions in [int(count) for count in args.sessions.split(',')]:
+        for index, transport in enumerate(args.transports.split(',')):
+            bench_transport(transport, args.port + index, sessions,
+                            args.reports)
+
+
+if __name__ == '__main__':
+    main()